@@ -1,14 +1,50 @@
 from flask import Flask
 from .database import init_db
-from .routes import main
-from .auth_routes import auth
+from .cache import init_cache
+from .metrics import init_metrics
+
+def create_app(config=None):
+    """Build the app; `config` overrides settings before anything is initialised."""
+    # Imported here so tools like build_models.py can use app.artifacts
+    # without importing the serving code
+    from .routes import main
+    from .auth_routes import auth
+    from .api import api, init_api
+    from .ratings import init_ratings
+    from .trainer import init_trainer
+    from .recommender import init_models
+    from .health import health
 
-def create_app():
     app = Flask(__name__, static_folder="../static", template_folder="../templates")
     app.secret_key = "supersecretkey"  # change later
+    app.config.update(config or {})
     init_db(app)
+    init_metrics(app)
+    init_ratings(app)
+    init_cache(app)
+    init_trainer(app)
+    init_api(app)
+    init_models(app)
 
     app.register_blueprint(main)
     app.register_blueprint(auth, url_prefix="/auth")
+    app.register_blueprint(api, url_prefix="/api")
+    app.register_blueprint(health)
 
     return app
+
+
+def reset_after_fork(app):
+    """
+    In a gunicorn worker forked from a master that ran create_app (preload_app): drop
+    the database and cache connections inherited from the master and restart the
+    trainer thread, which did not survive the fork. Loaded models are kept.
+    """
+    from . import cache
+    from .database import db
+    from .trainer import restart_trainer
+
+    with app.app_context():
+        db.engine.dispose(close=False)
+    cache.recs_cache.after_fork()
+    restart_trainer()
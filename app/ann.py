@@ -0,0 +1,174 @@
+# app/ann.py
+"""
+Approximate nearest-neighbour search with an inverted-file (IVF) index.
+
+Vectors are partitioned with spherical k-means. A query scores the centroids, then
+scores exactly only the vectors in its `n_probe` best partitions, so a search touches
+roughly n_probe / n_lists of the catalog. n_probe is the recall/latency dial: probing
+every list gives the exact answer.
+
+Works with dense arrays (CF item factors) and scipy CSR matrices (TF-IDF rows), ranking
+by inner product, which is cosine similarity for L2-normalised rows. The index stores
+only centroids and partition lists; the vectors are passed to `search`, so they can stay
+memory-mapped in their own artifact.
+"""
+import numpy as np
+from scipy import sparse
+
+from .ranking import top_n as rank_top_n
+
+DEFAULT_N_PROBE = 8
+# Below this many rows brute force is as fast and exact, so no index is built
+MIN_ROWS = 2000
+KMEANS_ITERATIONS = 10
+# Rows used to fit the centroids; assignment always covers every row
+KMEANS_SAMPLE_PER_LIST = 64
+
+
+def _dense(matrix):
+    return matrix.toarray() if sparse.issparse(matrix) else np.asarray(matrix)
+
+
+def _normalize(rows):
+    norms = np.linalg.norm(rows, axis=1, keepdims=True)
+    return rows / np.where(norms > 0, norms, 1.0)
+
+
+def _assign(vectors, centroids, block_size=4096):
+    """Index of the most similar centroid for every row, computed in blocks."""
+    assign = np.empty(vectors.shape[0], dtype=np.int32)
+    for start in range(0, vectors.shape[0], block_size):
+        block = _dense(vectors[start:start + block_size] @ centroids.T)
+        assign[start:start + block_size] = np.argmax(block, axis=1)
+    return assign
+
+
+def _kmeans(vectors, n_lists, n_iter, rng):
+    """Spherical k-means: centroids are unit vectors, similarity is the inner product."""
+    n = vectors.shape[0]
+    centroids = _normalize(_dense(vectors[rng.choice(n, n_lists, replace=False)]).astype(np.float32))
+    for _ in range(n_iter):
+        assign = _assign(vectors, centroids)
+        members = sparse.csr_matrix(
+            (np.ones(n, dtype=np.float32), (assign, np.arange(n))), shape=(n_lists, n)
+        )
+        sums = _dense(members @ vectors).astype(np.float32)
+        # Reseed empty partitions from random rows
+        empty = np.flatnonzero(np.asarray(members.sum(axis=1)).ravel() == 0)
+        if len(empty):
+            sums[empty] = _dense(vectors[rng.choice(n, len(empty), replace=False)])
+        centroids = _normalize(sums)
+    return centroids
+
+
+class IVFIndex:
+    def __init__(self, centroids, list_rows, list_offsets, n_probe=DEFAULT_N_PROBE):
+        self.centroids = centroids
+        self.list_rows = list_rows
+        self.list_offsets = list_offsets
+        self.n_probe = n_probe
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, n_probe=DEFAULT_N_PROBE, n_iter=KMEANS_ITERATIONS, seed=0):
+        """Partition `vectors` (N x d, dense or CSR) into n_lists lists (default ~sqrt(N))."""
+        n = vectors.shape[0]
+        n_lists = min(n_lists or max(int(np.sqrt(n)), 1), n)
+        rng = np.random.default_rng(seed)
+        sample_size = min(n, n_lists * KMEANS_SAMPLE_PER_LIST)
+        sample = np.sort(rng.choice(n, sample_size, replace=False))
+        centroids = _kmeans(vectors[sample], n_lists, n_iter, rng)
+        return cls._from_assignment(centroids, _assign(vectors, centroids), n_probe)
+
+    @classmethod
+    def _from_assignment(cls, centroids, assign, n_probe):
+        list_rows = np.argsort(assign, kind="stable").astype(np.int32)
+        list_offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=len(centroids)), out=list_offsets[1:])
+        return cls(centroids, list_rows, list_offsets, n_probe)
+
+    def add(self, vectors, rows):
+        """Return a new index with `rows` of `vectors` assigned to their nearest lists."""
+        rows = np.asarray(rows, dtype=np.int32)
+        assign = np.empty(len(self.list_rows) + len(rows), dtype=np.int32)
+        list_ids = np.repeat(np.arange(self.n_lists, dtype=np.int32), np.diff(self.list_offsets))
+        all_rows = np.concatenate([self.list_rows, rows])
+        assign[:len(self.list_rows)] = list_ids
+        assign[len(self.list_rows):] = _assign(vectors[rows], self.centroids)
+        order = np.argsort(assign, kind="stable")
+        list_offsets = np.zeros(self.n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=self.n_lists), out=list_offsets[1:])
+        return IVFIndex(self.centroids, all_rows[order], list_offsets, self.n_probe)
+
+    def remap(self, row_map):
+        """Return a new index with row r renamed row_map[r]; rows mapped to -1 are dropped."""
+        list_ids = np.repeat(np.arange(self.n_lists, dtype=np.int32), np.diff(self.list_offsets))
+        rows = np.asarray(row_map)[self.list_rows]
+        keep = rows >= 0
+        list_offsets = np.zeros(self.n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(list_ids[keep], minlength=self.n_lists), out=list_offsets[1:])
+        return IVFIndex(self.centroids, rows[keep].astype(np.int32), list_offsets, self.n_probe)
+
+    def search(self, vectors, queries, k, n_probe=None, exclude=None, allowed=None):
+        """
+        Approximate top-k rows of `vectors` by inner product for each query row.
+
+        `exclude` is an optional list (one per query) of row indices to skip, e.g. the
+        query's own row or a user's rated items. `allowed` is an optional boolean mask
+        over all rows (e.g. a genre filter) applied to every query. Returns (indices,
+        scores) of shape (n_queries, k); missing slots are -1 / -inf.
+        """
+        if sparse.issparse(queries):
+            queries = queries.tocsr()
+        else:
+            queries = np.atleast_2d(queries)
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        probes, _ = rank_top_n(_dense(queries @ self.centroids.T), n_probe)
+
+        n_queries = queries.shape[0]
+        indices = np.full((n_queries, k), -1, dtype=np.int64)
+        scores = np.full((n_queries, k), -np.inf, dtype=np.float32)
+        for i in range(n_queries):
+            candidates = np.concatenate([
+                self.list_rows[self.list_offsets[l]:self.list_offsets[l + 1]] for l in probes[i]
+            ])
+            if allowed is not None:
+                candidates = candidates[allowed[candidates]]
+            if exclude is not None and len(exclude[i]):
+                candidates = candidates[~np.isin(candidates, exclude[i])]
+            if len(candidates) == 0:
+                continue
+            candidate_scores = _dense(vectors[candidates] @ queries[i].T).ravel()
+            top, top_scores = rank_top_n(candidate_scores, k)
+            indices[i, :len(top)] = candidates[top]
+            scores[i, :len(top)] = top_scores
+        return indices, scores
+
+    def to_arrays(self, prefix="ann"):
+        """Arrays for app.artifacts.write_artifact."""
+        return {
+            f"{prefix}_centroids": self.centroids,
+            f"{prefix}_list_rows": self.list_rows,
+            f"{prefix}_list_offsets": self.list_offsets,
+        }
+
+    @classmethod
+    def from_artifact(cls, artifact, prefix="ann", n_probe=DEFAULT_N_PROBE):
+        if not artifact.has(f"{prefix}_centroids"):
+            return None
+        return cls(
+            artifact.array(f"{prefix}_centroids"),
+            artifact.array(f"{prefix}_list_rows"),
+            artifact.array(f"{prefix}_list_offsets"),
+            n_probe,
+        )
+
+
+def recall_at_k(approx_indices, exact_indices):
+    """Mean fraction of the exact top-k found by the approximate search."""
+    hits = [len(np.intersect1d(a[a >= 0], e[e >= 0])) / max((e >= 0).sum(), 1)
+            for a, e in zip(approx_indices, exact_indices)]
+    return float(np.mean(hits)) if hits else 0.0
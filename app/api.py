@@ -0,0 +1,158 @@
+# app/api.py
+"""
+JSON API for other services: CBF, CF and hybrid recommendations plus title search.
+
+CBF and CF requests go through a BatchCoalescer (app/batching.py), so concurrent requests
+arriving within API_BATCH_WINDOW seconds are scored with one batched NumPy call. Set
+API_BATCH_WINDOW to 0 to score every request on its own.
+
+    GET /api/search?q=<text>&limit=10
+    GET /api/recommendations/cbf?title=<title>&n=8[&genre=..][&exclude_genre=..]
+    GET /api/recommendations/cf?user_id=<id>&n=10
+    GET /api/recommendations/hybrid?user_id=<id>[&title=<title>]&n=10&alpha=0.5[&method=zscore|rank]
+
+The CF and hybrid endpoints read a user's rating history, so they serve the logged-in
+user only. A service presenting API_TOKEN as a bearer token may ask for any user_id.
+"""
+import hmac
+import os
+
+from flask import Blueprint, current_app, jsonify, request
+from flask_login import current_user
+
+from .batching import DEFAULT_MAX_BATCH, DEFAULT_WINDOW, BatchCoalescer
+from .collaborative import get_cf_model, get_cf_recommendations_batch
+from .genres import normalize_genre
+from .blending import BLEND_METHODS
+from .metrics import stage
+from .hybrid import BLEND_METHOD, get_hybrid_recommendations, get_profile_hybrid_recommendations
+from .recommender import RECORD_COLUMNS, get_cbf_scores_batch, get_popular_recommendations, models, search_titles
+
+api = Blueprint('api', __name__)
+
+MAX_RESULTS = 100
+
+
+def _cbf_batch(key, titles):
+    top_n, include, exclude = key
+    return get_cbf_scores_batch(titles, top_n, include_genres=list(include), exclude_genres=list(exclude))
+
+
+def _cf_batch(key, payloads):
+    top_n, _ = key
+    model = payloads[0][1]
+    return get_cf_recommendations_batch([user_id for user_id, _ in payloads], top_n=top_n, model=model)
+
+
+cbf_batcher = BatchCoalescer(_cbf_batch)
+cf_batcher = BatchCoalescer(_cf_batch)
+
+
+def init_api(app):
+    """Configure the coalescers from API_BATCH_WINDOW (seconds) and API_MAX_BATCH, and the service API_TOKEN."""
+    app.config.setdefault('API_TOKEN', os.environ.get('API_TOKEN'))
+    app.config.setdefault('API_BATCH_WINDOW', DEFAULT_WINDOW)
+    app.config.setdefault('API_MAX_BATCH', DEFAULT_MAX_BATCH)
+    for batcher in (cbf_batcher, cf_batcher):
+        batcher.window = app.config['API_BATCH_WINDOW']
+        batcher.max_batch = app.config['API_MAX_BATCH']
+
+
+def _error(message, status=400):
+    return jsonify({'error': message}), status
+
+
+def _top_n(default):
+    return max(1, min(request.args.get('n', default, type=int), MAX_RESULTS))
+
+
+def _has_service_token():
+    token = current_app.config.get('API_TOKEN')
+    header = request.headers.get('Authorization', '')
+    return bool(token) and header.startswith('Bearer ') and hmac.compare_digest(header[7:], token)
+
+
+def _user_id():
+    """
+    The user whose ratings the request may read, or an error response. Services with the
+    API token choose any user_id; a logged-in user only gets their own.
+    """
+    user_id = request.args.get('user_id', type=int)
+    if _has_service_token():
+        return (user_id, None) if user_id is not None else (None, _error("Missing 'user_id'"))
+    if not current_user.is_authenticated:
+        return None, _error("Login or an API token is required", 401)
+    if user_id is not None and user_id != current_user.id:
+        return None, _error("'user_id' must be the logged-in user", 403)
+    return current_user.id, None
+
+
+def _with_details(scores, score_key='score'):
+    """[(manga_id, score)] -> catalog records with the score attached."""
+    with stage('metadata_join'):
+        details = models.metadata.get_many([manga_id for manga_id, _ in scores], RECORD_COLUMNS)
+    return [
+        {**details[manga_id], score_key: round(float(score), 4)}
+        for manga_id, score in scores if manga_id in details
+    ]
+
+
+@api.route("/search")
+def search():
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 10, type=int), MAX_RESULTS))
+    return jsonify({'query': query, 'results': search_titles(query, limit=limit)})
+
+
+@api.route("/recommendations/cbf")
+def cbf():
+    title = request.args.get('title', '')
+    if not title:
+        return _error("Missing 'title'")
+    key = (
+        _top_n(8),
+        tuple(sorted(map(normalize_genre, request.args.getlist('genre')))),
+        tuple(sorted(map(normalize_genre, request.args.getlist('exclude_genre')))),
+    )
+    if not models.has_similarity:
+        # Degraded (no similarity artifact): the most popular titles, as the pages show
+        popular = get_popular_recommendations(key[0], list(key[1]), list(key[2]))
+        return jsonify({'title': title, 'results': popular, 'fallback': 'popularity'})
+    scores = cbf_batcher.submit(key, title)
+    return jsonify({'title': title, 'results': _with_details(scores)})
+
+
+@api.route("/recommendations/cf")
+def cf():
+    user_id, error = _user_id()
+    if error:
+        return error
+    model = get_cf_model()
+    if model is None:
+        return _error("CF model is not available", 503)
+    top_n = _top_n(10)
+    # Requests pinned to the same model version are batched together
+    scores = cf_batcher.submit((top_n, id(model)), (user_id, model))
+    return jsonify({'user_id': user_id, 'results': _with_details(scores, 'predicted_rating')})
+
+
+@api.route("/recommendations/hybrid")
+def hybrid():
+    user_id, error = _user_id()
+    if error:
+        return error
+    title = request.args.get('title')
+    alpha = min(max(request.args.get('alpha', 0.5, type=float), 0.0), 1.0)
+    method = request.args.get('method', BLEND_METHOD)
+    if method not in BLEND_METHODS:
+        return _error(f"'method' must be one of {', '.join(BLEND_METHODS)}")
+    include = request.args.getlist('genre')
+    exclude = request.args.getlist('exclude_genre')
+    if title:
+        results = get_hybrid_recommendations(user_id, title, alpha=alpha, top_n=_top_n(10),
+                                             include_genres=include, exclude_genres=exclude, method=method)
+    else:
+        results = get_profile_hybrid_recommendations(user_id, alpha=alpha, top_n=_top_n(10),
+                                                     include_genres=include, exclude_genres=exclude,
+                                                     method=method)
+    return jsonify({'user_id': user_id, 'title': title, 'results': results})
@@ -0,0 +1,298 @@
+# app/artifacts.py
+"""
+Versioned on-disk model artifacts.
+
+Layout:
+    <root>/CURRENT                 name of the live version
+    <root>/<version>/manifest.json format, row count, array dtypes/shapes, extra metadata
+    <root>/<version>/<name>.npy    numeric columns and matrices (opened with mmap_mode='r')
+    <root>/<version>/<name>.offsets.npy + <name>.utf8
+                                   string columns: one UTF-8 buffer plus int64 offsets
+    <root>/<version>/<name>.joblib Python objects that cannot be memory-mapped
+
+Every worker that opens the same version maps the same files, so the OS page cache
+holds a single copy of the read-only data no matter how many workers are running.
+"""
+import json
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+import joblib
+import numpy as np
+
+FORMAT_VERSION = 1
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+
+
+class StringColumn:
+    """Read-only column of strings backed by a UTF-8 buffer and an offsets array."""
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        start, stop = self.offsets[row], self.offsets[row + 1]
+        return bytes(self.data[start:stop]).decode("utf-8")
+
+    def take(self, rows):
+        return [self[row] for row in rows]
+
+    def tolist(self):
+        return self.take(range(len(self)))
+
+
+def _encode_strings(values):
+    encoded = [("" if v is None else str(v)).encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, b"".join(encoded)
+
+
+def new_version():
+    """Sortable, unique version id."""
+    return time.strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:8]
+
+
+def write_artifact(root, arrays, strings=None, objects=None, meta=None, version=None):
+    """
+    Write a new artifact version under `root` and make it current.
+
+    arrays:  {name: ndarray}, saved as .npy
+    strings: {name: sequence of str}, saved as offsets + UTF-8 buffer
+    objects: {name: picklable}, saved with joblib
+    meta:    extra JSON-serialisable values stored in the manifest
+
+    The version is written to a temporary directory and renamed into place, then the
+    CURRENT pointer is replaced atomically, so readers never see a partial artifact.
+    Returns the version id.
+    """
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    version = version or new_version()
+    tmp_dir = root / f".tmp-{version}"
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir()
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "version": version,
+        "created": time.time(),
+        "arrays": {},
+        "strings": [],
+        "objects": [],
+        "meta": meta or {},
+    }
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        np.save(tmp_dir / f"{name}.npy", array)
+        manifest["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape)}
+    for name, values in (strings or {}).items():
+        offsets, data = _encode_strings(values)
+        np.save(tmp_dir / f"{name}.offsets.npy", offsets)
+        (tmp_dir / f"{name}.utf8").write_bytes(data)
+        manifest["strings"].append(name)
+    for name, obj in (objects or {}).items():
+        joblib.dump(obj, tmp_dir / f"{name}.joblib")
+        manifest["objects"].append(name)
+
+    (tmp_dir / MANIFEST_FILE).write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp_dir, root / version)
+    set_current(root, version)
+    return version
+
+
+class ArtifactWriter:
+    """
+    Build an artifact version incrementally, for data that does not fit in memory.
+
+    `append()` adds rows to numeric and string columns chunk by chunk; each chunk is
+    written straight to disk. `commit()` finishes the files, writes the manifest and
+    publishes the version exactly like write_artifact.
+
+        with ArtifactWriter(root) as writer:
+            for chunk in chunks:
+                writer.append(arrays={...}, strings={...})
+            writer.commit(meta={...})
+    """
+
+    def __init__(self, root, version=None):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.version = version or new_version()
+        self.tmp_dir = self.root / f".tmp-{self.version}"
+        if self.tmp_dir.exists():
+            shutil.rmtree(self.tmp_dir)
+        self.tmp_dir.mkdir()
+        self.rows = 0
+        self._arrays = {}   # name -> (dtype, trailing shape)
+        self._strings = {}  # name -> bytes written so far
+        self._objects = []
+        self._committed = False
+
+    def _raw(self, name):
+        return self.tmp_dir / f"{name}.raw"
+
+    def append(self, arrays=None, strings=None):
+        """Append one chunk of rows; every column must get the same number of rows."""
+        lengths = {len(v) for v in list((arrays or {}).values()) + list((strings or {}).values())}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns in one chunk have different lengths: {sorted(lengths)}")
+        for name, array in (arrays or {}).items():
+            array = np.ascontiguousarray(array)
+            spec = self._arrays.setdefault(name, (array.dtype, array.shape[1:]))
+            if spec != (array.dtype, array.shape[1:]):
+                raise ValueError(f"Column {name} changed dtype or shape between chunks")
+            with open(self._raw(name), "ab") as f:
+                array.tofile(f)
+        for name, values in (strings or {}).items():
+            offsets, data = _encode_strings(values)
+            start = self._strings.get(name, 0)
+            if name not in self._strings:
+                with open(self._raw(f"{name}.offsets"), "ab") as f:
+                    np.zeros(1, dtype=np.int64).tofile(f)
+            with open(self._raw(f"{name}.offsets"), "ab") as f:
+                (offsets[1:] + start).tofile(f)
+            with open(self.tmp_dir / f"{name}.utf8", "ab") as f:
+                f.write(data)
+            self._strings[name] = start + len(data)
+        self.rows += lengths.pop() if lengths else 0
+
+    def add_object(self, name, obj):
+        joblib.dump(obj, self.tmp_dir / f"{name}.joblib")
+        self._objects.append(name)
+
+    def _finish_array(self, name, dtype, trailing_shape, chunk_rows=1 << 16):
+        """Copy a raw column into a .npy file, a chunk at a time."""
+        raw = self._raw(name)
+        shape = (raw.stat().st_size // (dtype.itemsize * int(np.prod(trailing_shape))),
+                 *trailing_shape)
+        out = np.lib.format.open_memmap(self.tmp_dir / f"{name}.npy", mode="w+", dtype=dtype, shape=shape)
+        source = np.memmap(raw, dtype=dtype, mode="r", shape=shape) if shape[0] else out
+        for start in range(0, shape[0], chunk_rows):
+            out[start:start + chunk_rows] = source[start:start + chunk_rows]
+        out.flush()
+        del out, source
+        raw.unlink()
+        return shape
+
+    def commit(self, meta=None):
+        """Finish every column, publish the version and make it current."""
+        manifest = {
+            "format": FORMAT_VERSION,
+            "version": self.version,
+            "created": time.time(),
+            "arrays": {},
+            "strings": list(self._strings),
+            "objects": self._objects,
+            "meta": meta or {},
+        }
+        for name, (dtype, trailing_shape) in self._arrays.items():
+            shape = self._finish_array(name, dtype, trailing_shape)
+            manifest["arrays"][name] = {"dtype": dtype.str, "shape": list(shape)}
+        for name in self._strings:
+            self._finish_array(f"{name}.offsets", np.dtype(np.int64), ())
+
+        (self.tmp_dir / MANIFEST_FILE).write_text(json.dumps(manifest, indent=2))
+        os.replace(self.tmp_dir, self.root / self.version)
+        set_current(self.root, self.version)
+        self._committed = True
+        return self.version
+
+    def abort(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self._committed:
+            self.abort()
+
+
+def set_current(root, version):
+    """Atomically point CURRENT at `version`."""
+    root = Path(root)
+    tmp = root / f".{CURRENT_FILE}.{uuid.uuid4().hex}"
+    tmp.write_text(version)
+    os.replace(tmp, root / CURRENT_FILE)
+
+
+def current_version(root):
+    """Version id CURRENT points at, or None if nothing has been published."""
+    path = Path(root) / CURRENT_FILE
+    if not path.exists():
+        return None
+    return path.read_text().strip() or None
+
+
+def prune(root, keep=3):
+    """Delete all but the newest `keep` versions (never the current one)."""
+    root = Path(root)
+    current = current_version(root)
+    versions = sorted(p for p in root.iterdir() if p.is_dir() and not p.name.startswith("."))
+    for path in versions[:-keep] if keep else versions:
+        if path.name != current:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class Artifact:
+    """A published artifact version; arrays are memory-mapped on first access."""
+
+    def __init__(self, path, mmap=True):
+        self.path = Path(path)
+        self.manifest = json.loads((self.path / MANIFEST_FILE).read_text())
+        if self.manifest.get("format") != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported artifact format {self.manifest.get('format')} in {self.path}"
+            )
+        self.version = self.manifest["version"]
+        self.meta = self.manifest.get("meta", {})
+        self._mmap_mode = "r" if mmap else None
+        self._cache = {}
+
+    def has(self, name):
+        return (
+            name in self.manifest["arrays"]
+            or name in self.manifest["strings"]
+            or name in self.manifest["objects"]
+        )
+
+    def array(self, name):
+        if name not in self._cache:
+            self._cache[name] = np.load(self.path / f"{name}.npy", mmap_mode=self._mmap_mode)
+        return self._cache[name]
+
+    def strings(self, name):
+        if name not in self._cache:
+            offsets = np.load(self.path / f"{name}.offsets.npy", mmap_mode=self._mmap_mode)
+            data_path = self.path / f"{name}.utf8"
+            if data_path.stat().st_size == 0:
+                data = np.zeros(0, dtype=np.uint8)
+            elif self._mmap_mode:
+                data = np.memmap(data_path, dtype=np.uint8, mode="r")
+            else:
+                data = np.fromfile(data_path, dtype=np.uint8)
+            self._cache[name] = StringColumn(offsets, data)
+        return self._cache[name]
+
+    def load_object(self, name):
+        if name not in self._cache:
+            self._cache[name] = joblib.load(self.path / f"{name}.joblib")
+        return self._cache[name]
+
+
+def open_artifact(root, version=None, mmap=True):
+    """Open `version` (default: CURRENT) under `root`, or return None if there is none."""
+    version = version or current_version(root)
+    if version is None:
+        return None
+    return Artifact(Path(root) / version, mmap=mmap)
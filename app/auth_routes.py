@@ -1,7 +1,9 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from flask_login import login_user, logout_user, current_user, login_required
 from .database import db, bcrypt
 from .models import User
+from .ratings import upsert_ratings
+from .routes import ratings_changed
 
 auth = Blueprint('auth', __name__)
 
@@ -33,28 +35,17 @@ def login():
 
         if user and bcrypt.check_password_hash(user.password_hash, password):
             login_user(user)
-            flash("Logged in successfully!", "success")
-            return redirect(url_for('main.index'))
-        else:
-            flash("Invalid email or password", "error")
-        user = User.query.filter_by(username=request.form.get("username")).first()
-        
-        if user and check_password_hash(user.password, request.form.get("password")):
-            login_user(user)
 
-            # Merge guest ratings if they exist
+            # Merge ratings given as a guest during onboarding, in one statement
             guest_ratings = session.pop('guest_ratings', None)
             if guest_ratings:
-                for manga_id, rating_value in guest_ratings.items():
-                    existing = Rating.query.filter_by(user_id=user.id, manga_id=manga_id).first()
-                    if existing:
-                        existing.rating = rating_value
-                    else:
-                        new_rating = Rating(user_id=user.id, manga_id=manga_id, rating=rating_value)
-                        db.session.add(new_rating)
-                db.session.commit()
+                upsert_ratings(user.id, guest_ratings)
+                ratings_changed(user.id)
 
-            return redirect(url_for("main.index"))
+            flash("Logged in successfully!", "success")
+            return redirect(url_for('main.index'))
+        else:
+            flash("Invalid email or password", "error")
     return render_template("login.html")
 
 @auth.route("/logout")
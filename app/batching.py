@@ -0,0 +1,72 @@
+# app/batching.py
+"""
+Request coalescing: calls that arrive within a short window are scored together.
+
+The first caller for a key becomes the batch leader. It waits up to `window` seconds (or
+until `max_batch` callers have joined), then runs `batch_fn(key, payloads)` once for the
+whole group on its own thread and hands each follower its result. There is no background
+thread, so the batch runs inside a real request with its app context.
+"""
+import threading
+from concurrent.futures import Future
+
+DEFAULT_WINDOW = 0.002  # seconds
+DEFAULT_MAX_BATCH = 64
+
+
+class BatchCoalescer:
+    def __init__(self, batch_fn, window=DEFAULT_WINDOW, max_batch=DEFAULT_MAX_BATCH, timeout=10.0):
+        self.batch_fn = batch_fn
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pending = {}  # key -> {'items': [(payload, future)], 'full': Event}
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, key, payload):
+        """Return batch_fn's result for `payload`, batched with concurrent calls for `key`."""
+        if self.window <= 0:
+            return self._run(key, [(payload, None)])[0]
+
+        future = Future()
+        with self._lock:
+            batch = self._pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._pending[key] = {'items': [], 'full': threading.Event()}
+            batch['items'].append((payload, future))
+            if len(batch['items']) >= self.max_batch:
+                # Later callers start a new batch
+                del self._pending[key]
+                batch['full'].set()
+
+        if leader:
+            batch['full'].wait(self.window)
+            with self._lock:
+                if self._pending.get(key) is batch:
+                    del self._pending[key]
+            try:
+                results = self._run(key, batch['items'])
+            except Exception as e:
+                for _, f in batch['items']:
+                    f.set_exception(e)
+            else:
+                for (_, f), result in zip(batch['items'], results):
+                    f.set_result(result)
+        return future.result(timeout=self.timeout)
+
+    def _run(self, key, items):
+        results = self.batch_fn(key, [payload for payload, _ in items])
+        with self._lock:
+            self.batches += 1
+            self.items += len(items)
+        return results
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+        }
@@ -0,0 +1,60 @@
+# app/blending.py
+"""
+Score blending for the hybrid recommender.
+
+Content similarities (cosine, 0-1) and CF predictions (SVD reconstructions, any scale)
+are not comparable as they are, so each source is normalized over the candidates before
+the weighted sum:
+
+    zscore  (score - mean) / std over the candidates the source scored
+    rank    percentile rank in [0, 1]; only the order within the source matters
+
+Sources are rows of one (n_sources, n_candidates) array aligned over a shared candidate
+array, NaN marking a candidate a source has no score for. Missing entries get the
+source's neutral value, so a title is neither rewarded nor penalised for what one
+model does not know.
+"""
+import numpy as np
+
+BLEND_METHODS = ('zscore', 'rank')
+
+
+def union_candidates(*pools):
+    """Sorted unique manga ids over several candidate pools."""
+    pools = [np.asarray(pool, dtype=np.int64) for pool in pools]
+    return np.unique(np.concatenate(pools)) if pools else np.empty(0, dtype=np.int64)
+
+
+def zscore(scores):
+    """Row-wise z-scores over the non-NaN entries; constant rows become 0."""
+    valid = ~np.isnan(scores)
+    n = np.maximum(valid.sum(axis=1, keepdims=True), 1)
+    mean = np.where(valid, scores, 0.0).sum(axis=1, keepdims=True) / n
+    std = np.sqrt((np.where(valid, scores - mean, 0.0) ** 2).sum(axis=1, keepdims=True) / n)
+    return np.where(valid, (scores - mean) / np.where(std > 0, std, 1.0), np.nan)
+
+
+def rank_normalize(scores):
+    """Row-wise percentile ranks in [0, 1] over the non-NaN entries; ties share a rank."""
+    # scipy.stats takes about a second to import; only this non-default method needs it
+    from scipy.stats import rankdata
+
+    valid = ~np.isnan(scores)
+    n = valid.sum(axis=1, keepdims=True)
+    ranks = rankdata(scores, axis=1, nan_policy='omit')
+    return np.where(valid, (ranks - 1) / np.where(n > 1, n - 1, 1), np.nan)
+
+
+_NORMALIZERS = {'zscore': (zscore, 0.0), 'rank': (rank_normalize, 0.5)}
+
+
+def blend(scores, weights, method='zscore'):
+    """
+    Normalize each source (row of `scores`) and return the weighted sum per candidate.
+    NaN entries count as the source's neutral value (mean z-score 0, median rank 0.5).
+    """
+    if method not in _NORMALIZERS:
+        raise ValueError(f"Unknown blend method '{method}'; expected one of {BLEND_METHODS}")
+    normalize, neutral = _NORMALIZERS[method]
+    normalized = normalize(np.atleast_2d(np.asarray(scores, dtype=np.float64)))
+    return np.asarray(weights, dtype=np.float64) @ np.where(np.isnan(normalized), neutral, normalized)
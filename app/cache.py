@@ -0,0 +1,204 @@
+# app/cache.py
+"""
+Recommendation cache: an in-process LRU with TTL, plus an optional SQLite tier shared
+by every worker on the host.
+
+Entries are keyed per user (hybrid / home-page lists) or per seed title (CBF lists).
+Every user key includes the state of the user's ratings (count and latest timestamp,
+read from the ratings table), so after a rating write the old entries miss in *all*
+workers, whether or not the shared tier is on. Rating writes also call
+invalidate_user() to free the writer's (and the shared tier's) stale entries.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from .ratings import user_ratings_version
+
+DEFAULT_MAX_SIZE = 2048
+DEFAULT_TTL = 300  # seconds
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not _MISSING:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete_where(self, predicate):
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    """File-backed cache tier shared across processes. Values are stored as JSON."""
+
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        self.path = str(path)
+        self.ttl = ttl
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS recs_cache ("
+                " key TEXT PRIMARY KEY, user_id INTEGER, value TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_recs_cache_user ON recs_cache (user_id)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def after_fork(self):
+        """In a forked child: open fresh connections instead of sharing the parent's."""
+        self._local = threading.local()
+
+    def get(self, key, default=None):
+        row = self._connect().execute(
+            "SELECT value FROM recs_cache WHERE key = ? AND expires > ?", (key, time.time())
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value, user_id=None):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO recs_cache (key, user_id, value, expires) VALUES (?, ?, ?, ?)",
+            (key, user_id, json.dumps(value), time.time() + self.ttl),
+        )
+
+    def invalidate_user(self, user_id):
+        self._connect().execute("DELETE FROM recs_cache WHERE user_id = ?", (user_id,))
+
+    def purge_expired(self):
+        self._connect().execute("DELETE FROM recs_cache WHERE expires <= ?", (time.time(),))
+
+
+class RecommendationCache:
+    """Two-tier cache for recommendation lists with per-user invalidation."""
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL, shared_path=None, user_version=None):
+        self.local = TTLCache(max_size=max_size, ttl=ttl)
+        self.shared = SQLiteCache(shared_path, ttl=ttl) if shared_path else None
+        # user_id -> hashable state of their ratings (ratings.user_ratings_version)
+        self.user_version = user_version
+
+    def _key(self, kind, user_id, parts):
+        version = self.user_version(user_id) if self.user_version and user_id is not None else None
+        return (kind, user_id, version, *parts)
+
+    def get_or_compute(self, kind, parts, compute, user_id=None):
+        """
+        Return the cached value for (kind, user_id, *parts), computing and storing it on
+        a miss. Pass user_id for anything that depends on the user's ratings.
+        """
+        key = self._key(kind, user_id, parts)
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        shared_key = json.dumps(key, default=str) if self.shared is not None else None
+        if self.shared is not None:
+            value = self.shared.get(shared_key, _MISSING)
+            if value is not _MISSING:
+                self.local.set(key, value)
+                return value
+
+        value = compute()
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(shared_key, value, user_id=user_id)
+        return value
+
+    def invalidate_user(self, user_id):
+        """Drop the entries computed for `user_id` here and in the shared tier (other workers' already miss)."""
+        self.local.delete_where(lambda key: key[1] == user_id)
+        if self.shared is not None:
+            self.shared.invalidate_user(user_id)
+
+    def after_fork(self):
+        if self.shared is not None:
+            self.shared.after_fork()
+
+    def stats(self):
+        local_requests = self.local.hits + self.local.misses
+        stats = {
+            'local_hits': self.local.hits,
+            'local_misses': self.local.misses,
+            'local_evictions': self.local.evictions,
+            'local_size': len(self.local),
+            'local_hit_rate': self.local.hits / local_requests if local_requests else 0.0,
+        }
+        if self.shared is not None:
+            shared_requests = self.shared.hits + self.shared.misses
+            stats.update({
+                'shared_hits': self.shared.hits,
+                'shared_misses': self.shared.misses,
+                'shared_hit_rate': self.shared.hits / shared_requests if shared_requests else 0.0,
+            })
+        return stats
+
+
+recs_cache = RecommendationCache()
+
+
+def init_cache(app):
+    """Configure the module-level cache from RECS_CACHE_* settings."""
+    global recs_cache
+    app.config.setdefault('RECS_CACHE_SIZE', DEFAULT_MAX_SIZE)
+    app.config.setdefault('RECS_CACHE_TTL', DEFAULT_TTL)
+    app.config.setdefault('RECS_CACHE_SHARED_PATH', os.environ.get('RECS_CACHE_SHARED_PATH'))
+    recs_cache = RecommendationCache(
+        max_size=app.config['RECS_CACHE_SIZE'],
+        ttl=app.config['RECS_CACHE_TTL'],
+        shared_path=app.config['RECS_CACHE_SHARED_PATH'],
+        user_version=user_ratings_version,
+    )
+    return recs_cache
@@ -1,112 +1,414 @@
-import pandas as pd
+import logging
+import threading
+
 import numpy as np
+from flask import g, has_request_context
 from scipy.sparse import csr_matrix
 from scipy.sparse.linalg import svds
 
-from .models import Rating
-from .database import db
+from .ratings import export_ratings
+from .ranking import top_n as rank_top_n
+from .ann import IVFIndex, MIN_ROWS as ANN_MIN_ROWS
+from .metrics import stage
+
+logger = logging.getLogger(__name__)
 
 # CF model container
-# The model will now store the SVD components and mappings
+# The model will now store the SVD components and mappings.
+# Rebuilds and fold-ins both replace it as a whole (see set_cf_model); it is never modified in place.
 cf_model = None
 
-def build_cf_model():
+# Fold-in drift limits: past either one, a full rebuild is worth its cost
+MAX_NEW_RATING_FRACTION = 0.25  # ratings folded in since the last build / ratings at build
+MAX_RMSE_RATIO = 1.5            # fold-in reconstruction RMSE / baseline RMSE
+# Floor for that baseline, in stars. With k close to min(shape) the SVD fits the training
+# ratings almost exactly, so the in-sample train RMSE alone would flag every fold-in.
+MIN_BASELINE_RMSE = 1.0
+
+_update_lock = threading.Lock()
+
+def get_cf_model():
     """
-    Builds the SVD-based collaborative filtering model using SciPy.
+    The model this request should use.
+
+    Inside a request this is the model pinned in `g` when the request started, so a
+    hot-swap mid-request does not change the version a request is working with.
     """
+    if has_request_context() and 'cf_model' in g:
+        return g.cf_model
+    return cf_model
+
+
+def set_cf_model(model):
+    """Swap the live model. A single reference assignment, so readers see old or new."""
     global cf_model
-    
-    # Load ratings from the database
-    ratings_df = pd.read_sql(db.session.query(Rating).statement, db.session.bind)
+    cf_model = model
+    return model
+
+
+def publish_cf_model(model):
+    """
+    Swap in a model built outside the fold-in path (trainer, artifact load). Waits for a
+    fold-in in progress, so its result, derived from the old model, cannot land on top.
+    """
+    with _update_lock:
+        return set_cf_model(model)
+
+
+def build_cf_model():
+    """
+    Builds the SVD-based collaborative filtering model using SciPy and makes it live.
+    """
+    model = train_cf_model()
+    if model is not None:
+        set_cf_model(model)
+    return model
+
+
+def train_cf_model():
+    """
+    Fit a new SVD model from all ratings without touching the live model.
+    """
+    # Load ratings from the database as COO arrays (app/ratings.py)
+    coo = export_ratings()
 
-    if ratings_df.empty or len(ratings_df) < 20: # SVD needs a reasonable amount of data
-        print("Not enough ratings available to build the CF model.")
+    if len(coo['id']) < 20: # SVD needs a reasonable amount of data
+        logger.warning("Not enough ratings available to build the CF model.")
         return None
 
     # --- Data Preparation ---
-    # Create unique integer mappings for users and mangas
-    user_ids = ratings_df['user_id'].unique()
-    manga_ids = ratings_df['manga_id'].unique()
-    
-    user_map = {id: i for i, id in enumerate(user_ids)}
-    manga_map = {id: i for i, id in enumerate(manga_ids)}
-
-    # Create inverse mappings to retrieve original IDs later
-    user_inv_map = {i: id for id, i in user_map.items()}
-    manga_inv_map = {i: id for id, i in manga_map.items()}
+    # Unique ids and each rating's matrix index, in one pass per axis
+    user_ids, user_indices = np.unique(coo['user_id'], return_inverse=True)
+    manga_ids, manga_indices = np.unique(coo['manga_id'], return_inverse=True)
 
-    # Map original IDs to matrix indices
-    user_indices = ratings_df['user_id'].map(user_map)
-    manga_indices = ratings_df['manga_id'].map(manga_map)
+    user_map = dict(zip(user_ids.tolist(), range(len(user_ids))))
+    manga_map = dict(zip(manga_ids.tolist(), range(len(manga_ids))))
 
     # --- Create the User-Item Sparse Matrix ---
     # csr_matrix is efficient for sparse data (most users haven't rated most mangas)
-    user_item_matrix = csr_matrix((ratings_df['rating'], (user_indices, manga_indices)),
+    user_item_matrix = csr_matrix((coo['rating'], (user_indices, manga_indices)),
                                   shape=(len(user_map), len(manga_map)))
 
     # --- SVD Model Training ---
     # Decompose the matrix. 'k' is the number of latent factors (a hyperparameter).
     # svds is used for sparse matrices.
-    k = 50 
-    U, sigma, Vt = svds(user_item_matrix, k=k)
+    # svds needs k < min(n_users, n_mangas)
+    k = min(50, min(user_item_matrix.shape) - 1)
+    if k < 1:
+        logger.warning("Not enough users or mangas to build the CF model.")
+        return None
+    U, sigma, Vt = svds(user_item_matrix.astype(np.float64), k=k)
 
-    # Sigma is returned as a 1D array, convert it to a diagonal matrix
-    sigma = np.diag(sigma)
+    # Premultiply sigma into Vt once, so R_hat = U @ sigma_Vt is a single float32 matmul
+    U = U.astype(np.float32)
+    sigma_Vt = (sigma[:, None] * Vt).astype(np.float32)
+    train_rmse = _rmse(U, sigma_Vt, user_indices, manga_indices, coo['rating'])
 
     # Store all necessary components for prediction
-    cf_model = {
+    model = index_items({
         'U': U,
         'sigma': sigma,
-        'Vt': Vt,
+        'sigma_Vt': sigma_Vt,
         'user_map': user_map,
-        'manga_map': manga_map
-    }
+        'manga_map': manga_map,
+        # Column -> manga id, and each user's rated columns (for masking)
+        'item_ids': manga_ids.astype(np.int64),
+        'rated': _rated_columns(user_indices, manga_indices, len(user_map)),
+        # Bookkeeping for incremental updates
+        'n_ratings': len(coo['id']),
+        'max_rating_id': int(coo['id'].max()),
+        'train_rmse': train_rmse,
+        'drift': _empty_drift(),
+        'version': None,
+        # IVF index over the item vectors (columns of sigma_Vt) for sublinear retrieval
+        'ann': IVFIndex.build(sigma_Vt.T) if sigma_Vt.shape[1] >= ANN_MIN_ROWS else None,
+    })
     
-    print("CF Model trained successfully using SciPy.")
-    return cf_model
+    logger.info("CF model trained: %d users, %d mangas.", len(user_ids), len(manga_ids))
+    return model
+
+
+def index_items(model):
+    """Add a sorted view of item_ids so manga ids map to columns with one searchsorted."""
+    order = np.argsort(model['item_ids'], kind='stable')
+    model['item_order'] = order
+    model['item_sorted'] = model['item_ids'][order]
+    return model
+
+
+def _item_columns(model, manga_ids):
+    """Vectorized manga id -> column lookup. Returns (columns, found_mask)."""
+    manga_ids = np.asarray(manga_ids, dtype=np.int64)
+    sorted_ids = model['item_sorted']
+    if len(sorted_ids) == 0:
+        return np.zeros(len(manga_ids), dtype=np.intp), np.zeros(len(manga_ids), dtype=bool)
+    pos = np.minimum(np.searchsorted(sorted_ids, manga_ids), len(sorted_ids) - 1)
+    found = sorted_ids[pos] == manga_ids
+    return model['item_order'][pos], found
+
 
+def _rated_columns(user_indices, manga_indices, n_users):
+    """One int32 array of rated columns per user row."""
+    order = np.argsort(user_indices, kind='stable')
+    counts = np.bincount(user_indices, minlength=n_users)
+    return np.split(manga_indices[order].astype(np.int32), np.cumsum(counts)[:-1])
 
-def get_cf_recommendations(user_id, manga_ids, top_n=10):
+
+def _rmse(U, sigma_Vt, user_indices, manga_indices, ratings):
+    """RMSE of the reconstruction over the observed (user, manga, rating) triples."""
+    if len(ratings) == 0:
+        return 0.0
+    predicted = np.einsum('ij,ji->i', U[user_indices], sigma_Vt[:, manga_indices])
+    return float(np.sqrt(np.mean((predicted - ratings) ** 2)))
+
+
+def _empty_drift():
+    return {'new_ratings': 0, 'new_users': 0, 'new_mangas': 0, 'fold_sq_error': 0.0}
+
+
+def fold_in_ratings(ratings_df, model=None):
     """
-    Generate CF-based predictions for a given user and list of manga IDs using the SciPy model.
+    Fold new or changed ratings into an existing SVD model without refactorizing.
+
+    `ratings_df` must hold the *complete* current ratings (user_id, manga_id, rating) of
+    every user being updated. New and existing users are projected onto the item factors
+    (u = r V / sigma), then mangas the model has never seen are projected onto the user
+    factors (v = U^T r / sigma). Rows are rewritten in a copy of U, never in `model`
+    itself, so requests that pinned `model` keep a consistent version.
+    Returns the updated model, or None if there is no model to update.
     """
-    if cf_model is None:
-        print("CF model is not available.")
-        return []
+    model = model if model is not None else get_cf_model()
+    if model is None or ratings_df.empty:
+        return model
+
+    U, sigma_Vt = model['U'], model['sigma_Vt']
+    sigma = model['sigma']
+    # Copies: requests still ranking with `model` must keep seeing consistent maps
+    user_map, manga_map = dict(model['user_map']), dict(model['manga_map'])
+    item_ids, rated = model['item_ids'], list(model['rated'])
+    # With sigma folded into Vt: u = r V / sigma = (r @ sigma_Vt.T) / sigma^2.
+    # Tiny singular values would blow up the projection.
+    safe_sigma = np.where(sigma > 1e-9, sigma, 1.0)
+    inv_sigma_sq = np.where(sigma > 1e-9, 1.0 / safe_sigma ** 2, 0.0).astype(np.float32)
+    drift = dict(model['drift'])
+
+    # --- Users: project each user's known-manga ratings onto the item factors ---
+    known = ratings_df[ratings_df['manga_id'].isin(list(manga_map))]
+    new_user_ids = [uid for uid in ratings_df['user_id'].unique() if uid not in user_map]
+    if new_user_ids:
+        # vstack copies, so the rows written below never reach the pinned model
+        U = np.vstack([U, np.zeros((len(new_user_ids), U.shape[1]), dtype=U.dtype)])
+        rated = rated + [np.zeros(0, dtype=np.int32) for _ in new_user_ids]
+        for uid in new_user_ids:
+            user_map[uid] = len(user_map)
+        drift['new_users'] += len(new_user_ids)
+    else:
+        U = U.copy()
+
+    for uid, user_ratings in known.groupby('user_id'):
+        cols = user_ratings['manga_id'].map(manga_map).to_numpy()
+        U[user_map[uid]] = (user_ratings['rating'].to_numpy() @ sigma_Vt[:, cols].T) * inv_sigma_sq
+
+    # --- Mangas: project unseen mangas onto the (updated) user factors ---
+    # The sigma_Vt column of a new manga is sigma * (U^T r / sigma) = U^T r
+    unseen = ratings_df[~ratings_df['manga_id'].isin(list(manga_map))]
+    new_items = not unseen.empty
+    if new_items:
+        new_manga_ids = unseen['manga_id'].unique()
+        new_cols = np.zeros((sigma_Vt.shape[0], len(new_manga_ids)), dtype=sigma_Vt.dtype)
+        for j, (mid, manga_ratings) in enumerate(unseen.groupby('manga_id', sort=False)):
+            rows = manga_ratings['user_id'].map(user_map).to_numpy()
+            new_cols[:, j] = U[rows].T @ manga_ratings['rating'].to_numpy()
+            manga_map[mid] = sigma_Vt.shape[1] + j
+        first_new = sigma_Vt.shape[1]
+        sigma_Vt = np.hstack([sigma_Vt, new_cols])
+        item_ids = np.concatenate([item_ids, np.asarray(new_manga_ids, dtype=np.int64)])
+        drift['new_mangas'] += len(new_manga_ids)
+        if model.get('ann') is not None:
+            model = {**model, 'ann': model['ann'].add(sigma_Vt.T, np.arange(first_new, sigma_Vt.shape[1]))}
 
-    # Unpack the model components
-    U = cf_model['U']
-    sigma = cf_model['sigma']
-    Vt = cf_model['Vt']
-    user_map = cf_model['user_map']
-    manga_map = cf_model['manga_map']
+    # --- Rated columns, so batch scoring keeps excluding what users have seen ---
+    for uid, user_ratings in ratings_df.groupby('user_id'):
+        rated[user_map[uid]] = user_ratings['manga_id'].map(manga_map).to_numpy(dtype=np.int32)
+
+    # --- Drift: how well the folded-in rows reconstruct the ratings they came from ---
+    user_indices = ratings_df['user_id'].map(user_map).to_numpy()
+    manga_indices = ratings_df['manga_id'].map(manga_map).to_numpy()
+    fold_rmse = _rmse(U, sigma_Vt, user_indices, manga_indices, ratings_df['rating'].to_numpy())
+    drift['new_ratings'] += len(ratings_df)
+    drift['fold_sq_error'] += fold_rmse ** 2 * len(ratings_df)
+
+    updated = {**model, 'U': U, 'sigma_Vt': sigma_Vt, 'item_ids': item_ids, 'user_map': user_map,
+               'manga_map': manga_map, 'rated': rated, 'drift': drift}
+    return index_items(updated) if new_items else updated
+
+
+def cf_drift(model=None):
+    """
+    Summarise how far the model has drifted since its last full build:
+    {'new_ratings', 'new_users', 'new_mangas', 'new_fraction', 'fold_rmse', 'train_rmse'}.
+    """
+    model = model if model is not None else get_cf_model()
+    if model is None:
+        return None
+    drift = model['drift']
+    n_new = drift['new_ratings']
+    return {
+        'new_ratings': n_new,
+        'new_users': drift['new_users'],
+        'new_mangas': drift['new_mangas'],
+        'new_fraction': n_new / max(model['n_ratings'], 1),
+        'fold_rmse': float(np.sqrt(drift['fold_sq_error'] / n_new)) if n_new else 0.0,
+        'train_rmse': model['train_rmse'],
+    }
+
+
+def needs_full_rebuild(model=None, max_new_fraction=MAX_NEW_RATING_FRACTION,
+                       max_rmse_ratio=MAX_RMSE_RATIO):
+    """True when fold-in updates have drifted far enough that svds should be rerun."""
+    drift = cf_drift(model)
+    if drift is None:
+        return True
+    if drift['new_fraction'] > max_new_fraction:
+        return True
+    baseline = max(drift['train_rmse'], MIN_BASELINE_RMSE)
+    return drift['fold_rmse'] > max_rmse_ratio * baseline
+
+
+def update_cf_model_for_user(user_id, rebuild=True):
+    """
+    Bring the CF model up to date after `user_id` rated something.
+
+    Folds the user's current ratings into the live model. With rebuild=True the full SVD
+    is rerun here when there is no model yet or the drift limits are exceeded. The route
+    hook (trainer.on_ratings_changed) passes rebuild=False and publishes the rebuild itself.
+    """
+    # Fold-ins read-modify-write the live model, so concurrent rating writes take turns
+    with _update_lock:
+        model = cf_model
+        if model is None:
+            return build_cf_model() if rebuild else None
+        if rebuild and needs_full_rebuild(model):
+            return build_cf_model()
+
+        import pandas as pd  # slow to import; only rating writes need it, not app startup
+
+        user_ratings = pd.DataFrame(export_ratings(user_id=user_id))
+        if user_ratings.empty and user_id in model['user_map']:
+            # All of the user's ratings were deleted; zero their row in a copy, like fold-ins
+            row = model['user_map'][user_id]
+            U, rated = model['U'].copy(), list(model['rated'])
+            U[row] = 0.0
+            rated[row] = np.zeros(0, dtype=np.int32)
+            model = {**model, 'U': U, 'rated': rated}
+        model = set_cf_model(fold_in_ratings(user_ratings, model))
+
+        if rebuild and needs_full_rebuild(model):
+            logger.info("CF drift past limits (%s); rebuilding.", cf_drift(model))
+            return build_cf_model()
+        return model
+
+
+@stage('cf_scoring')
+def get_cf_recommendations(user_id, manga_ids=None, top_n=10):
+    """
+    Generate CF-based predictions for a given user using the SciPy model.
+
+    With `manga_ids`, only those candidates are ranked; without, the whole catalog is
+    ranked and the user's already-rated mangas are excluded.
+    """
+    model = get_cf_model()
+    if model is None:
+        logger.debug("CF model is not available.")
+        return []
 
     # Check if the user exists in the model's training data
-    if user_id not in user_map:
-        print(f"User {user_id} not in the training data. Cannot provide recommendations.")
+    if user_id not in model['user_map']:
+        logger.debug("User %s not in the CF training data.", user_id)
         return []
 
-    # Get the internal index for the user
-    user_index = user_map[user_id]
-    
-    # --- Prediction ---
-    # Get the user's latent factor vector
-    user_vector = U[user_index, :]
-    
-    # Predict ratings for all mangas for this user by reconstructing their row in the matrix
-    # R_hat = U @ sigma @ Vt
-    user_predictions = user_vector @ sigma @ Vt
-
-    predictions = []
-    for mid in manga_ids:
-        # Check if the manga was in the training data
-        if mid in manga_map:
-            manga_index = manga_map[mid]
-            # Get the estimated rating from the full prediction vector
-            estimated_rating = user_predictions[manga_index]
-            predictions.append((mid, estimated_rating))
-
-    # Sort by the estimated rating in descending order
-    sorted_preds = sorted(predictions, key=lambda x: x[1], reverse=True)
-    
-    return sorted_preds[:top_n]
\ No newline at end of file
+    if manga_ids is None:
+        return get_cf_recommendations_batch([user_id], top_n=top_n, model=model)[0]
+
+    # --- Prediction over the candidate columns only ---
+    candidates = np.asarray(manga_ids, dtype=np.int64)
+    cols, found = _item_columns(model, candidates)
+    candidates, cols = candidates[found], cols[found]
+    user_vector = model['U'][model['user_map'][user_id]]
+    user_predictions = user_vector @ model['sigma_Vt'][:, cols]
+
+    order, scores = rank_top_n(user_predictions, top_n)
+    return list(zip(candidates[order].tolist(), scores.tolist()))
+
+
+@stage('cf_scoring')
+def get_cf_scores(user_id, manga_ids, model=None, exclude_rated=False):
+    """
+    Predicted ratings for `manga_ids` as one float array aligned with it, from a single
+    user-vector product over the matching columns. NaN where the model does not know the
+    manga, every entry when it does not know the user, and with exclude_rated=True
+    for the mangas the user already rated.
+    """
+    model = model if model is not None else get_cf_model()
+    scores = np.full(len(manga_ids), np.nan)
+    if model is None or user_id not in model['user_map']:
+        return scores
+
+    cols, found = _item_columns(model, manga_ids)
+    row = model['user_map'][user_id]
+    scores[found] = model['U'][row] @ model['sigma_Vt'][:, cols[found]]
+    if exclude_rated:
+        scores[found & np.isin(cols, model['rated'][row])] = np.nan
+    return scores
+
+
+@stage('cf_scoring')
+def get_cf_recommendations_batch(user_ids, top_n=10, exclude_rated=True, model=None,
+                                 batch_size=1024, use_ann=True, n_probe=None):
+    """
+    Top-N over the whole catalog for many users at once.
+
+    Scores each chunk of `batch_size` users with one U[rows] @ sigma_Vt product, masks
+    every user's rated mangas in one vectorized assignment, and ranks with argpartition.
+    When the model has an ANN index (ann.MIN_ROWS+ items) only the probed partitions are
+    scored, approximate and sublinear in catalog size; use_ann=False forces exact scoring.
+    Returns one [(manga_id, predicted_rating), ...] list per user (empty if unknown).
+    """
+    model = model if model is not None else get_cf_model()
+    results = [[] for _ in user_ids]
+    if model is None:
+        return results
+
+    user_map = model['user_map']
+    known = [(pos, user_map[uid]) for pos, uid in enumerate(user_ids) if uid in user_map]
+    if use_ann and model.get('ann') is not None:
+        rows = np.asarray([row for _, row in known], dtype=np.intp)
+        rated = [model['rated'][row] if exclude_rated else () for row in rows]
+        order, top_scores = model['ann'].search(
+            model['sigma_Vt'].T, model['U'][rows], top_n, n_probe=n_probe, exclude=rated
+        )
+        top_ids = model['item_ids'][np.maximum(order, 0)]
+        for (pos, _), row_ids, row_scores in zip(known, top_ids.tolist(), top_scores.tolist()):
+            results[pos] = [(mid, score) for mid, score in zip(row_ids, row_scores)
+                            if score != -np.inf]
+        return results
+
+    for start in range(0, len(known), batch_size):
+        chunk = known[start:start + batch_size]
+        positions = [pos for pos, _ in chunk]
+        rows = np.asarray([row for _, row in chunk], dtype=np.intp)
+        scores = model['U'][rows] @ model['sigma_Vt']
+
+        exclude = None
+        if exclude_rated:
+            rated = [model['rated'][row] for row in rows]
+            exclude = np.zeros(scores.shape, dtype=bool)
+            exclude[np.repeat(np.arange(len(rows)), [len(r) for r in rated]),
+                    np.concatenate(rated).astype(np.intp)] = True
+
+        order, top_scores = rank_top_n(scores, top_n, exclude=exclude)
+        top_ids = model['item_ids'][order]
+        for pos, row_ids, row_scores in zip(positions, top_ids.tolist(), top_scores.tolist()):
+            results[pos] = [(mid, score) for mid, score in zip(row_ids, row_scores)
+                            if score != -np.inf]
+    return results
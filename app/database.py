@@ -1,17 +1,73 @@
 # app/database.py
+import os
+
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
-from flask_login import UserMixin 
+from flask_login import UserMixin
 from flask_login import LoginManager
+from sqlalchemy import event
 
 db = SQLAlchemy()
 bcrypt = Bcrypt()
 login_manager = LoginManager()
 
+# Relative SQLite paths are resolved against the instance folder
+DEFAULT_DATABASE_URI = 'sqlite:///../instance/manga.db'
+# Seconds a connection waits for another worker's write lock before "database is locked"
+SQLITE_BUSY_TIMEOUT = 30
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',        # readers and the writer no longer block each other
+    'synchronous': 'NORMAL',      # with WAL: durable at checkpoints, no fsync per commit
+    'cache_size': -64 * 1024,     # page cache per connection, in KiB when negative
+    'temp_store': 'MEMORY',
+    'mmap_size': 256 * 1024 * 1024,
+}
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 10
+
+def _engine_options(config):
+    """Engine pool and driver options for the configured database."""
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    if uri in ('sqlite://', 'sqlite:///:memory:'):
+        # In-memory databases live in a single connection; keep SQLAlchemy's pool for them
+        return {}
+    options = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_pre_ping': True,
+    }
+    if uri.startswith('sqlite'):
+        # Connections move between request threads; the pool hands each to one at a time
+        options['connect_args'] = {'timeout': config['SQLITE_BUSY_TIMEOUT'], 'check_same_thread': False}
+    return options
+
+def _set_sqlite_pragmas(pragmas):
+    def on_connect(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+    return on_connect
+
 def init_db(app):
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///../instance/manga.db'
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    """
+    Configure SQLAlchemy from SQLALCHEMY_DATABASE_URI (default: the DATABASE_URL
+    environment variable, then instance/manga.db). SQLite connections get
+    SQLITE_PRAGMAS and a SQLITE_BUSY_TIMEOUT, so concurrent workers queue for the
+    write lock instead of failing; DB_POOL_SIZE / DB_MAX_OVERFLOW size the pool.
+    """
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URI))
+    app.config.setdefault('SQLALCHEMY_TRACK_MODIFICATIONS', False)
+    app.config.setdefault('SQLITE_BUSY_TIMEOUT', SQLITE_BUSY_TIMEOUT)
+    app.config.setdefault('SQLITE_PRAGMAS', SQLITE_PRAGMAS)
+    app.config.setdefault('DB_POOL_SIZE', DB_POOL_SIZE)
+    app.config.setdefault('DB_MAX_OVERFLOW', DB_MAX_OVERFLOW)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', _engine_options(app.config))
+
     db.init_app(app)
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        with app.app_context():
+            event.listen(db.engine, 'connect', _set_sqlite_pragmas(app.config['SQLITE_PRAGMAS']))
     bcrypt.init_app(app)
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login'
@@ -0,0 +1,93 @@
+# app/genres.py
+"""
+Genre vocabulary with a uint64 bitset per title.
+
+Filters become vectorized masks: a title has every included genre when
+`bits & include == include`, and none of the excluded ones when `bits & exclude == 0`.
+The masks are applied before ranking, so a filtered list is ranked only over the titles
+that pass.
+"""
+import numpy as np
+
+MAX_GENRES = 64
+# Multi-word genre names, joined so that each genre is a single token
+GENRE_PHRASES = ['Award Winning', 'Slice of Life', 'Boys Love', 'Girls Love', 'Avant Garde']
+
+
+def normalize_genre(name):
+    """Case- and separator-insensitive genre key: 'slice of life' -> 'slice_of_life'."""
+    return "_".join(str(name).lower().replace("_", " ").split())
+
+
+def join_genre_phrases(genres):
+    """Join multi-word genres in a space-separated genre string: 'Boys Love' -> 'Boys_Love'."""
+    for phrase in GENRE_PHRASES:
+        genres = genres.replace(phrase, phrase.replace(' ', '_'))
+    return genres
+
+
+class GenreIndex:
+    def __init__(self, names, bits):
+        self.names = list(names)
+        self.bits = np.asarray(bits, dtype=np.uint64)
+        self._codes = {normalize_genre(name): code for code, name in enumerate(self.names)}
+
+    @classmethod
+    def from_strings(cls, genres):
+        """Build the vocabulary from space-joined genre strings (one per title)."""
+        codes = {}
+        bits = np.zeros(len(genres), dtype=np.uint64)
+        for row, value in enumerate(genres):
+            for name in join_genre_phrases(str(value)).split():
+                code = codes.setdefault(name, len(codes))
+                if code >= MAX_GENRES:
+                    raise ValueError(f"More than {MAX_GENRES} genres; cannot index '{name}'")
+                bits[row] |= np.uint64(1) << np.uint64(code)
+        return cls(sorted(codes, key=codes.get), bits)
+
+    @classmethod
+    def from_artifact(cls, artifact):
+        """Use the bitsets written by build_models.py, or derive them from the genres column."""
+        if artifact.has('genre_bits'):
+            return cls(artifact.meta['genre_names'], artifact.array('genre_bits'))
+        return cls.from_strings(artifact.strings('genres').tolist())
+
+    def __len__(self):
+        return len(self.bits)
+
+    def bits_for(self, names):
+        """Bitset of the given genre names, or None if any of them is unknown."""
+        bits = np.uint64(0)
+        for name in names or ():
+            code = self._codes.get(normalize_genre(name))
+            if code is None:
+                return None
+            bits |= np.uint64(1) << np.uint64(code)
+        return bits
+
+    def mask(self, include=None, exclude=None):
+        """
+        Boolean mask over titles that have every genre in `include` and none in `exclude`,
+        or None when there is nothing to filter. An unknown included genre matches nothing;
+        unknown excluded genres are ignored.
+        """
+        if not include and not exclude:
+            return None
+        mask = np.ones(len(self.bits), dtype=bool)
+        if include:
+            want = self.bits_for(include)
+            if want is None:
+                return np.zeros(len(self.bits), dtype=bool)
+            mask &= (self.bits & want) == want
+        if exclude:
+            avoid = self.bits_for([name for name in exclude if normalize_genre(name) in self._codes])
+            mask &= (self.bits & avoid) == 0
+        return mask
+
+    def counts(self, rows=None):
+        """{genre: number of titles} over `rows` (default: the whole catalog), for facets."""
+        bits = self.bits if rows is None else self.bits[np.asarray(rows, dtype=np.intp)]
+        codes = np.arange(len(self.names), dtype=np.uint64)
+        present = (bits[:, None] >> codes) & np.uint64(1)
+        totals = present.sum(axis=0)
+        return {name: int(total) for name, total in zip(self.names, totals) if total}
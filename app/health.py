@@ -0,0 +1,54 @@
+# app/health.py
+"""
+Liveness and readiness probes.
+
+    GET /healthz   the process is up; touches neither the models nor the database
+    GET /readyz    loads the content model if this worker has not yet (so the first
+                   probe warms it) and checks the database
+
+/readyz answers 503 while the database is unreachable or there is no catalog to
+serve. A missing similarity artifact only makes it 'degraded': requests are answered,
+with popularity in place of content ranking.
+"""
+from flask import Blueprint, jsonify
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from .collaborative import get_cf_model
+from .database import db
+from .recommender import models
+
+health = Blueprint('health', __name__)
+
+
+def _database_ok():
+    try:
+        db.session.execute(text("SELECT 1"))
+        return True
+    except SQLAlchemyError:
+        return False
+
+
+@health.route("/healthz")
+def healthz():
+    return jsonify({'status': 'ok'})
+
+
+@health.route("/readyz")
+def readyz():
+    models.load()
+    cf_model = get_cf_model()
+    database_ok = _database_ok()
+    ready = database_ok and len(models.metadata) > 0
+    body = {
+        'status': models.status if ready else 'unavailable',
+        'database': 'ok' if database_ok else 'error',
+        'content_model': {
+            'version': models.version,
+            'titles': len(models.metadata),
+            'load_seconds': round(models.load_seconds, 3),
+            'errors': models.errors,
+        },
+        'cf_model': cf_model['version'] if cf_model is not None else None,
+    }
+    return jsonify(body), 200 if ready else 503
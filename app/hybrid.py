@@ -1,51 +1,128 @@
-from .collaborative import get_cf_recommendations
-from .recommender import get_cbf_scores, manga_df
+import numpy as np
 
-def get_hybrid_recommendations(user_id, title, alpha=0.5, top_n=10):
+from .blending import blend, union_candidates
+from .metrics import stage
+from .collaborative import _item_columns, get_cf_model, get_cf_scores
+from .ranking import top_n as rank_top_n
+from .recommender import find_closest_title, get_cbf_similarities, get_similar_indices, models
+from .profiles import get_profile_scores, get_profile_similarities
+
+# Candidates taken from each source (content and CF) before blending
+POOL_SIZE = 50
+# How each source is normalized before blending: 'zscore' or 'rank' (see app/blending.py)
+BLEND_METHOD = 'zscore'
+
+def get_hybrid_recommendations(user_id, title, alpha=0.5, top_n=10, include_genres=None, exclude_genres=None,
+                               method=BLEND_METHOD, pool_size=POOL_SIZE):
     """
     Combine CBF + CF scores for final hybrid recommendations.
+    Genre filters are applied to both candidate pools, before anything is ranked.
+    """
+    _, idx = find_closest_title(title)
+    if idx is None:
+        return []
+
+    # Step 1: Content-based candidates
+    allowed = models.genre_index.mask(include_genres, exclude_genres)
+    rows, _ = get_similar_indices(idx, pool_size, allowed=allowed)
+    content_ids = models.manga_ids[rows[rows >= 0]]
+    # The seed itself is not a recommendation; its content similarity of 1.0 would rank it first
+    return blend_with_cf(user_id, content_ids, lambda ids: get_cbf_similarities(idx, ids),
+                         alpha=alpha, top_n=top_n, allowed=allowed, method=method, pool_size=pool_size,
+                         exclude_ids=models.manga_ids[[idx]])
+
+def get_profile_hybrid_recommendations(user_id, alpha=0.5, top_n=10, include_genres=None, exclude_genres=None,
+                                       method=BLEND_METHOD, pool_size=POOL_SIZE):
+    """
+    Hybrid recommendations seeded by the user's content profile (their whole rating
+    history) instead of a single title. Titles the user already rated are left out.
+    """
+    profile_scores = get_profile_scores(user_id, top_n=pool_size, include_genres=include_genres,
+                                        exclude_genres=exclude_genres)
+    content_ids = [mid for mid, _ in profile_scores]
+    return blend_with_cf(user_id, content_ids, lambda ids: get_profile_similarities(user_id, ids),
+                         alpha=alpha, top_n=top_n, allowed=models.genre_index.mask(include_genres, exclude_genres),
+                         method=method, pool_size=pool_size)
+
+@stage('cf_scoring')
+def get_cf_candidates(user_id, pool_size=POOL_SIZE, allowed=None, model=None, exclude_rows=None):
+    """
+    The user's top pool_size unrated catalog titles by CF prediction (minus `exclude_rows`),
+    as manga ids. Models with an IVF index over the item factors (catalogs of
+    ann.MIN_ROWS+ titles) search it; a short approximate result falls back to scoring
+    the whole catalog.
     """
-    # Step 1: Content-based recommendations
-    cbf_scores = get_cbf_scores(title, top_n=50)  # Get a bigger pool
-    cbf_dict = {mid: score for mid, score in cbf_scores}
-
-    # Step 2: Collaborative recommendations (for the same pool of manga IDs)
-    manga_ids = [mid for mid, _ in cbf_scores]
-    cf_scores = get_cf_recommendations(user_id, manga_ids, top_n=len(manga_ids))
-    cf_dict = {mid: score for mid, score in cf_scores}
-
-    # Step 3: Merge scores
-    hybrid_scores = []
-    for mid in manga_ids:
-        cbf = cbf_dict.get(mid, 0)
-        cf = cf_dict.get(mid, 0)
-        final_score = alpha * cbf + (1 - alpha) * cf
-        hybrid_scores.append((mid, final_score))
-
-    # Step 4: Sort and return
-    sorted_scores = sorted(hybrid_scores, key=lambda x: x[1], reverse=True)
+    model = model if model is not None else get_cf_model()
+    if model is not None and model.get('ann') is not None and user_id in model['user_map']:
+        ids = _ann_cf_candidates(model, user_id, pool_size, allowed, exclude_rows)
+        if len(ids) == pool_size:
+            return ids
+    scores = get_cf_scores(user_id, models.manga_ids, model=model, exclude_rated=True)
+    excluded = np.isnan(scores) if allowed is None else np.isnan(scores) | ~allowed
+    if exclude_rows is not None:
+        excluded[exclude_rows] = True
+    order, top_scores = rank_top_n(scores, pool_size, exclude=excluded)
+    return models.manga_ids[order[~np.isneginf(top_scores)]]
+
+def _ann_cf_candidates(model, user_id, pool_size, allowed, exclude_rows):
+    row = model['user_map'][user_id]
+    exclude = model['rated'][row]
+    if exclude_rows is not None and len(exclude_rows):
+        cols, found = _item_columns(model, models.manga_ids[exclude_rows])
+        exclude = np.concatenate([exclude, cols[found]])
+    # Item columns the catalog knows (and the filter allows)
+    rows, found = models.metadata.rows_for(model['item_ids'])
+    allowed_cols = found if allowed is None else found & allowed[np.where(found, rows, 0)]
+    order, scores = model['ann'].search(model['sigma_Vt'].T, model['U'][row], pool_size,
+                                        exclude=[exclude], allowed=allowed_cols)
+    return model['item_ids'][order[0][~np.isneginf(scores[0])]]
+
+def blend_with_cf(user_id, content_ids, content_similarity, alpha=0.5, top_n=10, allowed=None,
+                  method=BLEND_METHOD, pool_size=POOL_SIZE, exclude_ids=None):
+    """
+    Blend a pool of content candidates with the user's CF predictions.
+
+    Candidates are the union of `content_ids` and the user's top CF titles (restricted to
+    `allowed`). Both sources score every candidate, `content_similarity(ids)` for the
+    content side, and the normalized scores are combined in one step:
+    alpha * content + (1 - alpha) * CF. Ids in `exclude_ids` (e.g. the seed title) are
+    never candidates.
+    """
+    # Step 2: Collaborative candidates, from the model version pinned for this request
+    model = get_cf_model()
+    exclude_rows = None
+    if exclude_ids is not None:
+        rows, found = models.metadata.rows_for(exclude_ids)
+        exclude_rows = rows[found]
+    candidates = union_candidates(content_ids, get_cf_candidates(user_id, pool_size, allowed, model, exclude_rows))
+    if exclude_ids is not None:
+        candidates = candidates[~np.isin(candidates, exclude_ids)]
+    if not len(candidates):
+        return []
+
+    # Step 3: Align both sources over the candidates and blend
+    scores = np.vstack([content_similarity(candidates), get_cf_scores(user_id, candidates, model=model)])
+    with stage('blending'):
+        hybrid_scores = blend(scores, [alpha, 1 - alpha], method=method)
+
+        # Step 4: Rank and return
+        order, top_scores = rank_top_n(hybrid_scores, top_n)
+        top = candidates[order].tolist()
+    # One vectorized id lookup for all results; ids missing from the catalog are skipped
+    with stage('metadata_join'):
+        details = models.metadata.get_many(top, ['title', 'genres', 'synopsis', 'image_url'])
     recommendations = []
-    # Iterate through the top N results to build the dictionary list
-    for mid, score in sorted_scores[:top_n]:
-        # Find the manga's details in the main DataFrame
-        manga_details = manga_df[manga_df['id'] == mid]
-        
-        # Make sure we found the manga before proceeding
-        if not manga_details.empty:
-            # Get the first matching row (should be only one)
-            manga_row = manga_details.iloc[0]
-            
-            # Create a dictionary with all the desired fields
-            rec_dict = {
-                'id': int(mid),
-                'title': manga_row['title'],
-                'recommendation_score': round(score, 4), # The calculated hybrid score
-                # --- Add any other fields you want from manga_df here ---
-                'genres': manga_row.get('genres', 'N/A'), # Using .get is safer if a column might not exist
-                'synopsis': manga_row.get('synopsis', ''),
-                'image_url': manga_row.get('image_url', '')
-            }
-            recommendations.append(rec_dict)
-            
+    for mid, score in zip(top, top_scores.tolist()):
+        manga_row = details.get(mid)
+        if manga_row is None:
+            continue
+        recommendations.append({
+            'id': int(mid),
+            'title': manga_row['title'],
+            'recommendation_score': round(score, 4), # The calculated hybrid score
+            'genres': manga_row['genres'] or 'N/A',
+            'synopsis': manga_row['synopsis'],
+            'image_url': manga_row['image_url'],
+        })
+
     return recommendations
-   
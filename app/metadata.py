@@ -0,0 +1,107 @@
+# app/metadata.py
+import numpy as np
+
+# Ids above this use a sorted-array lookup instead of a direct-address table
+MAX_DIRECT_ID = 10_000_000
+
+
+class MetadataStore:
+    """
+    Catalog metadata keyed by manga id.
+
+    Columns are whatever the model artifact holds (memory-mapped numeric arrays and
+    lazily decoded StringColumns), so nothing is copied per worker. Ids map to rows
+    through a direct-address int32 table: one array read per id, vectorized for bulk
+    lookups.
+    """
+
+    def __init__(self, ids, columns):
+        self.ids = np.asarray(ids)
+        self.columns = {'id': self.ids, **columns}
+        max_id = int(self.ids.max()) if len(self.ids) else -1
+        if 0 <= max_id <= MAX_DIRECT_ID and (len(self.ids) == 0 or self.ids.min() >= 0):
+            self._row_of_id = np.full(max_id + 1, -1, dtype=np.int32)
+            # Reverse order so the first row wins for duplicated ids
+            rows = np.arange(len(self.ids), dtype=np.int32)
+            self._row_of_id[self.ids[::-1]] = rows[::-1]
+            self._order = None
+        else:
+            self._row_of_id = None
+            self._order = np.argsort(self.ids, kind='stable')
+
+    @classmethod
+    def from_artifact(cls, artifact, string_columns, numeric_columns=()):
+        columns = {name: artifact.strings(name) for name in string_columns}
+        columns.update({name: artifact.array(name) for name in numeric_columns})
+        return cls(artifact.array('ids'), columns)
+
+    @classmethod
+    def from_dataframe(cls, df):
+        columns = {}
+        for name in df.columns:
+            if name == 'id':
+                continue
+            if df[name].dtype.kind in 'biuf':
+                columns[name] = df[name].to_numpy()
+            else:
+                columns[name] = df[name].fillna('').astype(str).tolist()
+        return cls(df['id'].to_numpy(), columns)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, manga_id):
+        return self.row(manga_id) is not None
+
+    def rows_for(self, manga_ids):
+        """Vectorized id -> row lookup. Returns (rows, found_mask)."""
+        manga_ids = np.asarray(manga_ids, dtype=np.int64)
+        if self._row_of_id is not None:
+            in_range = (manga_ids >= 0) & (manga_ids < len(self._row_of_id))
+            rows = np.full(len(manga_ids), -1, dtype=np.int64)
+            rows[in_range] = self._row_of_id[manga_ids[in_range]]
+            return rows, rows >= 0
+        sorted_ids = self.ids[self._order]
+        pos = np.minimum(np.searchsorted(sorted_ids, manga_ids), max(len(sorted_ids) - 1, 0))
+        found = sorted_ids[pos] == manga_ids if len(sorted_ids) else np.zeros(len(manga_ids), bool)
+        return np.where(found, self._order[pos], -1), found
+
+    def row(self, manga_id):
+        rows, found = self.rows_for([manga_id])
+        return int(rows[0]) if found[0] else None
+
+    def value(self, row, column):
+        value = self.columns[column][row]
+        return value.item() if isinstance(value, np.generic) else value
+
+    def records(self, rows, columns=None):
+        """Dicts for the given row indices, restricted to `columns` (default: all)."""
+        columns = columns or list(self.columns)
+        return [{col: self.value(row, col) for col in columns} for row in rows]
+
+    def get(self, manga_id, columns=None):
+        """One record by id, or None if the id is not in the catalog."""
+        row = self.row(manga_id)
+        return None if row is None else self.records([row], columns)[0]
+
+    def get_many(self, manga_ids, columns=None):
+        """
+        Records for many ids at once, in the order given. Returns {manga_id: record}
+        for the ids that exist; unknown ids are left out.
+        """
+        manga_ids = list(manga_ids)
+        rows, found = self.rows_for(manga_ids)
+        return {
+            manga_id: record
+            for manga_id, record in zip(
+                (m for m, ok in zip(manga_ids, found) if ok),
+                self.records(rows[found].tolist(), columns),
+            )
+        }
+
+    def sample(self, n, columns=None, rng=None, mask=None):
+        """`n` random records without replacement, drawn from the rows where `mask` is set."""
+        rng = rng or np.random.default_rng()
+        rows = np.arange(len(self.ids)) if mask is None else np.flatnonzero(mask)
+        rows = rng.choice(rows, size=min(n, len(rows)), replace=False)
+        return self.records(rows.tolist(), columns)
@@ -0,0 +1,403 @@
+# app/metrics.py
+"""
+Request instrumentation: per-stage timings, Prometheus metrics and a slow-request profiler.
+
+    with stage('blending'): ...          time a block as one stage of the current request
+    @stage('cf_scoring')                 or a whole function
+
+Stages are timed exclusively: time spent in a nested stage (a DB query inside profile
+scoring, say) counts towards the inner stage only, so the stages of a request add up
+to at most its total. DB queries and template renders are picked up automatically
+from SQLAlchemy and Flask events. Every request gets a `Server-Timing` header with
+its stage breakdown and a DEBUG log line on the `app.metrics` logger.
+
+    GET /metrics                         Prometheus text format, for this worker process
+
+With PROFILE_SLOW_REQUEST_MS set, a sampling thread records the stacks of in-flight
+requests every PROFILE_INTERVAL seconds; requests slower than the threshold have
+their samples written to PROFILE_DIR in collapsed-stack format (one "a;b;c count"
+line per stack), which flamegraph.pl and speedscope read directly.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as StackCounter
+from contextlib import ContextDecorator
+from pathlib import Path
+
+from flask import Response, before_render_template, request, template_rendered
+from sqlalchemy import event
+
+from .database import db
+
+logger = logging.getLogger(__name__)
+
+# Seconds; the upper bounds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROFILE_INTERVAL = 0.005
+PROFILE_DIR = Path("instance") / "profiles"
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Metric families in registration order, and functions adding scrape-time samples
+_metrics = []
+_collectors = []
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for v in values)
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, escaped)) + '}'
+
+
+class Counter:
+    """A monotonically increasing count per combination of label values."""
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {} if labels else {(): 0}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_labels(self.labels, key)} {value}" for key, value in values]
+
+
+class Histogram:
+    """Observations bucketed by upper bound, per combination of label values."""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket..., count above the last bound, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, *label_values):
+        slot = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[slot] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            series = [(key, list(values)) for key, values in self._series.items()]
+        lines = []
+        names = self.labels + ('le',)
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, key + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {values[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram('manga_request_seconds', 'Request latency.', ('endpoint',))
+REQUESTS = Counter('manga_requests_total', 'Requests served.', ('endpoint', 'status'))
+STAGE_SECONDS = Histogram('manga_stage_seconds', 'Time spent in each request stage, exclusive of nested stages.',
+                          ('stage',))
+SLOW_PROFILES = Counter('manga_slow_request_profiles_total', 'Profiles written for slow requests.')
+
+
+def add_collector(collect):
+    """
+    Register `collect()`, called on every scrape, returning
+    [(name, type, help, [(labels dict, value), ...]), ...] for values read at that moment.
+    """
+    _collectors.append(collect)
+
+
+def render_metrics():
+    """Every metric in Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines += [f"# HELP {metric.name} {metric.help}", f"# TYPE {metric.name} {metric.kind}"]
+        lines += metric.samples()
+    for collect in _collectors:
+        for name, kind, help, samples in collect():
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{_labels(list(labels), labels.values())} {value}" for labels, value in samples]
+    return '\n'.join(lines) + '\n'
+
+
+# --- Stage timing ---
+
+_local = threading.local()
+
+
+def _enter(name):
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    if stack and stack[-1][0] == name:
+        # Re-entering the same stage (get_similar_indices -> ..._batch) extends it
+        stack[-1][3] += 1
+        return
+    # [name, start, time spent in nested stages, re-entry depth]
+    stack.append([name, time.perf_counter(), 0.0, 0])
+
+
+def _exit():
+    stack = getattr(_local, 'stack', None)
+    if not stack:
+        return
+    frame = stack[-1]
+    if frame[3]:
+        frame[3] -= 1
+        return
+    stack.pop()
+    elapsed = time.perf_counter() - frame[1]
+    if stack:
+        stack[-1][2] += elapsed
+    own = elapsed - frame[2]
+    STAGE_SECONDS.observe(own, frame[0])
+    timings = getattr(_local, 'timings', None)
+    if timings is not None:
+        timings[frame[0]] = timings.get(frame[0], 0.0) + own
+
+
+class stage(ContextDecorator):
+    """Time a block, or every call of a function, as the stage `name` of the current request."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        _enter(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        _exit()
+        return False
+
+
+def request_timings():
+    """{stage: seconds} so far for the request on this thread."""
+    return dict(getattr(_local, 'timings', None) or {})
+
+
+# --- Slow-request profiler ---
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """
+    One daemon thread that samples the stacks of watched threads every `interval`
+    seconds. It sleeps while nothing is watched.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self._watched = {}
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread = None
+
+    def watch(self, thread_id):
+        with self._lock:
+            self._watched[thread_id] = StackCounter()
+            self._active.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+
+    def unwatch(self, thread_id):
+        """Stop sampling the thread; returns its {collapsed stack: samples}."""
+        with self._lock:
+            samples = self._watched.pop(thread_id, StackCounter())
+            if not self._watched:
+                self._active.clear()
+        return samples
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, samples in self._watched.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[_collapse(frame)] += 1
+
+
+sampler = None
+
+
+def _write_profile(samples, directory, elapsed_ms):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    now = time.time()
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(now)) + f"-{int(now * 1000) % 1000:03d}"
+    path = directory / f"{stamp}-{request.endpoint or 'unmatched'}-{elapsed_ms:.0f}ms-{os.getpid()}.folded"
+    path.write_text(''.join(f"{stack} {count}\n" for stack, count in samples.most_common()))
+    SLOW_PROFILES.inc()
+    return path
+
+
+# --- Flask and SQLAlchemy hooks ---
+
+def _start_request():
+    _local.stack = []
+    _local.timings = {}
+    _local.start = time.perf_counter()
+    if sampler is not None:
+        sampler.watch(threading.get_ident())
+
+
+def _finish_request(response, slow_ms, profile_dir):
+    start = getattr(_local, 'start', None)
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    samples = sampler.unwatch(threading.get_ident()) if sampler is not None else None
+    timings = request_timings()
+    endpoint = request.endpoint or 'unmatched'
+
+    REQUEST_SECONDS.observe(elapsed, endpoint)
+    REQUESTS.inc(endpoint, str(response.status_code))
+    response.headers['Server-Timing'] = ', '.join(
+        [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items()]
+        + [f"total;dur={elapsed * 1000:.2f}"]
+    )
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("request method=%s path=%s status=%s total_ms=%.2f%s", request.method, request.path,
+                     response.status_code, elapsed * 1000,
+                     ''.join(f" {name}_ms={seconds * 1000:.2f}" for name, seconds in timings.items()))
+    if samples and elapsed * 1000 >= slow_ms:
+        path = _write_profile(samples, profile_dir, elapsed * 1000)
+        logger.warning("Slow request %s %s took %.0f ms; profile in %s",
+                       request.method, request.path, elapsed * 1000, path)
+    return response
+
+
+def _clear_request(_exc):
+    _local.stack = []
+    _local.timings = None
+    _local.start = None
+    if sampler is not None:
+        sampler.unwatch(threading.get_ident())
+
+
+def _before_cursor_execute(*_args):
+    _enter('db_query')
+
+
+def _after_cursor_execute(*_args):
+    _exit()
+
+
+def _handle_error(_context):
+    # after_cursor_execute does not fire for a failed statement
+    _exit()
+
+
+def _before_render(*_args, **_kwargs):
+    _enter('template_render')
+
+
+def _after_render(*_args, **_kwargs):
+    _exit()
+
+
+def _app_metrics():
+    """Scrape-time values: model versions, load time and recommendation cache counters."""
+    from . import cache
+    from .collaborative import get_cf_model
+    from .recommender import models as content_models
+
+    # Read without loading: a scrape should not pay for the model load
+    families = [('manga_content_model_info', 'gauge', 'Content model version being served and its status.',
+                 [({'version': content_models.version if content_models.loaded else '',
+                    'status': content_models.status}, 1)])]
+    if content_models.loaded:
+        families.append(('manga_content_model_load_seconds', 'gauge', 'Content model load time in this worker.',
+                         [({}, content_models.load_seconds)]))
+    model = get_cf_model()
+    if model is not None:
+        families += [
+            ('manga_cf_model_info', 'gauge', 'CF model version being served.',
+             [({'version': model['version'] or 'unpublished'}, 1)]),
+            ('manga_cf_model_users', 'gauge', 'Users in the CF model.', [({}, len(model['user_map']))]),
+        ]
+
+    stats = cache.recs_cache.stats()
+    tiers = ['local'] + (['shared'] if 'shared_hits' in stats else [])
+    families += [
+        ('manga_recs_cache_hits_total', 'counter', 'Recommendation cache hits.',
+         [({'tier': tier}, stats[f'{tier}_hits']) for tier in tiers]),
+        ('manga_recs_cache_misses_total', 'counter', 'Recommendation cache misses.',
+         [({'tier': tier}, stats[f'{tier}_misses']) for tier in tiers]),
+        ('manga_recs_cache_hit_ratio', 'gauge', 'Recommendation cache hit rate since start.',
+         [({'tier': tier}, stats[f'{tier}_hit_rate']) for tier in tiers]),
+        ('manga_recs_cache_evictions_total', 'counter', 'In-process cache evictions.',
+         [({}, stats['local_evictions'])]),
+        ('manga_recs_cache_size', 'gauge', 'Entries in the in-process cache.', [({}, stats['local_size'])]),
+    ]
+    return families
+
+
+def metrics_view():
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
+
+
+def init_metrics(app):
+    """
+    Time requests and their stages, serve METRICS_PATH (None to disable) and, when
+    PROFILE_SLOW_REQUEST_MS is set, profile requests slower than that.
+    LOG_LEVEL sets the level of the app's loggers.
+    """
+    global sampler
+    app.config.setdefault('LOG_LEVEL', os.environ.get('LOG_LEVEL', 'INFO'))
+    app.config.setdefault('METRICS_PATH', '/metrics')
+    app.config.setdefault('PROFILE_SLOW_REQUEST_MS', os.environ.get('PROFILE_SLOW_REQUEST_MS'))
+    app.config.setdefault('PROFILE_INTERVAL', PROFILE_INTERVAL)
+    app.config.setdefault('PROFILE_DIR', PROFILE_DIR)
+
+    # Flask's logger (with its stderr handler) is named after the package: it covers every app.* module
+    app.logger.setLevel(app.config['LOG_LEVEL'])
+
+    slow_ms = app.config['PROFILE_SLOW_REQUEST_MS']
+    slow_ms = float(slow_ms) if slow_ms not in (None, '') else float('inf')
+    if slow_ms != float('inf') and sampler is None:
+        sampler = StackSampler(app.config['PROFILE_INTERVAL'])
+
+    app.before_request(_start_request)
+    app.after_request(lambda response: _finish_request(response, slow_ms, app.config['PROFILE_DIR']))
+    app.teardown_request(_clear_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(db.engine, 'handle_error', _handle_error)
+
+    if app.config['METRICS_PATH']:
+        app.add_url_rule(app.config['METRICS_PATH'], 'metrics', metrics_view)
+    if not _collectors:
+        add_collector(_app_metrics)
+    return app
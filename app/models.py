@@ -17,4 +17,21 @@ class Rating(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     manga_id = db.Column(db.Integer, nullable=False)
     rating = db.Column(db.Integer, nullable=False)  # 1-5 stars
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # Last write: edits move it too, which cache keys and the precompute race check rely on
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # One rating per user and manga; also serves every per-user lookup (prefix)
+        db.Index('ix_rating_user_manga', 'user_id', 'manga_id', unique=True),
+        # Incremental "changed since" exports
+        db.Index('ix_rating_timestamp', 'timestamp'),
+    )
+
+class UserRecommendations(db.Model):
+    """A user's home-page list, precomputed by the batch job in app/precompute.py."""
+    user_id = db.Column(db.Integer, primary_key=True)
+    # Hash of the (manga_id, rating) pairs the list was computed from
+    ratings_hash = db.Column(db.BigInteger, nullable=False)
+    manga_ids = db.Column(db.LargeBinary, nullable=False)  # int32 array, best first
+    scores = db.Column(db.LargeBinary, nullable=False)     # float32 array, aligned with manga_ids
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,131 @@
+# app/popularity.py
+"""
+Popularity tiers and genre-stratified sampling tables for onboarding and cold start.
+
+build_models.py writes them into the model artifact:
+
+    popularity_order                 catalog rows by descending score
+    popularity_tiers                 where each tier starts in popularity_order (TIER_FRACTIONS)
+    strata_rows, strata_offsets      per genre, its titles from the sampling tiers, most popular first
+
+"The n most popular titles" is then a slice of popularity_order. A diverse sample picks
+genres, then a random title within each genre's stratum, so it costs a handful of
+draws however large the catalog is.
+"""
+import numpy as np
+
+# Cumulative catalog fractions where the tiers end: top 1%, 5%, 20%, everything
+TIER_FRACTIONS = (0.01, 0.05, 0.20, 1.0)
+# Samples come from the first SAMPLE_TIERS tiers (the top 20%), and at least MIN_SAMPLE_POOL titles
+SAMPLE_TIERS = 3
+MIN_SAMPLE_POOL = 200
+# Draws per requested title before sample() falls back to scanning the pool
+MAX_DRAWS = 8
+
+
+class PopularityIndex:
+    def __init__(self, order, tiers, strata_rows, strata_offsets):
+        self.order = np.asarray(order)
+        self.tiers = np.asarray(tiers)
+        self.strata_rows = np.asarray(strata_rows)
+        self.strata_offsets = np.asarray(strata_offsets)
+        self.pool = self.order[:_pool_size(self.tiers)]
+        sizes = np.diff(self.strata_offsets)
+        self._genres = np.flatnonzero(sizes)
+        # Genres are drawn in proportion to their share of the sampling pool
+        self._genre_weights = sizes[self._genres] / sizes.sum() if len(self._genres) else None
+
+    @classmethod
+    def build(cls, scores, genre_bits, n_genres):
+        """From per-title scores (NaN: unscored, ranked last) and GenreIndex bitsets."""
+        scores = np.nan_to_num(np.asarray(scores, dtype=np.float64), nan=-np.inf)
+        order = np.argsort(-scores, kind='stable').astype(np.int32)
+        tiers = np.concatenate([[0], np.ceil(np.asarray(TIER_FRACTIONS) * len(order))]).astype(np.int64)
+        pool = order[:_pool_size(tiers)]
+
+        # (genre, position) pairs come out of np.nonzero sorted by genre, then by popularity
+        bits = np.asarray(genre_bits, dtype=np.uint64)[pool]
+        member = (bits[None, :] >> np.arange(n_genres, dtype=np.uint64)[:, None]) & np.uint64(1)
+        genre_of, position = np.nonzero(member)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(genre_of, minlength=n_genres))])
+        return cls(order, tiers, pool[position].astype(np.int32), offsets.astype(np.int64))
+
+    @classmethod
+    def from_artifact(cls, artifact):
+        if not artifact.has('popularity_order'):
+            return None
+        return cls(artifact.array('popularity_order'), artifact.array('popularity_tiers'),
+                   artifact.array('strata_rows'), artifact.array('strata_offsets'))
+
+    def to_arrays(self):
+        return {
+            'popularity_order': self.order,
+            'popularity_tiers': self.tiers,
+            'strata_rows': self.strata_rows,
+            'strata_offsets': self.strata_offsets,
+        }
+
+    def tier(self, k):
+        """Rows of tier k, most popular first."""
+        return self.order[self.tiers[k]:self.tiers[k + 1]]
+
+    def top(self, n, allowed=None, exclude_rows=None):
+        """
+        The n most popular rows, skipping rows outside the boolean mask `allowed` and rows
+        in `exclude_rows`. Reads popularity_order in growing chunks, so a filter costs about
+        n / (fraction of titles passing it) lookups rather than a pass over the catalog.
+        """
+        if allowed is None and exclude_rows is None:
+            return self.order[:n]
+        excluded = None if exclude_rows is None else np.asarray(list(exclude_rows), dtype=np.int64)
+        found, count, start, chunk = [], 0, 0, max(4 * n, 256)
+        while count < n and start < len(self.order):
+            rows = self.order[start:start + chunk]
+            keep = np.ones(len(rows), dtype=bool) if allowed is None else allowed[rows]
+            if excluded is not None:
+                keep &= ~np.isin(rows, excluded)
+            found.append(rows[keep])
+            count += int(keep.sum())
+            start += chunk
+            chunk *= 2
+        return np.concatenate(found)[:n] if found else self.order[:0]
+
+    def sample(self, n, rng=None, allowed=None, exclude_rows=None):
+        """
+        Up to n distinct popular rows spread across genres, in draw order.
+
+        Each round draws distinct genres (weighted by stratum size) and a random title from
+        each one's stratum; rows outside `allowed` or in `exclude_rows` are skipped. When a
+        narrow filter leaves the strata mostly empty, the rest comes from the sampling pool
+        and then from the whole catalog.
+        """
+        rng = rng or np.random.default_rng()
+        seen = set() if exclude_rows is None else set(np.asarray(exclude_rows).tolist())
+        chosen = []
+
+        def take(rows):
+            for row in rows:
+                row = int(row)
+                if row not in seen and (allowed is None or allowed[row]):
+                    seen.add(row)
+                    chosen.append(row)
+                    if len(chosen) == n:
+                        break
+
+        draws = 0
+        while len(chosen) < n and draws < MAX_DRAWS * n and len(self._genres):
+            genres = rng.choice(self._genres, size=min(n - len(chosen), len(self._genres)), replace=False,
+                                p=self._genre_weights)
+            starts, ends = self.strata_offsets[genres], self.strata_offsets[genres + 1]
+            take(self.strata_rows[starts + (rng.random(len(genres)) * (ends - starts)).astype(np.int64)])
+            draws += len(genres)
+
+        for candidates in (self.pool, self.order):
+            if len(chosen) < n:
+                rows = candidates if allowed is None else candidates[allowed[candidates]]
+                take(rng.permutation(rows))
+        return chosen
+
+
+def _pool_size(tiers):
+    return int(min(max(tiers[SAMPLE_TIERS], MIN_SAMPLE_POOL), tiers[-1]))
@@ -0,0 +1,286 @@
+# app/precompute.py
+"""
+Offline batch precomputation of per-user home-page lists.
+
+    python -m app.precompute                 # users whose ratings changed since the last run
+    python -m app.precompute --full          # every user, e.g. after new models are published
+
+Run it nightly from a scheduler. The job reads all ratings once as COO arrays and hashes
+each user's (manga_id, rating) pairs. A user is recomputed only when that hash differs
+from the one stored with their list. Users are scored in chunks over a process pool.
+For a whole chunk, the content profiles, their catalog similarities and the CF
+predictions are each one matrix product; only the final blend of each user's ~100
+candidates runs per user. The candidates and blending are the same as
+_home_recommendations in app/routes.py.
+
+Lists are stored in the user_recommendations table as packed arrays, so `index()` reads
+one row by primary key and never touches the models. A rating write deletes the user's
+row (invalidate_precomputed), and the live pipeline serves them until the next run.
+"""
+import argparse
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from sqlalchemy import inspect
+
+from . import collaborative
+from .blending import blend, union_candidates
+from .database import db
+from .hybrid import BLEND_METHOD, POOL_SIZE
+from .models import UserRecommendations
+from .profiles import NEUTRAL_RATING
+from .ranking import top_n as rank_top_n
+from .ratings import export_ratings
+from .recommender import RECORD_COLUMNS, models
+from .trainer import refresh_cf_model
+
+logger = logging.getLogger(__name__)
+
+TOP_N = 10
+ALPHA = 0.5
+# Below this many ratings the home page uses the content profile alone (as in routes.py)
+HYBRID_MIN_RATINGS = 3
+CHUNK_SIZE = 512               # users per scoring chunk, before the memory cap
+MAX_MEMORY_MB = 512            # dense (chunk, catalog) score arrays in flight, per process
+WORKERS = os.cpu_count() or 1
+
+
+# Whether this database has the user_recommendations table; checked once per process
+_store_ready = None
+
+
+def store_ready():
+    """False until `python -m app.ratings migrate` has created the table (then restart the app)."""
+    global _store_ready
+    if _store_ready is None:
+        _store_ready = inspect(db.engine).has_table(UserRecommendations.__tablename__)
+    return _store_ready
+
+
+# --- Change detection ---
+
+def ratings_hashes(ratings):
+    """
+    Order-independent hash of each user's (manga_id, rating) pairs, from COO arrays.
+    Returns (user_ids, hashes) with hashes as int64, sorted by user id.
+    """
+    user_ids, inverse = np.unique(ratings['user_id'], return_inverse=True)
+    x = ratings['manga_id'].astype(np.uint64) * np.uint64(31) + ratings['rating'].astype(np.uint64)
+    # splitmix64 finalizer, so that summing the pair hashes does not collide on simple edits
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    hashes = np.zeros(len(user_ids), dtype=np.uint64)
+    np.add.at(hashes, inverse, x)
+    return user_ids, hashes.view(np.int64)
+
+
+def _stored_hashes():
+    return dict(db.session.query(UserRecommendations.user_id, UserRecommendations.ratings_hash).all())
+
+
+# --- Scoring ---
+
+def _profile_similarities(owner, rows, weights, n_users):
+    """Cosine similarity of each user's content profile to every catalog title; NaN rows without one."""
+    if models.tfidf_matrix is None:
+        return np.full((n_users, len(models.metadata)), np.nan)
+    # Profiles as in app/profiles.py: rating-weighted sums of the rated titles' TF-IDF rows
+    weight_matrix = csr_matrix((weights, (owner, rows)), shape=(n_users, len(models.metadata)))
+    profiles = (weight_matrix @ models.tfidf_matrix).toarray()
+    norms = np.linalg.norm(profiles, axis=1)
+    sims = np.asarray(models.tfidf_matrix @ profiles.T).T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(norms[:, None] > 0, sims / norms[:, None], np.nan)
+
+
+def _cf_predictions(user_ids, cf_model):
+    """Predicted ratings for every catalog title, one row per user; NaN where the model cannot tell."""
+    scores = np.full((len(user_ids), len(models.metadata)), np.nan)
+    if cf_model is None:
+        return scores
+    known = [(pos, cf_model['user_map'][uid]) for pos, uid in enumerate(user_ids.tolist())
+             if uid in cf_model['user_map']]
+    if not known:
+        return scores
+    positions, user_rows = (np.asarray(values, dtype=np.intp) for values in zip(*known))
+    cols, found = collaborative._item_columns(cf_model, models.manga_ids)
+    scores[np.ix_(positions, np.flatnonzero(found))] = cf_model['U'][user_rows] @ cf_model['sigma_Vt'][:, cols[found]]
+    return scores
+
+
+def score_users(user_ids, indptr, manga_ids, ratings, cf_model=None, top_n=TOP_N, alpha=ALPHA,
+                pool_size=POOL_SIZE, method=BLEND_METHOD):
+    """
+    Home-page lists for a chunk of users, whose ratings are given CSR-style
+    (user i rated manga_ids[indptr[i]:indptr[i + 1]]). Users with fewer than
+    HYBRID_MIN_RATINGS ratings get their content-profile top-N, the rest the profile
+    hybrid of app/hybrid.py. Returns one (manga_ids, scores) pair of arrays per user.
+    """
+    n_users, counts = len(user_ids), np.diff(indptr)
+    owner = np.repeat(np.arange(n_users), counts)
+    rows, found = models.metadata.rows_for(manga_ids)
+    owner, rows, weights = owner[found], rows[found], (ratings[found] - NEUTRAL_RATING).astype(np.float32)
+    rated = np.zeros((n_users, len(models.metadata)), dtype=bool)
+    rated[owner, rows] = True
+
+    content = _profile_similarities(owner, rows, weights, n_users)
+    cf = _cf_predictions(user_ids, cf_model)
+    content_rows, content_top = rank_top_n(content, max(pool_size, top_n), exclude=rated | np.isnan(content))
+    cf_rows, cf_top = rank_top_n(cf, pool_size, exclude=rated | np.isnan(cf))
+
+    results = []
+    for user in range(n_users):
+        if counts[user] < HYBRID_MIN_RATINGS:
+            keep = ~np.isneginf(content_top[user, :top_n])
+            results.append((models.manga_ids[content_rows[user, :top_n][keep]], content_top[user, :top_n][keep]))
+            continue
+        candidates = union_candidates(
+            models.manga_ids[content_rows[user, :pool_size][~np.isneginf(content_top[user, :pool_size])]],
+            models.manga_ids[cf_rows[user][~np.isneginf(cf_top[user])]],
+        )
+        candidate_rows, _ = models.metadata.rows_for(candidates)
+        scores = blend(np.vstack([content[user, candidate_rows], cf[user, candidate_rows]]),
+                       [alpha, 1 - alpha], method=method)
+        order, top_scores = rank_top_n(scores, top_n)
+        results.append((candidates[order], top_scores))
+    return [(ids.astype(np.int32), scores.astype(np.float32)) for ids, scores in results]
+
+
+def chunk_size_for(n_items, chunk_size=CHUNK_SIZE, max_memory_mb=MAX_MEMORY_MB):
+    # About six (chunk, catalog) float64-sized arrays are alive while a chunk is ranked
+    return int(max(1, min(chunk_size, max_memory_mb * 2**20 // (48 * max(n_items, 1)))))
+
+
+# The CF model in each pool process, sent once by the pool initializer
+_worker_cf_model = None
+
+
+def _init_worker(cf_model):
+    global _worker_cf_model
+    _worker_cf_model = cf_model
+
+
+def _worker_chunk(chunk):
+    return score_users(*chunk, cf_model=_worker_cf_model)
+
+
+# --- Store ---
+
+def _write_chunk(chunk, results, user_hashes):
+    """Replace the chunk's rows; drop those of users whose ratings changed while the job ran."""
+    user_ids = chunk[0].tolist()
+    UserRecommendations.query.filter(UserRecommendations.user_id.in_(user_ids)).delete(synchronize_session=False)
+    now = datetime.utcnow()
+    db.session.execute(db.insert(UserRecommendations), [
+        {'user_id': uid, 'ratings_hash': user_hashes[uid], 'manga_ids': ids.tobytes(),
+         'scores': scores.tobytes(), 'updated_at': now}
+        for uid, (ids, scores) in zip(user_ids, results)
+    ])
+    # SQLite holds the write lock taken by the DELETE above until our commit, so a rating
+    # write either shows up here or commits after us and its invalidate_precomputed() wins
+    current_ids, current_hashes = ratings_hashes(export_ratings(user_ids=user_ids))
+    current = dict(zip(current_ids.tolist(), current_hashes.tolist()))
+    raced = [uid for uid in user_ids if current.get(uid) != user_hashes[uid]]
+    if raced:
+        UserRecommendations.query.filter(UserRecommendations.user_id.in_(raced)).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def precompute_recommendations(full=False, workers=WORKERS, chunk_size=CHUNK_SIZE, max_memory_mb=MAX_MEMORY_MB):
+    """
+    Refresh the stored lists (inside an app context). Only users whose ratings hash
+    changed are scored, or all with full=True. Rows of users with no ratings left are
+    deleted. Returns {'users', 'scored', 'deleted'} counts.
+    """
+    if not store_ready():
+        raise RuntimeError("No user_recommendations table; run: python -m app.ratings migrate")
+    ratings = export_ratings()
+    user_ids, hashes = ratings_hashes(ratings)
+    user_hashes = dict(zip(user_ids.tolist(), hashes.tolist()))
+    stored = _stored_hashes()
+
+    gone = [uid for uid in stored if uid not in user_hashes]
+    if gone:
+        UserRecommendations.query.filter(UserRecommendations.user_id.in_(gone)).delete(synchronize_session=False)
+        db.session.commit()
+    dirty = user_ids if full else np.asarray([uid for uid in user_ids.tolist()
+                                              if stored.get(uid) != user_hashes[uid]], dtype=np.int64)
+
+    # Each user's ratings as a contiguous slice of the user-sorted COO arrays
+    order = np.argsort(ratings['user_id'], kind='stable')
+    sorted_users = ratings['user_id'][order]
+    manga_ids, values = ratings['manga_id'][order], ratings['rating'][order]
+    size = chunk_size_for(len(models.metadata), chunk_size, max_memory_mb)
+    chunks = []
+    for start in range(0, len(dirty), size):
+        chunk_users = dirty[start:start + size]
+        begins = np.searchsorted(sorted_users, chunk_users, side='left')
+        ends = np.searchsorted(sorted_users, chunk_users, side='right')
+        take = np.concatenate([np.arange(b, e) for b, e in zip(begins, ends)]).astype(np.intp)
+        indptr = np.concatenate([[0], np.cumsum(ends - begins)])
+        chunks.append((chunk_users, indptr, manga_ids[take], values[take]))
+
+    # The published model, as the web workers use it; without one, lists are content-only
+    cf_model = refresh_cf_model(force=True)
+    models.load()
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cf_model,)) as pool:
+            # map() yields in submission order, so each result lines up with its chunk
+            for chunk, results in zip(chunks, pool.map(_worker_chunk, chunks)):
+                _write_chunk(chunk, results, user_hashes)
+    else:
+        for chunk in chunks:
+            _write_chunk(chunk, score_users(*chunk, cf_model=cf_model), user_hashes)
+
+    stats = {'users': len(user_ids), 'scored': len(dirty), 'deleted': len(gone)}
+    logger.info("Precomputed recommendations: %s", stats)
+    return stats
+
+
+def get_precomputed_recommendations(user_id, columns=RECORD_COLUMNS):
+    """The user's stored list as recommendation records, or None if there is none (or it is empty)."""
+    if not store_ready():
+        return None
+    row = db.session.get(UserRecommendations, user_id)
+    if row is None or not row.manga_ids:
+        return None
+    ids = np.frombuffer(row.manga_ids, dtype=np.int32).tolist()
+    scores = np.frombuffer(row.scores, dtype=np.float32).tolist()
+    details = models.metadata.get_many(ids, columns)
+    return [
+        {**details[manga_id], 'recommendation_score': round(score, 4)}
+        for manga_id, score in zip(ids, scores) if manga_id in details
+    ]
+
+
+def invalidate_precomputed(user_id):
+    """Rating-write hook: the stored list is stale; serve the live pipeline until the next run."""
+    if not store_ready():
+        return
+    UserRecommendations.query.filter_by(user_id=user_id).delete()
+    db.session.commit()
+
+
+if __name__ == "__main__":
+    from . import create_app
+
+    parser = argparse.ArgumentParser(description="Precompute per-user home-page recommendation lists.")
+    parser.add_argument("--full", action="store_true", help="recompute every user, not only changed ones")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="scoring processes")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="users per chunk")
+    parser.add_argument("--max-memory-mb", type=int, default=MAX_MEMORY_MB,
+                        help="cap on a chunk's dense score arrays; shrinks chunks on large catalogs")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        stats = precompute_recommendations(full=args.full, workers=args.workers, chunk_size=args.chunk_size,
+                                           max_memory_mb=args.max_memory_mb)
+    print(f"Users: {stats['users']}, scored: {stats['scored']}, deleted: {stats['deleted']}")
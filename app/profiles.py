@@ -0,0 +1,144 @@
+# app/profiles.py
+"""
+User content profiles.
+
+A profile is the rating-weighted sum of the TF-IDF rows of every title the user rated:
+ratings above NEUTRAL_RATING pull it towards a title, ratings below push it away. Ranking
+the catalog against it is one sparse-dense product, so the whole history counts, not
+just the most recently rated title.
+
+Profiles are cached per user. A rating write re-reads the user's ratings and applies
+only the weight deltas of the ones that changed. The count and latest timestamp of the
+user's ratings are stored with the profile, so a write in one worker makes every other
+worker refresh its copy on next use.
+"""
+import numpy as np
+
+from .cache import TTLCache
+from .database import db
+from .metrics import stage
+from .models import Rating
+from .ranking import top_n as rank_top_n
+from .ratings import user_ratings_version
+from .recommender import RECORD_COLUMNS, models
+
+# Ratings are 1-5 stars; weights are rating - NEUTRAL_RATING
+NEUTRAL_RATING = 2.5
+PROFILE_CACHE_SIZE = 1024
+PROFILE_CACHE_TTL = 60 * 60
+
+_profiles = TTLCache(max_size=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL)
+
+
+def _user_ratings(user_id):
+    rows = db.session.query(Rating.manga_id, Rating.rating).filter(Rating.user_id == user_id).all()
+    return {manga_id: rating for manga_id, rating in rows}
+
+
+def _weight(ratings, manga_id):
+    return ratings[manga_id] - NEUTRAL_RATING if manga_id in ratings else 0.0
+
+
+def _add_rows(vector, weights):
+    """vector += sum of weight * TF-IDF row over {manga_id: weight}; unknown ids are skipped."""
+    ids = [manga_id for manga_id, weight in weights.items() if weight]
+    rows, found = models.metadata.rows_for(ids)
+    if found.any():
+        w = np.array([weights[manga_id] for manga_id in ids], dtype=np.float32)[found]
+        vector += models.tfidf_matrix[rows[found]].T @ w
+    return vector
+
+
+def build_user_profile(user_id):
+    # Version first: a write landing in between then shows up as a stale version, not lost
+    version = user_ratings_version(user_id)
+    ratings = _user_ratings(user_id)
+    vector = np.zeros(models.tfidf_matrix.shape[1], dtype=np.float32)
+    _add_rows(vector, {manga_id: _weight(ratings, manga_id) for manga_id in ratings})
+    return {'vector': vector, 'ratings': ratings, 'version': version}
+
+
+def _refresh(user_id, profile):
+    """Apply only the rating changes since `profile` was computed."""
+    version = user_ratings_version(user_id)
+    ratings = _user_ratings(user_id)
+    old = profile['ratings']
+    deltas = {manga_id: _weight(ratings, manga_id) - _weight(old, manga_id)
+              for manga_id in old.keys() | ratings.keys()}
+    # Copy: other threads may be ranking against the cached vector
+    vector = _add_rows(profile['vector'].copy(), deltas)
+    return {'vector': vector, 'ratings': ratings, 'version': version}
+
+
+def get_user_profile(user_id):
+    """The user's up-to-date profile, built on first use and then refreshed incrementally."""
+    profile = _profiles.get(user_id)
+    if profile is None:
+        profile = build_user_profile(user_id)
+    elif profile['version'] != user_ratings_version(user_id):
+        profile = _refresh(user_id, profile)
+    else:
+        return profile
+    _profiles.set(user_id, profile)
+    return profile
+
+
+def update_user_profile(user_id):
+    """Rating-write hook: fold the user's changes into their cached profile, if any."""
+    profile = _profiles.get(user_id)
+    if profile is not None:
+        _profiles.set(user_id, _refresh(user_id, profile))
+
+
+def _unit_vector(profile):
+    if profile is None:
+        return None
+    norm = np.linalg.norm(profile['vector'])
+    return profile['vector'] / norm if norm else None
+
+
+@stage('cbf_ranking')
+def get_profile_similarities(user_id, ids):
+    """
+    Cosine similarity of the user's profile to each manga id in `ids`, aligned with it.
+    NaN for ids missing from the catalog, every entry when there is no usable profile.
+    """
+    rows, found = models.metadata.rows_for(ids)
+    sims = np.full(len(rows), np.nan)
+    unit = _unit_vector(get_user_profile(user_id)) if models.tfidf_matrix is not None else None
+    if unit is not None:
+        sims[found] = models.tfidf_matrix[rows[found]] @ unit
+    return sims
+
+
+@stage('cbf_ranking')
+def get_profile_scores(user_id, top_n=10, include_genres=None, exclude_genres=None, exclude_rated=True):
+    """
+    [(manga_id, cosine similarity to the user's profile)], best first. Empty when the
+    user has no usable ratings or no TF-IDF rows are available (legacy models).
+    """
+    profile = get_user_profile(user_id) if models.tfidf_matrix is not None else None
+    unit = _unit_vector(profile)
+    if unit is None:
+        return []
+
+    scores = models.tfidf_matrix @ unit
+    allowed = models.genre_index.mask(include_genres, exclude_genres)
+    excluded = np.zeros(len(scores), dtype=bool) if allowed is None else ~allowed
+    if exclude_rated:
+        rows, found = models.metadata.rows_for(list(profile['ratings']))
+        excluded[rows[found]] = True
+    order, top_scores = rank_top_n(scores, top_n, exclude=excluded)
+    keep = ~np.isneginf(top_scores)
+    return list(zip(models.manga_ids[order[keep]].tolist(), top_scores[keep].tolist()))
+
+
+def get_profile_recommendations(user_id, top_n=10, include_genres=None, exclude_genres=None):
+    """Content recommendations from the user's whole rating history."""
+    scores = get_profile_scores(user_id, top_n, include_genres, exclude_genres)
+    with stage('metadata_join'):
+        details = models.metadata.get_many([manga_id for manga_id, _ in scores], RECORD_COLUMNS)
+    return [
+        {**details[manga_id], 'recommendation_score': round(score, 4)}
+        for manga_id, score in scores if manga_id in details
+    ]
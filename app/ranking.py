@@ -0,0 +1,30 @@
+# app/ranking.py
+import numpy as np
+
+
+def top_n(scores, n, exclude=None):
+    """
+    Return (indices, scores) of the n highest scores, best first.
+
+    `scores` can be 1-D (one query) or 2-D (one row per query, ranked independently).
+    `exclude` is an optional boolean mask with the same shape; masked entries are
+    pushed to -inf so they rank last. Only the selected n entries are fully sorted
+    (argpartition + partial sort), so the cost is O(N + n log n) per row.
+    """
+    scores = np.asarray(scores)
+    if exclude is not None:
+        scores = np.where(exclude, -np.inf, scores)
+
+    size = scores.shape[-1]
+    n = max(min(n, size), 0)
+    if n == 0:
+        empty = scores[..., :0]
+        return empty.astype(np.intp), empty
+
+    if n < size:
+        top = np.argpartition(-scores, n - 1, axis=-1)[..., :n]
+    else:
+        top = np.broadcast_to(np.arange(size), scores.shape).copy()
+    top_scores = np.take_along_axis(scores, top, axis=-1)
+    order = np.argsort(-top_scores, axis=-1, kind="stable")
+    return np.take_along_axis(top, order, axis=-1), np.take_along_axis(top_scores, order, axis=-1)
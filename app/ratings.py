@@ -0,0 +1,205 @@
+# app/ratings.py
+"""
+Ratings data layer: schema migration, bulk upserts and columnar exports.
+
+    upsert_ratings(user_id, {manga_id: rating})   one INSERT .. ON CONFLICT for the batch
+    export_ratings(since_id=.., since=..)         COO arrays, read straight from the cursor
+
+The unique (user_id, manga_id) index makes the upsert possible and serves every per-user
+query; the app migrates an out-of-date schema at startup. export_ratings is what CF training reads. `since_id` picks up new rows only;
+upserts also bump `timestamp`, so `since` picks up edited ratings too. Deletes show up in
+neither, so consumers that need them re-read the affected users.
+
+    python -m app.ratings migrate
+    python -m app.ratings export ratings.npz [--since-id N]
+"""
+import argparse
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from sqlalchemy import bindparam, inspect, text
+from sqlalchemy.schema import CreateIndex
+
+from .database import db
+from .models import Rating
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process development server
+    fcntl = None
+
+COO_DTYPE = [('id', np.int64), ('user_id', np.int64), ('manga_id', np.int64), ('rating', np.float32)]
+
+
+def migrate_ratings():
+    """
+    Bring an existing database up to the current schema: create missing tables and the
+    rating indexes. Duplicate (user_id, manga_id) rows, which the old select-then-insert
+    writes could leave behind, are dropped first, keeping the newest of each.
+    """
+    db.create_all()
+    existing = {index['name'] for index in inspect(db.engine).get_indexes('rating')}
+    with db.engine.begin() as conn:
+        if 'ix_rating_user_manga' not in existing:
+            removed = conn.execute(text(
+                "DELETE FROM rating WHERE id NOT IN "
+                "(SELECT MAX(id) FROM rating GROUP BY user_id, manga_id)"
+            )).rowcount
+            if removed:
+                logger.warning("Removed %d duplicate ratings", removed)
+        for index in Rating.__table__.indexes:
+            if index.name not in existing:
+                # IF NOT EXISTS: workers starting together all run this
+                conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+def check_schema():
+    """Tables and rating indexes that migrate_ratings() would create; empty when up to date."""
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    missing = [table.name for table in db.metadata.sorted_tables if table.name not in tables]
+    if 'rating' in tables:
+        existing = {index['name'] for index in inspector.get_indexes('rating')}
+        missing += [index.name for index in Rating.__table__.indexes if index.name not in existing]
+    return missing
+
+
+def init_ratings(app):
+    """
+    Migrate an out-of-date schema on startup: rating writes need the unique index.
+    Workers booting together take turns on a file lock in the instance folder, so the
+    first one migrates and the rest find nothing left to do. Deploys where several hosts
+    share one database should run `python -m app.ratings migrate` before rolling out.
+    """
+    with app.app_context():
+        if not check_schema():
+            return
+        with _migration_lock(Path(app.instance_path) / ".migrate.lock"):
+            missing = check_schema()
+            if missing:
+                logger.warning("Database schema is out of date (missing %s); migrating", ", ".join(missing))
+                migrate_ratings()
+
+
+@contextmanager
+def _migration_lock(path):
+    """Blocking cross-process lock; a no-op where the file cannot be created (read-only deploys, Windows)."""
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        handle = open(path, "w")
+    except OSError:
+        handle = None
+    if handle is None or fcntl is None:
+        yield
+        return
+    with handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _insert():
+    """The dialect's INSERT construct with ON CONFLICT support (SQLite or PostgreSQL)."""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def upsert_ratings(user_id, ratings, commit=True):
+    """
+    Insert or update {manga_id: rating} for one user in a single statement, instead of
+    a SELECT per manga. Returns the number of ratings written.
+    """
+    if not ratings:
+        return 0
+    now = datetime.utcnow()
+    rows = [
+        {'user_id': user_id, 'manga_id': int(manga_id), 'rating': int(rating), 'timestamp': now}
+        for manga_id, rating in ratings.items()
+    ]
+    stmt = _insert()(Rating)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'manga_id'],
+        set_={'rating': stmt.excluded.rating, 'timestamp': stmt.excluded.timestamp},
+    )
+    db.session.execute(stmt, rows)
+    if commit:
+        db.session.commit()
+    return len(rows)
+
+
+def export_ratings(since_id=None, since=None, user_id=None, user_ids=None):
+    """
+    Ratings as COO arrays {'id', 'user_id', 'manga_id', 'rating'}, ordered by id.
+
+    Rows are streamed from the DB-API cursor into one structured array, with no ORM
+    objects or DataFrame in between. Filters: rows with id > since_id, rows written
+    at or after the datetime `since`, one user's rows, and the rows of a list of users.
+    """
+    query = "SELECT id, user_id, manga_id, rating FROM rating"
+    conditions, params = [], {}
+    if since_id is not None:
+        conditions.append("id > :since_id")
+        params['since_id'] = since_id
+    if since is not None:
+        conditions.append("timestamp >= :since")
+        params['since'] = since
+    if user_id is not None:
+        conditions.append("user_id = :user_id")
+        params['user_id'] = user_id
+    if user_ids is not None:
+        conditions.append("user_id IN :user_ids")
+        params['user_ids'] = [int(uid) for uid in user_ids]
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY id"
+
+    statement = text(query)
+    if user_ids is not None:
+        statement = statement.bindparams(bindparam('user_ids', expanding=True))
+    result = db.session.execute(statement, params)
+    rows = np.fromiter((tuple(row) for row in result), dtype=COO_DTYPE)
+    return {name: rows[name] for name, _ in COO_DTYPE}
+
+
+def latest_rating_id():
+    return db.session.query(db.func.max(Rating.id)).scalar() or 0
+
+
+def user_ratings_version(user_id):
+    """(count, latest timestamp) of one user's ratings; every insert, update or delete changes it."""
+    count, latest = db.session.query(db.func.count(Rating.id), db.func.max(Rating.timestamp)) \
+        .filter(Rating.user_id == user_id).one()
+    return count, latest
+
+
+if __name__ == "__main__":
+    from . import create_app
+
+    parser = argparse.ArgumentParser(description="Ratings table maintenance.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("migrate", help="create missing tables and indexes")
+    export = commands.add_parser("export", help="write ratings as COO arrays to an .npz file")
+    export.add_argument("output")
+    export.add_argument("--since-id", type=int, default=None, help="only ratings with a larger id")
+    args = parser.parse_args()
+
+    app = create_app()
+    if args.command == "migrate":
+        with app.app_context():
+            migrate_ratings()
+        print("Schema is up to date.")
+    elif args.command == "export":
+        with app.app_context():
+            coo = export_ratings(since_id=args.since_id)
+        np.savez(args.output, **coo)
+        print(f"Exported {len(coo['id'])} ratings to {args.output}")
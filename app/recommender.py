@@ -1,71 +1,366 @@
 # app/recommender.py
 import joblib
-import pandas as pd
 import numpy as np
 from pathlib import Path
-import random
-
+import logging
+import os
+import threading
+import time
+from scipy.sparse import csr_matrix
 
+from .ranking import top_n as rank_top_n
+from .title_index import TitleIndex
+from .artifacts import open_artifact
+from .ann import IVFIndex
+from .metadata import MetadataStore
+from .genres import GenreIndex
+from .popularity import PopularityIndex
+from .metrics import stage
 
+logger = logging.getLogger(__name__)
 
 MODELS_DIR = Path("models")
+ARTIFACTS_DIR = MODELS_DIR / "artifacts"
+METADATA_COLUMNS = ['title', 'genres', 'synopsis', 'image_url']
+# Fields of a recommendation record
+RECORD_COLUMNS = ['id', *METADATA_COLUMNS]
+
+class ModelRegistry:
+    """
+    The content model, loaded on first use rather than at import.
+
+    Reading any model attribute (`models.metadata`, `models.tfidf_matrix`, ...) loads it
+    once, under a lock; after that they are plain instance attributes. `load()` does the
+    same up front (MODELS_PRELOAD, or the gunicorn master with preload_app).
+    Whatever cannot be read is listed in `errors`, and the app serves what is left:
+    without similarity data, content recommendations fall back to popularity.
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.load_seconds = None
+
+    def load(self):
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    start = time.perf_counter()
+                    state = self._loader()
+                    self.__dict__.update(state)
+                    self.load_seconds = time.perf_counter() - start
+                    self.loaded = True
+                    logger.info("Loaded content model %s (%d titles) in %.2f s", self.version,
+                                len(self.metadata), self.load_seconds)
+                    for error in self.errors:
+                        logger.warning("Content model degraded: %s", error)
+        return self
+
+    def __getattr__(self, name):
+        # Only reached for attributes that are not set, i.e. model attributes before the load
+        if name.startswith('_') or self.loaded:
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    @property
+    def status(self):
+        """'not_loaded', 'ready', or 'degraded' when part of the model is missing."""
+        if not self.loaded:
+            return 'not_loaded'
+        return 'degraded' if self.errors or not self.has_similarity else 'ready'
+
 
 def load_models():
+    """
+    Open the current model artifact (see app/artifacts.py). Arrays are memory-mapped,
+    so gunicorn workers share one copy through the page cache and nothing is parsed.
+    Falls back to the pre-artifact joblib/CSV files if no artifact has been built.
+    Returns the registry's attributes as a dict.
+    """
+    errors = []
+    try:
+        artifact = open_artifact(ARTIFACTS_DIR)
+    except (OSError, ValueError) as e:
+        errors.append(f"cannot open {ARTIFACTS_DIR}: {e}")
+        artifact = None
+    state = load_artifact_models(artifact) if artifact is not None else load_legacy_models(errors)
+
+    # Row index -> manga id
+    state['manga_ids'] = state['metadata'].ids
+    state['has_similarity'] = any(state[name] is not None for name in ('neighbors', 'cosine_sim', 'tfidf_matrix'))
+    state['popularity'] = state.pop('popularity', None) or _build_popularity(state['metadata'], state['genre_index'])
+    state['errors'] = errors
+    return state
+
+def load_artifact_models(artifact):
+    if artifact.has('neighbor_indices'):
+        # Top-k neighbour index: (indices, scores), each of shape (N, k)
+        neighbors = (artifact.array('neighbor_indices'), artifact.array('neighbor_scores'))
+        cosine_sim = None
+    else:
+        neighbors = None
+        cosine_sim = artifact.array('cosine_sim')
+
+    # Id-indexed view over the artifact's columns; no DataFrame is built
+    metadata = MetadataStore.from_artifact(artifact, METADATA_COLUMNS, numeric_columns=['score'])
+    return {
+        'artifact': artifact,
+        'version': artifact.version,
+        'cosine_sim': cosine_sim,
+        'neighbors': neighbors,
+        'metadata': metadata,
+        # Exact / prefix / substring / fuzzy title search
+        'title_index': TitleIndex(metadata.columns['title'].tolist()),
+        'genre_index': GenreIndex.from_artifact(artifact),
+        'tfidf_matrix': get_tfidf_matrix(artifact, len(metadata)),
+        'tfidf_ann': IVFIndex.from_artifact(artifact),
+        # Popularity tiers and genre strata; built at load time for older artifacts
+        'popularity': PopularityIndex.from_artifact(artifact),
+    }
+
+def load_legacy_models(errors):
     # If models missing, user should run build_models.py
-    tfidf = joblib.load(MODELS_DIR / "tfidf_vectorizer.joblib")
-    cosine_sim = joblib.load(MODELS_DIR / "cosine_sim.joblib")
-    df = pd.read_csv(MODELS_DIR / "manga_indexed.csv")
-    # Build map
-    title_to_idx = {t.lower(): idx for idx, t in enumerate(df['title'].astype(str))}
-    return tfidf, cosine_sim, df, title_to_idx
+    import pandas as pd  # slow to import, and only this fallback reads CSV
+
+    try:
+        df = pd.read_csv(MODELS_DIR / "manga_indexed.csv")
+        metadata = MetadataStore.from_dataframe(df[['id', *METADATA_COLUMNS, *(['score'] if 'score' in df else [])]])
+    except OSError as e:
+        errors.append(f"no catalog: {e}")
+        metadata = MetadataStore(np.zeros(0, dtype=np.int64), {name: [] for name in METADATA_COLUMNS})
+    try:
+        cosine_sim = joblib.load(MODELS_DIR / "cosine_sim.joblib")
+    except OSError as e:
+        errors.append(f"no similarity matrix: {e}")
+        cosine_sim = None
+    return {
+        'artifact': None,
+        'version': 'legacy',
+        'cosine_sim': cosine_sim,
+        'neighbors': None,
+        'metadata': metadata,
+        'title_index': TitleIndex(metadata.columns['title']),
+        'genre_index': GenreIndex.from_strings(metadata.columns['genres']),
+        'tfidf_matrix': None,
+        'tfidf_ann': None,
+    }
+
+def get_tfidf_matrix(artifact, n_rows):
+    """Normalized TF-IDF rows as a CSR matrix over the memory-mapped artifact arrays."""
+    return csr_matrix(
+        (artifact.array('tfidf_data'), artifact.array('tfidf_indices'), artifact.array('tfidf_indptr')),
+        shape=(n_rows, artifact.meta['vocabulary']),
+    )
+
+def _build_popularity(metadata, genre_index):
+    """Popularity tables for catalogs built without them (scores NaN-ranked last, catalog order without scores)."""
+    score = metadata.columns.get('score')
+    score = np.full(len(metadata), np.nan) if score is None else score
+    return PopularityIndex.build(score, genre_index.bits, len(genre_index.names))
+
+models = ModelRegistry(load_models)
+
+def init_models(app):
+    """Load the content model at startup when MODELS_PRELOAD is set; otherwise on first use."""
+    app.config.setdefault('MODELS_PRELOAD', os.environ.get('MODELS_PRELOAD') == '1')
+    if app.config['MODELS_PRELOAD']:
+        models.load()
+    return models
+
+def search_similar_vectors(queries, top_n, exclude=None, n_probe=None, allowed=None):
+    """
+    Rank catalog rows by cosine similarity to each query row (sparse TF-IDF vectors).
+    Uses the IVF index when one was built, otherwise an exact sparse product.
+    `allowed` is an optional boolean mask over the catalog (e.g. a genre filter).
+    Returns (row_indices, scores) arrays of shape (n_queries, top_n); missing slots are -1.
+    """
+    if models.tfidf_ann is None:
+        return _exact_similar_vectors(queries, top_n, exclude, allowed)
 
-tfidf, cosine_sim, manga_df, title_to_idx = load_models()
+    indices, scores = models.tfidf_ann.search(models.tfidf_matrix, queries, top_n, n_probe=n_probe,
+                                              exclude=exclude, allowed=allowed)
+    if allowed is not None:
+        # A narrow filter can leave the probed partitions with fewer than top_n allowed
+        # titles; rank those queries exactly rather than return a short list
+        short = np.flatnonzero((indices < 0).any(axis=1))
+        if len(short):
+            indices, scores = indices.copy(), scores.copy()
+            indices[short], scores[short] = _exact_similar_vectors(
+                queries[short], top_n, None if exclude is None else [exclude[i] for i in short], allowed)
+    return indices, scores
 
+def _exact_similar_vectors(queries, top_n, exclude=None, allowed=None):
+    sims = (queries @ models.tfidf_matrix.T).toarray()
+    mask = np.zeros(sims.shape, dtype=bool) if exclude is not None or allowed is not None else None
+    if exclude is not None:
+        for i, rows in enumerate(exclude):
+            mask[i, rows] = True
+    if allowed is not None:
+        mask |= ~allowed
+    indices, scores = rank_top_n(sims, top_n, exclude=mask)
+    indices = np.where(np.isneginf(scores), -1, indices)
+    return indices, scores
+
+def get_vectorizer():
+    """The fitted TfidfVectorizer, unpickled on first use since serving does not need it."""
+    if models.artifact is not None:
+        return models.artifact.load_object('tfidf_vectorizer')
+    return joblib.load(MODELS_DIR / "tfidf_vectorizer.joblib")
+
+@stage('title_resolution')
 def find_closest_title(query):
-    q = query.strip().lower()
-    if q in title_to_idx:
-        return q, title_to_idx[q]
-    # fallback: try simple partial match
-    for title, idx in title_to_idx.items():
-        if q in title:
-            return title, idx
-    return None, None
-
-def get_cbf_recommendations(manga_title, top_n=8):
+    """Return (title, row_index) of the best exact, prefix, substring or fuzzy match."""
+    if not query:
+        return None, None
+    return models.title_index.lookup(query)
+
+@stage('title_resolution')
+def search_titles(query, limit=10):
+    """
+    Ranked title matches for autocomplete: [{'id', 'title'}, ...], best first.
+    """
+    title_index = models.title_index
+    matches = title_index.search(query, limit=limit)
+    return [
+        {'id': int(models.manga_ids[row]), 'title': title_index.titles[row]}
+        for row, _, _ in matches
+    ]
+
+def get_similar_indices(idx, top_n, allowed=None):
+    """
+    Return (row_indices, similarities) arrays for the top_n titles most similar to row idx.
+    Reads the top-k neighbour index when available, so top_n is capped at k.
+    """
+    rows, scores = get_similar_indices_batch([idx], top_n, allowed=allowed)
+    return rows[0], scores[0]
+
+@stage('cbf_ranking')
+def get_similar_indices_batch(idxs, top_n, allowed=None):
+    """
+    Batch version of get_similar_indices: one row of results per seed row index.
+    `allowed` is an optional boolean mask over the catalog; only those titles are ranked.
+    Returns two (len(idxs), top_n) arrays; slots nothing qualified for are -1.
+    """
+    idxs = np.asarray(idxs, dtype=np.intp)
+    neighbors, cosine_sim, tfidf_matrix = models.neighbors, models.cosine_sim, models.tfidf_matrix
+    if not models.has_similarity:
+        # Degraded: no similarity data was loaded, so nothing qualifies
+        return np.full((len(idxs), top_n), -1), np.full((len(idxs), top_n), -np.inf)
+    if neighbors is not None:
+        indices, scores = neighbors
+        if allowed is None and (top_n <= indices.shape[1] or tfidf_matrix is None):
+            return indices[idxs, :top_n], scores[idxs, :top_n]
+        if allowed is not None:
+            # Filter the stored lists; enough when every seed keeps top_n allowed neighbours
+            rows = indices[idxs]
+            kept = allowed[rows]
+            if (top_n <= indices.shape[1] and kept.sum(axis=1).min() >= top_n) or tfidf_matrix is None:
+                top, top_scores = rank_top_n(np.where(kept, scores[idxs], -np.inf), top_n)
+                top_rows = np.take_along_axis(rows, top, axis=1)
+                return np.where(np.isneginf(top_scores), -1, top_rows), top_scores
+        # Deeper than the stored top-k, or a narrow filter: query the TF-IDF vectors directly
+        return search_similar_vectors(tfidf_matrix[idxs], top_n, exclude=[[i] for i in idxs],
+                                      allowed=allowed)
+
+    # Dense matrix: rank every seed row in one vectorized call, excluding the seed itself
+    sims = np.asarray(cosine_sim[idxs], dtype=np.float32)
+    mask = np.zeros(sims.shape, dtype=bool)
+    mask[np.arange(len(idxs)), idxs] = True
+    if allowed is not None:
+        mask |= ~allowed
+    indices, scores = rank_top_n(sims, top_n, exclude=mask)
+    return np.where(np.isneginf(scores), -1, indices), scores
+
+def get_cbf_recommendations(manga_title, top_n=8, include_genres=None, exclude_genres=None):
+    if not models.has_similarity:
+        return get_popular_recommendations(top_n, include_genres, exclude_genres)
+    metadata = models.metadata
+    allowed = models.genre_index.mask(include_genres, exclude_genres)
     _, idx = find_closest_title(manga_title)
     if idx is None:
-        # return top popular by score if can't find title
-        top = manga_df.head(top_n)
-        return top.to_dict(orient='records')
+        # No matching title: the most popular titles passing the filter
+        return get_popular_recommendations(top_n, include_genres, exclude_genres)
 
-    sim_scores = list(enumerate(cosine_sim[idx]))
-    sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)[1: top_n+1]
-    indices = [i for i, s in sim_scores]
-    results = manga_df.iloc[indices][['id','title','genres','synopsis','image_url']]
-    # short synopsis
-    results['synopsis'] = results['synopsis'].fillna('')
-    
-    return results.to_dict(orient='records')
+    indices, _ = get_similar_indices(idx, top_n, allowed=allowed)
+    with stage('metadata_join'):
+        return metadata.records(indices[indices >= 0].tolist(), RECORD_COLUMNS)
 
+def _rated_rows(exclude_ids):
+    if not exclude_ids:
+        return None
+    rows, found = models.metadata.rows_for(list(exclude_ids))
+    return rows[found]
 
+def get_popular_recommendations(top_n=8, include_genres=None, exclude_genres=None, exclude_ids=None):
+    """The highest-scored titles passing the genre filter; what content ranking degrades to."""
+    allowed = models.genre_index.mask(include_genres, exclude_genres)
+    rows = models.popularity.top(top_n, allowed=allowed, exclude_rows=_rated_rows(exclude_ids))
+    with stage('metadata_join'):
+        return models.metadata.records(rows.tolist(), RECORD_COLUMNS)
 
-def get_random_manga_samples(df, n=10):
-    # Shuffle the dataframe and pick random rows
-    sample_df = df.sample(n=n)
-    return sample_df.to_dict(orient='records')
+def get_random_manga_samples(n=10, columns=None, include_genres=None, exclude_genres=None, exclude_ids=None,
+                             rng=None):
+    """
+    Popular titles spread across genres, for onboarding and cold start. Drawn from the
+    genre strata of the top popularity tiers, skipping `exclude_ids` (titles already rated).
+    """
+    rows = models.popularity.sample(n, rng=rng, allowed=models.genre_index.mask(include_genres, exclude_genres),
+                                    exclude_rows=_rated_rows(exclude_ids))
+    with stage('metadata_join'):
+        return models.metadata.records(rows, columns or RECORD_COLUMNS)
 
-def get_cbf_scores(title, top_n=10):
+def get_cbf_scores(title, top_n=10, include_genres=None, exclude_genres=None):
     """
     Return list of (manga_id, similarity_score) instead of just titles.
     """
-    if title not in manga_df['title'].values:
+    _, idx = find_closest_title(title)
+    if idx is None:
         return []
 
-    # Find the index of the selected manga
-    idx = manga_df[manga_df['title'] == title].index[0]
+    indices, scores = get_similar_indices(
+        idx, top_n, allowed=models.genre_index.mask(include_genres, exclude_genres)
+    )
+    found = indices >= 0
+    results = list(zip(models.manga_ids[indices[found]].tolist(), scores[found].tolist()))
+    return results
+
+@stage('cbf_ranking')
+def get_cbf_similarities(idx, ids):
+    """
+    Cosine similarity of catalog row idx to each manga id in `ids`, aligned with it
+    (NaN for ids missing from the catalog). Exact for any id, not only stored neighbours.
+    """
+    rows, found = models.metadata.rows_for(ids)
+    sims = np.full(len(rows), np.nan)
+    if models.tfidf_matrix is not None:
+        tfidf_matrix = models.tfidf_matrix
+        sims[found] = (tfidf_matrix[rows[found]] @ tfidf_matrix[idx].T).toarray().ravel()
+    elif models.cosine_sim is not None:
+        sims[found] = models.cosine_sim[idx, rows[found]]
+    return sims
+
+def get_cbf_scores_batch(titles, top_n=10, include_genres=None, exclude_genres=None):
+    """
+    Score many seed titles at once.
+    Returns one list of (manga_id, similarity_score) per title; unknown titles get [].
+    """
+    positions = []
+    idxs = []
+    for pos, title in enumerate(titles):
+        _, idx = find_closest_title(title)
+        if idx is not None:
+            positions.append(pos)
+            idxs.append(idx)
 
-    sim_scores = list(enumerate(cosine_sim[idx]))
-    sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)[1:top_n+1]
+    results = [[] for _ in titles]
+    if not idxs:
+        return results
 
-    results = [(int(manga_df.iloc[i]['id']), score) for i, score in sim_scores]
+    indices, scores = get_similar_indices_batch(
+        idxs, top_n, allowed=models.genre_index.mask(include_genres, exclude_genres)
+    )
+    ids = models.manga_ids[indices]
+    for pos, row_ids, row_scores, found in zip(positions, ids.tolist(), scores.tolist(), (indices >= 0).tolist()):
+        results[pos] = [(mid, score) for mid, score, ok in zip(row_ids, row_scores, found) if ok]
     return results
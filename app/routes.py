@@ -1,33 +1,103 @@
 from flask_login import current_user, login_required
 from .models import Rating
 from .database import db
-from flask import Blueprint, render_template, request, redirect,url_for,session,flash
-from .recommender import get_cbf_recommendations,manga_df,get_random_manga_samples,get_cbf_scores
-from .hybrid import get_hybrid_recommendations
+from .ratings import export_ratings, upsert_ratings
+from flask import Blueprint, render_template, request, redirect,url_for,session,flash,jsonify
+from .recommender import get_cbf_recommendations,models,get_random_manga_samples,get_cbf_scores,search_titles
+from .hybrid import get_hybrid_recommendations, get_profile_hybrid_recommendations
+from .profiles import get_profile_recommendations, update_user_profile
+from .trainer import on_ratings_changed
+from .collaborative import get_cf_model
+from .title_index import normalize_title
+from .genres import normalize_genre
+from .metrics import stage
+from .precompute import get_precomputed_recommendations, invalidate_precomputed
+from . import cache
 
 main = Blueprint('main', __name__)
 
+# Fields shown on the home page cards
+HOME_COLUMNS = ['id', 'title', 'genres', 'image_url']
+
+
+def _cf_version():
+    model = get_cf_model()
+    return model['version'] if model is not None else None
+
+
+def _rating_count(user_id):
+    return cache.recs_cache.get_or_compute(
+        'rating_count', (), lambda: Rating.query.filter_by(user_id=user_id).count(), user_id=user_id
+    )
+
+
+def ratings_changed(user_id):
+    """After any rating write: update the CF model and profile, drop the user's cached lists."""
+    on_ratings_changed(user_id)
+    invalidate_precomputed(user_id)
+    cache.recs_cache.invalidate_user(user_id)
+    update_user_profile(user_id)
+
+
+def _rated_ids():
+    """Manga ids the current user (or guest session) has rated; kept out of cold-start samples."""
+    if current_user.is_authenticated:
+        return export_ratings(user_id=current_user.id)['manga_id'].tolist()
+    return [int(manga_id) for manga_id in session.get('guest_ratings', {})]
+
+
+def _home_recommendations(user_id):
+    """Recommendations from the user's content profile; None if they have no ratings."""
+    # List from the nightly batch job (app/precompute.py), if it is current: one primary-key read
+    precomputed = get_precomputed_recommendations(user_id)
+    if precomputed:
+        return precomputed
+
+    user_ratings_count = _rating_count(user_id)
+    if not user_ratings_count:
+        return None
+
+    if user_ratings_count >= 3:
+        # Hybrid recommendations over the whole rating history
+        recommendations = get_profile_hybrid_recommendations(user_id, alpha=0.5, top_n=10)
+    else:
+        # Too few ratings for CF: content profile only
+        recommendations = get_profile_recommendations(user_id, top_n=10)
+    # Only neutral ratings (or legacy models without TF-IDF rows) → random diverse recommendations
+    return recommendations or get_random_manga_samples(n=10, columns=HOME_COLUMNS, exclude_ids=_rated_ids())
+
+
+def _title_recommendations(title, top_n=8, include_genres=(), exclude_genres=()):
+    filters = (tuple(sorted(map(normalize_genre, include_genres))),
+               tuple(sorted(map(normalize_genre, exclude_genres))))
+    if current_user.is_authenticated and _rating_count(current_user.id) >= 3:
+        return cache.recs_cache.get_or_compute(
+            'hybrid', (normalize_title(title), top_n, _cf_version(), *filters),
+            lambda: get_hybrid_recommendations(current_user.id, title, alpha=0.5, top_n=top_n,
+                                               include_genres=include_genres, exclude_genres=exclude_genres),
+            user_id=current_user.id,
+        )
+    return cache.recs_cache.get_or_compute(
+        'cbf', (normalize_title(title), top_n, *filters),
+        lambda: get_cbf_recommendations(title, top_n=top_n, include_genres=include_genres,
+                                        exclude_genres=exclude_genres),
+    )
+
 
 @main.route("/")
 def index():
     recommendations = []
 
     if current_user.is_authenticated:
-        # Logged-in user
-        has_ratings = Rating.query.filter_by(user_id=current_user.id).count() > 0
-        if not has_ratings:
+        # Logged-in user. Cached until their next rating write (or a new CF model),
+        # so a cache hit costs one indexed lookup of their ratings' count and latest timestamp.
+        recommendations = cache.recs_cache.get_or_compute(
+            'index', (_cf_version(),),
+            lambda: _home_recommendations(current_user.id),
+            user_id=current_user.id,
+        )
+        if recommendations is None:
             return redirect(url_for("main.onboarding"))
-        user_ratings_count = Rating.query.filter_by(user_id=current_user.id).count()
-
-        if user_ratings_count >= 3:
-            # Hybrid recommendations
-            # Use their most recently rated manga as a seed
-            last_rating = Rating.query.filter_by(user_id=current_user.id).order_by(Rating.id.desc()).first()
-            seed_title = manga_df[manga_df['id'] == last_rating.manga_id]['title'].values[0]
-            recommendations = get_hybrid_recommendations(current_user.id, seed_title, alpha=0.5, top_n=10)
-        else:
-            # Not enough ratings → random diverse recommendations
-            recommendations = manga_df.sample(10)[['title', 'genres','image_url']].to_dict(orient='records')
 
     else:
         # Guest user
@@ -37,13 +107,14 @@ def index():
 
         if guest_history:
             # Use guest's last viewed manga for CBF
-            last_manga_id = guest_history[-1]
-            seed_title = manga_df[manga_df['manga_id'] == last_manga_id]['title'].values[0]
-            cbf_recs = get_cbf_scores(seed_title, top_n=10)
-            recommendations = [{'title': t, 'genre': manga_df[manga_df['title'] == t]['genre'].values[0]} for t, _ in cbf_recs]
-        else:
+            seed = models.metadata.get(int(guest_history[-1]), ['title'])
+            cbf_recs = get_cbf_scores(seed['title'], top_n=10) if seed is not None else []
+            with stage('metadata_join'):
+                details = models.metadata.get_many([mid for mid, _ in cbf_recs], HOME_COLUMNS)
+            recommendations = list(details.values())
+        if not recommendations:
             # No history → random diverse recommendations
-            recommendations = manga_df.sample(10)[['title', 'genres','image_url']].to_dict(orient='records')
+            recommendations = get_random_manga_samples(n=10, columns=HOME_COLUMNS, exclude_ids=_rated_ids())
 
     return render_template("index.html", recommendations=recommendations)
 
@@ -51,60 +122,39 @@ def index():
 
 @main.route("/recommend", methods=["GET","POST"])
 def recommend():
-    print("Is user authenticated?", current_user.is_authenticated)
-
     if request.method == 'POST':
         title = request.form.get('title')
-    
-        if current_user.is_authenticated:
-            user_ratings_count = Rating.query.filter_by(user_id=current_user.id).count()
-            if user_ratings_count >= 3:
-                print("hybrid")
-                recs = get_hybrid_recommendations(current_user.id, title, alpha=0.5, top_n=8)
-            else:
-                print("Non-hybrid")
-                recs = get_cbf_recommendations(title, top_n=8)
-        else:
-            print("Non Hybrid")
-            recs = get_cbf_recommendations(title, top_n=8)
-    
-        return render_template("results.html", title=title, recommendations=recs)
-    title = request.args.get('title')
-    if current_user.is_authenticated:
-            user_ratings_count = Rating.query.filter_by(user_id=current_user.id).count()
-            if user_ratings_count >= 3:
-                print("hybrid")
-                recs = get_hybrid_recommendations(current_user.id, title, alpha=0.5, top_n=8)
-            else:
-                print("Non-hybrid")
-                recs = get_cbf_recommendations(title, top_n=8)
     else:
-            print("Non Hybrid")
-            recs = get_cbf_recommendations(title, top_n=8)
-    
+        title = request.args.get('title')
+
+    # Optional genre filters: ?genre=Romance&exclude_genre=Horror (repeatable)
+    recs = _title_recommendations(title or '', top_n=8,
+                                  include_genres=request.values.getlist('genre'),
+                                  exclude_genres=request.values.getlist('exclude_genre'))
     return render_template("results.html", title=title, recommendations=recs)
 
 
 
+@main.route("/autocomplete")
+def autocomplete():
+    query = request.args.get('q', '')
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    return jsonify(search_titles(query, limit=limit))
+
+
+
 @main.route("/rate", methods=["GET","POST"])
 
 @login_required
 def rate_manga():
-    print("DEBUG: /rate was hit!")
     if request.method == 'POST':
         manga_id = int(request.form.get("manga_id"))
         rating_value = int(request.form.get("rating"))
         next_url = request.form.get("next")
         title = request.form.get("title")
     # Update if exists, else add
-        existing = Rating.query.filter_by(user_id=current_user.id, manga_id=manga_id).first()
-        if existing:
-            existing.rating = rating_value
-        else:
-            new_rating = Rating(user_id=current_user.id, manga_id=manga_id, rating=rating_value)
-            db.session.add(new_rating)
-        db.session.commit()
-        print(title)
+        upsert_ratings(current_user.id, {manga_id: rating_value})
+        ratings_changed(current_user.id)
         return redirect(url_for('main.recommend',title=title))
     return redirect(url_for('main.index'))
 
@@ -117,24 +167,17 @@ def onboarding():
         ratings = request.form.to_dict(flat=False)  # { 'manga_id': ['rating'], ... }
 
         if current_user.is_authenticated:
-            # Save directly to DB
-            for manga_id, rating_list in ratings.items():
-                rating_value = int(rating_list[0])
-                existing = Rating.query.filter_by(user_id=current_user.id, manga_id=manga_id).first()
-                if existing:
-                    existing.rating = rating_value
-                else:
-                    new_rating = Rating(user_id=current_user.id, manga_id=manga_id, rating=rating_value)
-                    db.session.add(new_rating)
-            db.session.commit()
+            # Save directly to DB, all ratings in one statement
+            upsert_ratings(current_user.id, {manga_id: int(rating_list[0]) for manga_id, rating_list in ratings.items()})
+            ratings_changed(current_user.id)
         else:
             # Save to session for guest user
             session['guest_ratings'] = {manga_id: int(rating_list[0]) for manga_id, rating_list in ratings.items()}
 
         return redirect(url_for("main.index"))
 
-    # GET → show random sample
-    sample_mangas = get_random_manga_samples(manga_df, n=10)
+    # GET → popular titles across genres, minus anything already rated
+    sample_mangas = get_random_manga_samples(n=10, exclude_ids=_rated_ids())
     return render_template("onboarding.html", sample_mangas=sample_mangas)
 
 
@@ -144,10 +187,13 @@ def dashboard():
     # Get all ratings for the current user
     ratings = Rating.query.filter_by(user_id=current_user.id).all()
 
-    # Match manga_id with manga_df for title & genre
+    # Title & genre for every rated manga in one lookup
+    details = models.metadata.get_many([r.manga_id for r in ratings], ['title', 'genres'])
     user_data = []
     for r in ratings:
-        manga_info = manga_df[manga_df['id'] == r.manga_id].iloc[0]
+        manga_info = details.get(r.manga_id)
+        if manga_info is None:
+            continue
         user_data.append({
             'id': r.id,
             'manga_id': r.manga_id,
@@ -167,8 +213,8 @@ def edit_rating(rating_id):
         flash("Unauthorized action!", "danger")
         return redirect(url_for('main.dashboard'))
 
-    rating.rating = new_rating
-    db.session.commit()
+    upsert_ratings(current_user.id, {rating.manga_id: new_rating})
+    ratings_changed(current_user.id)
     flash("Rating updated successfully!", "success")
     return redirect(url_for('main.dashboard'))
 
@@ -182,5 +228,6 @@ def delete_rating(rating_id):
 
     db.session.delete(rating)
     db.session.commit()
+    ratings_changed(current_user.id)
     flash("Rating deleted successfully!", "success")
     return redirect(url_for('main.dashboard'))
@@ -0,0 +1,152 @@
+# app/title_index.py
+import re
+import unicodedata
+from bisect import bisect_left
+
+import numpy as np
+
+# Match tiers, best first (NO_MATCH marks rows outside every tier)
+EXACT, PREFIX, SUBSTRING, FUZZY, NO_MATCH = range(5)
+# Minimum trigram similarity for a fuzzy match to count, as an autocomplete suggestion
+MIN_FUZZY_SIMILARITY = 0.3
+# ... and to resolve a query to a single title (lookup), so that nonsense resolves to nothing
+MIN_LOOKUP_SIMILARITY = 0.6
+# Shared trigrams a fuzzy match needs: one is only the padded first letter, which short
+# queries would otherwise match on ('xq' -> 'X')
+MIN_FUZZY_OVERLAP = 2
+# Queries shorter than a trigram have no inner grams; their substrings come from the
+# 1- and 2-character gram index instead
+MIN_GRAM_QUERY = 3
+
+
+def normalize_title(title):
+    """Lowercase, strip accents and punctuation, and collapse whitespace."""
+    text = unicodedata.normalize("NFKD", str(title))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"[^\w]+", " ", text.casefold())
+    return " ".join(text.split())
+
+
+def short_grams(text):
+    """Every 1- and 2-character substring of a normalized title."""
+    return {text[i:i + n] for n in (1, 2) for i in range(len(text) - n + 1)}
+
+
+def trigrams(text):
+    """Character trigrams of a normalized title, padded so short titles still get grams."""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex:
+    """
+    Prebuilt title search index shared by the recommenders and the autocomplete endpoint.
+
+    - exact:     dict of normalized title -> row
+    - prefix:    sorted array of normalized titles, searched with bisect
+    - substring/fuzzy: character trigram inverted index; candidate overlap counts are
+      computed with one np.bincount over the query's posting lists
+    - short substrings: 1- and 2-character gram inverted index, for queries too short
+      to have an inner trigram
+    """
+
+    def __init__(self, titles):
+        self.titles = [str(t) for t in titles]
+        self.normalized = [normalize_title(t) for t in self.titles]
+
+        self.exact = {}
+        for idx, key in enumerate(self.normalized):
+            self.exact.setdefault(key, idx)
+
+        order = sorted(range(len(self.normalized)), key=lambda i: self.normalized[i])
+        self.sorted_keys = [self.normalized[i] for i in order]
+        self.sorted_rows = np.asarray(order, dtype=np.int32)
+
+        postings, short_postings = {}, {}
+        gram_counts = np.zeros(len(self.normalized), dtype=np.int32)
+        for idx, key in enumerate(self.normalized):
+            grams = trigrams(key)
+            gram_counts[idx] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(idx)
+            for gram in short_grams(key):
+                short_postings.setdefault(gram, []).append(idx)
+        self.postings = {gram: np.asarray(rows, dtype=np.int32) for gram, rows in postings.items()}
+        self.short_postings = {gram: np.asarray(rows, dtype=np.int32)
+                               for gram, rows in short_postings.items()}
+        self.gram_counts = gram_counts
+
+    def __len__(self):
+        return len(self.titles)
+
+    def _prefix_rows(self, q):
+        """Rows of every title starting with q: one contiguous run of the sorted keys."""
+        lo = bisect_left(self.sorted_keys, q)
+        hi = bisect_left(self.sorted_keys, q + "\U0010ffff", lo)
+        return self.sorted_rows[lo:hi]
+
+    def _trigram_overlap(self, q):
+        grams = trigrams(q)
+        lists = [self.postings[g] for g in grams if g in self.postings]
+        if not lists:
+            return grams, None
+        counts = np.bincount(np.concatenate(lists), minlength=len(self.titles))
+        return grams, counts
+
+    def _substring_rows(self, q, grams, counts):
+        if len(q) < MIN_GRAM_QUERY:
+            return self.short_postings.get(q, np.empty(0, dtype=np.int32))
+        if counts is None:
+            return np.empty(0, dtype=np.int32)
+        # A substring must contain every inner query trigram (the padded edge ones may be missing)
+        needed = len({g for g in grams if not g.startswith(" ") and not g.endswith(" ")})
+        candidates = np.flatnonzero(counts >= needed)
+        return np.asarray([row for row in candidates.tolist() if q in self.normalized[row]],
+                          dtype=np.int32)
+
+    def search(self, query, limit=10, min_similarity=MIN_FUZZY_SIMILARITY):
+        """
+        Return up to `limit` matches as [(row, tier, similarity), ...], best first.
+        Exact matches rank above prefix matches, then substring, then fuzzy trigram matches;
+        within a tier, results are ordered by trigram similarity to the query.
+        """
+        q = normalize_title(query)
+        if not q or limit <= 0:
+            return []
+
+        grams, counts = self._trigram_overlap(q)
+        if counts is None:
+            similarity = np.zeros(len(self.titles), dtype=np.float32)
+        else:
+            # Dice coefficient over trigram sets
+            similarity = (2.0 * counts / (len(grams) + self.gram_counts)).astype(np.float32)
+
+        # Assigned worst tier first, so each row ends up in the best tier it qualifies for
+        tiers = np.full(len(self.titles), NO_MATCH, dtype=np.int8)
+        if counts is not None:
+            tiers[(similarity >= min_similarity) & (counts >= MIN_FUZZY_OVERLAP)] = FUZZY
+        tiers[self._substring_rows(q, grams, counts)] = SUBSTRING
+        tiers[self._prefix_rows(q)] = PREFIX
+        if q in self.exact:
+            tiers[self.exact[q]] = EXACT
+
+        rows = np.flatnonzero(tiers != NO_MATCH)
+        # Similarity is in [0, 1], so this orders by tier, then by similarity within a tier
+        keys = 2.0 * tiers[rows] - similarity[rows]
+        if len(rows) > limit:
+            # Every row scoring at least as well as the limit-th, ties included, then sort those
+            cutoff = np.partition(keys, limit - 1)[limit - 1]
+            rows, keys = rows[keys <= cutoff], keys[keys <= cutoff]
+        ranked = rows[np.lexsort((rows, keys))][:limit]
+        return [(int(row), int(tiers[row]), float(similarity[row])) for row in ranked]
+
+    def lookup(self, query, min_similarity=MIN_LOOKUP_SIMILARITY):
+        """
+        Return (title, row) of the best match, or (None, None). Fuzzy matches need
+        min_similarity here, so a typo resolves but an unrelated query does not.
+        """
+        matches = self.search(query, limit=1, min_similarity=min_similarity)
+        if not matches:
+            return None, None
+        row = matches[0][0]
+        return self.titles[row], row
@@ -0,0 +1,277 @@
+# app/trainer.py
+"""
+Background CF training with atomic model hot-swap.
+
+Each worker runs a trainer thread that retrains on a schedule or once enough new
+ratings have arrived. A file lock in the artifact directory makes sure only one process
+trains at a time. The new model is published as an artifact version (app/artifacts.py);
+every worker notices the new CURRENT pointer on its next request and swaps it in with a
+single reference assignment. Requests pin the model they started with in `g`.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+from flask import g
+
+from . import collaborative
+from .ann import IVFIndex
+from .artifacts import current_version, open_artifact, prune, write_artifact
+from .ratings import latest_rating_id
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process development server
+    fcntl = None
+
+CF_ARTIFACTS_DIR = Path("models") / "cf"
+TRAIN_INTERVAL = 6 * 60 * 60   # seconds between scheduled retrains
+MIN_NEW_RATINGS = 50           # rating writes that trigger an early retrain
+REFRESH_INTERVAL = 5           # seconds between checks for a newer published model
+
+trainer = None
+_last_refresh_check = 0.0
+
+
+def save_cf_model(model, root=CF_ARTIFACTS_DIR):
+    """Publish `model` as a new artifact version and return the version id."""
+    user_ids = np.empty(len(model['user_map']), dtype=np.int64)
+    for uid, i in model['user_map'].items():
+        user_ids[i] = uid
+
+    rated_indptr = np.zeros(len(model['rated']) + 1, dtype=np.int64)
+    np.cumsum([len(cols) for cols in model['rated']], out=rated_indptr[1:])
+
+    return write_artifact(
+        root,
+        arrays={
+            'U': model['U'],
+            'sigma': model['sigma'],
+            'sigma_Vt': model['sigma_Vt'],
+            'user_ids': user_ids,
+            'item_ids': model['item_ids'],
+            'rated_indptr': rated_indptr,
+            'rated_indices': np.concatenate(model['rated']).astype(np.int32),
+            **(model['ann'].to_arrays() if model.get('ann') is not None else {}),
+        },
+        meta={
+            'n_ratings': model['n_ratings'],
+            'max_rating_id': model['max_rating_id'],
+            'train_rmse': model['train_rmse'],
+        },
+    )
+
+
+def load_cf_model(root=CF_ARTIFACTS_DIR, version=None):
+    """Load a published model (default: CURRENT), or None if nothing is published."""
+    # Fold-ins rewrite rows of U, so the arrays are loaded rather than memory-mapped
+    artifact = open_artifact(root, version, mmap=False)
+    if artifact is None:
+        return None
+    meta = artifact.meta
+    item_ids = artifact.array('item_ids')
+    rated_indptr = artifact.array('rated_indptr')
+    return collaborative.index_items({
+        'U': artifact.array('U'),
+        'sigma': artifact.array('sigma'),
+        'sigma_Vt': artifact.array('sigma_Vt'),
+        'user_map': {uid: i for i, uid in enumerate(artifact.array('user_ids').tolist())},
+        'manga_map': {mid: j for j, mid in enumerate(item_ids.tolist())},
+        'item_ids': item_ids,
+        'rated': np.split(artifact.array('rated_indices'), rated_indptr[1:-1]),
+        'n_ratings': meta['n_ratings'],
+        'max_rating_id': meta['max_rating_id'],
+        'train_rmse': meta['train_rmse'],
+        'drift': collaborative._empty_drift(),
+        'version': artifact.version,
+        'ann': IVFIndex.from_artifact(artifact),
+    })
+
+
+def refresh_cf_model(force=False):
+    """Swap in the published model if it is newer than the live one."""
+    global _last_refresh_check
+    now = time.monotonic()
+    if not force and now - _last_refresh_check < REFRESH_INTERVAL:
+        return collaborative.cf_model
+    _last_refresh_check = now
+
+    version = current_version(CF_ARTIFACTS_DIR)
+    live = collaborative.cf_model
+    if version is None or (live is not None and live.get('version') == version):
+        return live
+    if live is not None and open_artifact(CF_ARTIFACTS_DIR, version).meta['max_rating_id'] < live['max_rating_id']:
+        # The live model was trained here on newer ratings but could not be published
+        return live
+    return collaborative.publish_cf_model(load_cf_model(version=version))
+
+
+def pin_cf_model():
+    """before_request hook: pick up new versions, then pin one model for the request."""
+    refresh_cf_model()
+    g.cf_model = collaborative.cf_model
+
+
+@contextmanager
+def _train_lock(root):
+    """Non-blocking cross-process lock; yields False if another process holds it."""
+    root.mkdir(parents=True, exist_ok=True)
+    if fcntl is None:
+        yield True
+        return
+    with open(root / ".train.lock", "w") as handle:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+class CFTrainer:
+    """Retrains the CF model in a daemon thread every `interval` seconds or after
+    `min_new_ratings` rating writes, whichever comes first."""
+
+    def __init__(self, app, interval=TRAIN_INTERVAL, min_new_ratings=MIN_NEW_RATINGS,
+                 root=CF_ARTIFACTS_DIR):
+        self.app = app
+        self.interval = interval
+        self.min_new_ratings = min_new_ratings
+        self.root = Path(root)
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="cf-trainer", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def notify(self, n=1, force=False):
+        """Record `n` rating writes; wake the trainer if enough piled up (or `force`)."""
+        with self._lock:
+            self.pending += n
+            due = force or self.pending >= self.min_new_ratings
+        if due:
+            self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.train_once()
+            except Exception as e:
+                logger.exception("CF training failed: %s", e)
+
+    def train_once(self):
+        """Train and publish a new model version. Returns the version, or None if skipped."""
+        with self._lock:
+            pending, self.pending = self.pending, 0
+        with self.app.app_context():
+            return train_and_publish(self.root, force=bool(pending))
+
+
+def train_and_publish(root=CF_ARTIFACTS_DIR, force=False):
+    """
+    Retrain on all ratings, publish the model as a new version and swap it in (inside an
+    app context). Returns the version, or None if another process holds the train lock
+    or, without `force`, the published model already covers the latest rating.
+    """
+    root = Path(root)
+    with _train_lock(root) as acquired:
+        if not acquired:
+            # Another process is training; it will publish for everyone
+            return None
+        published = open_artifact(root, mmap=False)
+        if published is not None and not force and published.meta['max_rating_id'] >= latest_rating_id():
+            return None
+        model = collaborative.train_cf_model()
+        if model is None:
+            return None
+        version = save_cf_model(model, root)
+        prune(root, keep=3)
+
+    model['version'] = version
+    collaborative.publish_cf_model(model)
+    logger.info("Published CF model %s", version)
+    return version
+
+
+def on_ratings_changed(user_id):
+    """
+    Route hook after a rating write: fold it in now, and retrain when the drift limits
+    say so. The trainer thread retrains in the background. Without it the retrain runs
+    here, and is published like the trainer's so that refresh_cf_model keeps it.
+    """
+    model = collaborative.update_cf_model_for_user(user_id, rebuild=False)
+    due = model is None or collaborative.needs_full_rebuild(model)
+    if trainer is not None:
+        trainer.notify(force=due)
+    elif due:
+        try:
+            train_and_publish(force=True)
+        except OSError as e:
+            # Read-only models/cf (serverless): serve the rebuild from this process only
+            logger.warning("Cannot publish the CF model (%s); rebuilding in memory.", e)
+            model = collaborative.train_cf_model()
+            if model is not None:
+                collaborative.publish_cf_model(model)
+
+
+def restart_trainer():
+    """In a worker forked from a master that started the trainer: its thread did not survive the fork."""
+    global trainer
+    if trainer is not None:
+        trainer = CFTrainer(trainer.app, interval=trainer.interval, min_new_ratings=trainer.min_new_ratings,
+                            root=trainer.root).start()
+    return trainer
+
+
+def init_trainer(app):
+    """
+    Pin the published CF model per request, and start the background trainer if
+    CF_TRAINER_ENABLED=1. Nothing is loaded here: the first request's pin_cf_model loads
+    the model. The trainer is off by default. Serverless deploys cannot keep a thread
+    alive or write models/cf, so there a scheduler runs `python -m app.trainer` instead.
+    """
+    global trainer
+    app.config.setdefault('CF_TRAINER_ENABLED', os.environ.get('CF_TRAINER_ENABLED', '0') == '1')
+    app.config.setdefault('CF_TRAIN_INTERVAL', TRAIN_INTERVAL)
+    app.config.setdefault('CF_TRAIN_MIN_NEW_RATINGS', MIN_NEW_RATINGS)
+
+    app.before_request(pin_cf_model)
+
+    if app.config['CF_TRAINER_ENABLED'] and trainer is None:
+        trainer = CFTrainer(
+            app,
+            interval=app.config['CF_TRAIN_INTERVAL'],
+            min_new_ratings=app.config['CF_TRAIN_MIN_NEW_RATINGS'],
+        ).start()
+    return trainer
+
+
+if __name__ == "__main__":
+    # One-off training run, e.g. from cron: python -m app.trainer
+    from . import create_app
+    app = create_app()
+    with app.app_context():
+        version = train_and_publish()
+    print(f"Published {version}" if version else "Nothing to train.")
@@ -0,0 +1,105 @@
+# benchmarks/ann_recall.py
+"""
+Recall / latency of the IVF index against exact ranking.
+
+    python benchmarks/ann_recall.py                 # TF-IDF rows from the current artifact
+    python benchmarks/ann_recall.py --synthetic 50000 --dim 50   # CF-like dense factors
+    python benchmarks/ann_recall.py --synthetic 50000 --users    # ... queried with user factors, as CF does
+
+For each n_probe it reports recall@k against brute force and mean query latency.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.ann import IVFIndex, recall_at_k  # noqa: E402
+from app.artifacts import open_artifact  # noqa: E402
+from app.ranking import top_n  # noqa: E402
+
+
+def load_tfidf(root):
+    artifact = open_artifact(root)
+    if artifact is None:
+        sys.exit(f"No artifact under {root}; run build_models.py first.")
+    n = len(artifact.array('ids'))
+    return csr_matrix(
+        (artifact.array('tfidf_data'), artifact.array('tfidf_indices'), artifact.array('tfidf_indptr')),
+        shape=(n, artifact.meta['vocabulary']),
+    )
+
+
+def synthetic_factors(n, dim, seed=0, n_users=0):
+    """
+    Clustered latent factors, roughly what an SVD item matrix looks like, plus `n_users`
+    user factors that each mix a few of the item clusters.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(n // 500, 8), dim))
+    labels = rng.integers(len(centers), size=n)
+    items = (centers[labels] + 0.5 * rng.normal(size=(n, dim))).astype(np.float32)
+    tastes = rng.dirichlet(np.full(len(centers), 0.05), size=n_users)
+    users = (tastes @ centers + 0.2 * rng.normal(size=(n_users, dim))).astype(np.float32)
+    return items, users
+
+
+def exact_search(vectors, queries, k, exclude):
+    scores = queries @ vectors.T
+    scores = scores.toarray() if hasattr(scores, 'toarray') else np.asarray(scores)
+    for i, rows in enumerate(exclude):
+        scores[i, rows] = -np.inf
+    return top_n(scores, k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--artifacts", default="models/artifacts")
+    parser.add_argument("--synthetic", type=int, default=0, help="use N synthetic dense vectors")
+    parser.add_argument("--dim", type=int, default=50)
+    parser.add_argument("--users", action="store_true",
+                        help="with --synthetic: query with user factors (CF retrieval) instead of item rows")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--n-lists", type=int, default=None)
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    if args.synthetic:
+        vectors, users = synthetic_factors(args.synthetic, args.dim, n_users=args.queries if args.users else 0)
+    else:
+        vectors = load_tfidf(args.artifacts)
+    n = vectors.shape[0]
+    rng = np.random.default_rng(1)
+    query_rows = rng.choice(n, min(args.queries, n), replace=False)
+    queries = vectors[query_rows]
+    # A query never returns itself; user queries exclude nothing
+    exclude = [[row] for row in query_rows]
+    if args.synthetic and args.users:
+        queries, exclude = users, [[] for _ in users]
+
+    start = time.perf_counter()
+    index = IVFIndex.build(vectors, n_lists=args.n_lists)
+    print(f"{n} vectors, {index.n_lists} lists, built in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    exact, _ = exact_search(vectors, queries, args.k, exclude)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(exclude)
+    print(f"exact (one batched product): {exact_ms:.3f} ms/query")
+
+    print(f"{'n_probe':>8} {'recall@' + str(args.k):>10} {'ms/query':>10} {'speedup':>8}")
+    for n_probe in args.n_probe:
+        if n_probe > index.n_lists:
+            continue
+        start = time.perf_counter()
+        approx, _ = index.search(vectors, queries, args.k, n_probe=n_probe, exclude=exclude)
+        ms = (time.perf_counter() - start) * 1000 / len(exclude)
+        print(f"{n_probe:>8} {recall_at_k(approx, exact):>10.3f} {ms:>10.3f} {exact_ms / ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
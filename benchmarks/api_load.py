@@ -0,0 +1,111 @@
+# benchmarks/api_load.py
+"""
+Load test for the JSON API: per-request scoring vs. batched request coalescing.
+
+    python benchmarks/api_load.py                           # CBF endpoint, 32 clients
+    python benchmarks/api_load.py --endpoint cf --clients 64
+    python benchmarks/api_load.py --windows 0 1 2 5         # batch windows in ms
+
+For each batch window the app is served on a local threaded server and hammered by
+`--clients` concurrent clients for `--requests` requests in total. Window 0 scores every
+request on its own. Reports throughput, p50/p95 latency and the mean batch size.
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.chdir(Path(__file__).resolve().parent.parent)
+os.environ.setdefault("CF_TRAINER_ENABLED", "0")
+
+from werkzeug.serving import make_server  # noqa: E402
+
+from app import api as api_module, create_app  # noqa: E402
+
+# The CF endpoint serves other users' recommendations only to a service with the API token
+API_TOKEN = "benchmark"
+
+
+def query_params(app, endpoint, n):
+    """`n` random query-string dicts for the endpoint."""
+    from app.collaborative import build_cf_model, get_cf_model
+    from app.recommender import models
+
+    rng = random.Random(0)
+    if endpoint == "cbf":
+        titles = models.metadata.records(np.arange(len(models.metadata.ids)), ["title"])
+        return [{"title": rng.choice(titles)["title"], "n": 10} for _ in range(n)]
+    with app.app_context():
+        # With the trainer disabled nothing is loaded yet; train one in memory
+        model = get_cf_model() or build_cf_model()
+    if model is None:
+        sys.exit("Not enough ratings to train a CF model.")
+    users = list(model["user_map"])
+    return [{"user_id": rng.choice(users), "n": 10} for _ in range(n)]
+
+
+def run(app, endpoint, params, clients, window_ms):
+    api_module.cbf_batcher.window = api_module.cf_batcher.window = window_ms / 1000
+    batcher = api_module.cbf_batcher if endpoint == "cbf" else api_module.cf_batcher
+    batcher.batches = batcher.items = 0
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_port}/api/recommendations/{endpoint}"
+    local = threading.local()
+
+    def call(query):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+            session.headers["Authorization"] = f"Bearer {API_TOKEN}"
+        start = time.perf_counter()
+        response = session.get(url, params=query)
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(clients) as pool:
+            latencies = np.array(list(pool.map(call, params)))
+        seconds = time.perf_counter() - start
+    finally:
+        server.shutdown()
+    return len(params) / seconds, latencies, batcher.stats()["mean_batch_size"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint", choices=["cbf", "cf"], default="cbf")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--windows", type=float, nargs="+", default=[0, 2, 5], help="batch windows in ms")
+    args = parser.parse_args()
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    app = create_app({"API_TOKEN": API_TOKEN})
+    params = query_params(app, args.endpoint, args.requests)
+    # Warm up the models and caches outside the measurement
+    run(app, args.endpoint, params[:50], args.clients, 0)
+
+    print(f"/api/recommendations/{args.endpoint}: {args.requests} requests, {args.clients} clients, "
+          f"{os.cpu_count()} cores")
+    print(f"{'window':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'batch':>6}")
+    for window_ms in args.windows:
+        throughput, latencies, batch = run(app, args.endpoint, params, args.clients, window_ms)
+        p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+        print(f"{window_ms:>7g} {throughput:>8.0f} {p50:>8.2f} {p95:>8.2f} {batch:>6.1f}")
+
+
+if __name__ == "__main__":
+    main()
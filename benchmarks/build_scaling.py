@@ -0,0 +1,68 @@
+# benchmarks/build_scaling.py
+"""
+Throughput of the top-k similarity build as workers are added.
+
+    python benchmarks/build_scaling.py                     # TF-IDF rows from the current artifact
+    python benchmarks/build_scaling.py --synthetic 50000   # sparse random TF-IDF-like rows
+
+For each worker count it reports wall time, rows per second and speedup over one worker,
+and checks that the result is identical to the single-process build.
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from scipy import sparse
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from build_models import BLOCK_SIZE, MAX_MEMORY_MB, TOP_K, block_size_for, top_k_neighbors  # noqa: E402
+from benchmarks.ann_recall import load_tfidf  # noqa: E402
+
+
+def synthetic_tfidf(n, vocabulary, density, seed=0):
+    """Random sparse rows, L2-normalised like TfidfVectorizer output."""
+    matrix = sparse.random(n, vocabulary, density=density, format="csr", dtype=np.float32,
+                           random_state=seed)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    return sparse.diags(1 / np.where(norms > 0, norms, 1)).astype(np.float32) @ matrix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--artifacts", default="models/artifacts")
+    parser.add_argument("--synthetic", type=int, default=0, help="use N synthetic rows")
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--density", type=float, default=0.003)
+    parser.add_argument("--k", type=int, default=TOP_K)
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE)
+    parser.add_argument("--max-memory", type=int, default=MAX_MEMORY_MB)
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    args = parser.parse_args()
+
+    matrix = (synthetic_tfidf(args.synthetic, args.vocabulary, args.density) if args.synthetic
+              else load_tfidf(args.artifacts))
+    n = matrix.shape[0]
+    print(f"{n} rows, {matrix.nnz} non-zeros, {os.cpu_count()} cores")
+
+    print(f"{'workers':>8} {'block':>6} {'seconds':>8} {'rows/s':>9} {'speedup':>8} {'same':>5}")
+    baseline = None
+    for workers in args.workers:
+        start = time.perf_counter()
+        indices, scores = top_k_neighbors(matrix, args.k, args.block_size, workers=workers,
+                                          max_memory_mb=args.max_memory)
+        seconds = time.perf_counter() - start
+        if baseline is None:
+            baseline = (seconds, indices, scores)
+        same = np.array_equal(indices, baseline[1]) and np.array_equal(scores, baseline[2])
+        block = block_size_for(n, workers, args.block_size, args.max_memory)
+        print(f"{workers:>8} {block:>6} {seconds:>8.2f} {n / seconds:>9.0f} "
+              f"{baseline[0] / seconds:>7.1f}x {str(same):>5}")
+
+
+if __name__ == "__main__":
+    main()
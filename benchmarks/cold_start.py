@@ -0,0 +1,88 @@
+# benchmarks/cold_start.py
+"""
+Cold start: how long a fresh process takes to build the app and answer its first requests.
+
+    python benchmarks/cold_start.py               # 5 fresh processes per mode
+    python benchmarks/cold_start.py --runs 10 --title "One Piece"
+
+Each run is a new Python process on a copy of instance/manga.db. It reports import +
+create_app, then the first GET /auth/login (needs no model) and the first
+GET /recommend (needs the content model). "lazy" is the default, where the model loads
+on first use; "preload" sets MODELS_PRELOAD=1, as in a gunicorn master with
+preload_app. Files are read from a warm page cache after the first run.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+MODES = {"lazy": {"MODELS_PRELOAD": "0"}, "preload": {"MODELS_PRELOAD": "1"}}
+STEPS = ["create_app", "first_login", "first_recommend", "total"]
+
+
+def measure(db_path, title):
+    """Runs in the child process; prints one JSON dict of seconds per step."""
+    start = time.perf_counter()
+    from app import create_app
+
+    app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}"})
+    created = time.perf_counter()
+    client = app.test_client()
+    assert client.get("/auth/login").status_code == 200
+    logged_in = time.perf_counter()
+    assert client.get("/recommend", query_string={"title": title}).status_code == 200
+    done = time.perf_counter()
+    print(json.dumps({
+        "create_app": created - start,
+        "first_login": logged_in - created,
+        "first_recommend": done - logged_in,
+        "total": done - start,
+    }))
+
+
+def run(mode, args, db_path):
+    env = {**os.environ, **MODES[mode], "CF_TRAINER_ENABLED": "0", "LOG_LEVEL": "WARNING",
+           "PYTHONPATH": str(ROOT)}
+    samples = []
+    for _ in range(args.runs):
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", "--db", str(db_path), "--title", args.title],
+            cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+        )
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    medians = [np.median([sample[step] for sample in samples]) * 1000 for step in STEPS]
+    print(f"{mode:>8} " + " ".join(f"{ms:>16.1f}" for ms in medians))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="instance/manga.db")
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per mode")
+    parser.add_argument("--title", default="Naruto", help="seed title for the first /recommend")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        sys.path.insert(0, str(ROOT))
+        measure(args.db, args.title)
+        return
+
+    print(f"median of {args.runs} fresh processes, ms")
+    print(f"{'mode':>8} " + " ".join(f"{step:>16}" for step in STEPS))
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "manga.db"
+        shutil.copy(ROOT / args.db, db_path)
+        for mode in MODES:
+            run(mode, args, db_path)
+
+
+if __name__ == "__main__":
+    main()
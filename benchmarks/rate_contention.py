@@ -0,0 +1,141 @@
+# benchmarks/rate_contention.py
+"""
+Write contention on the ratings table: many simultaneous /rate posts from several
+worker processes sharing one SQLite file, as under gunicorn.
+
+    python benchmarks/rate_contention.py                          # 4 workers x 8 clients x 25 posts
+    python benchmarks/rate_contention.py --workers 8 --clients 16
+
+Each run works on a fresh copy of instance/manga.db and is repeated with the old
+settings (rollback journal, default 5 s busy timeout, no pragmas) and the tuned ones
+from app/database.py. Reports throughput, latency percentiles and failed posts
+("database is locked" surfaces as a 500).
+"""
+import argparse
+import logging
+import multiprocessing as mp
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.chdir(ROOT)
+os.environ.setdefault("CF_TRAINER_ENABLED", "0")
+
+BASELINE = {"SQLITE_PRAGMAS": {"journal_mode": "DELETE"}, "SQLITE_BUSY_TIMEOUT": 5}
+TUNED = {}
+PASSWORD = "bench"
+
+
+def create_users(db_path, n):
+    """Add n bench users to the copied database; returns their emails."""
+    from flask_bcrypt import generate_password_hash
+
+    password_hash = generate_password_hash(PASSWORD).decode()
+    emails = [f"bench{i}@example.com" for i in range(n)]
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany(
+            "INSERT INTO user (username, email, password_hash) VALUES (?, ?, ?)",
+            [(f"bench{i}", email, password_hash) for i, email in enumerate(emails)],
+        )
+    return emails
+
+
+def worker(config, emails, posts, barrier, results):
+    """One 'gunicorn worker': an app instance with one thread per client."""
+    try:
+        from app import create_app
+        from app.recommender import models
+
+        app = create_app(config)
+        logging.getLogger(app.name).setLevel(logging.CRITICAL)
+        clients = []
+        for email in emails:
+            client = app.test_client()
+            client.post("/auth/login", data={"email": email, "password": PASSWORD})
+            clients.append(client)
+    except Exception:
+        barrier.abort()  # don't leave the other workers waiting
+        raise
+
+    samples = []
+    lock = threading.Lock()
+
+    def post_ratings(client, seed):
+        rng = random.Random(seed)
+        local = []
+        for _ in range(posts):
+            form = {"manga_id": int(rng.choice(models.manga_ids)), "rating": rng.randint(1, 5), "title": ""}
+            start = time.perf_counter()
+            status = client.post("/rate", data=form).status_code
+            local.append((time.perf_counter() - start, status < 400))
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=post_ratings, args=(client, i)) for i, client in enumerate(clients)]
+    barrier.wait()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put(samples)
+
+
+def run(name, settings, args, source):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "manga.db"
+        shutil.copy(source, db_path)
+        emails = create_users(db_path, args.workers * args.clients)
+        config = {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}", **settings}
+
+        barrier = mp.Barrier(args.workers + 1)
+        results = mp.Queue()
+        processes = [
+            mp.Process(target=worker, args=(config, emails[w * args.clients:(w + 1) * args.clients],
+                                             args.posts, barrier, results))
+            for w in range(args.workers)
+        ]
+        for process in processes:
+            process.start()
+        try:
+            barrier.wait()  # every worker has loaded the app and logged in
+        except threading.BrokenBarrierError:
+            sys.exit("A worker failed to start; see its traceback above.")
+        start = time.perf_counter()
+        samples = [sample for _ in processes for sample in results.get()]
+        seconds = time.perf_counter() - start
+        for process in processes:
+            process.join()
+
+    latencies = np.array([latency for latency, _ in samples]) * 1000
+    failed = sum(not ok for _, ok in samples)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    print(f"{name:>9} {len(samples) / seconds:>8.0f} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f} {failed:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="instance/manga.db")
+    parser.add_argument("--workers", type=int, default=4, help="processes sharing the database")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients per worker")
+    parser.add_argument("--posts", type=int, default=25, help="/rate posts per client")
+    args = parser.parse_args()
+
+    total = args.workers * args.clients * args.posts
+    print(f"{total} /rate posts: {args.workers} workers x {args.clients} clients, {os.cpu_count()} cores")
+    print(f"{'settings':>9} {'posts/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'failed':>7}")
+    run("baseline", BASELINE, args, args.db)
+    run("tuned", TUNED, args, args.db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+# benchmarks/recommendation_suite.py
+"""
+End-to-end benchmark and offline evaluation on synthetic catalogs.
+
+    python benchmarks/recommendation_suite.py                        # 1k, 10k and 100k titles
+    python benchmarks/recommendation_suite.py --scales 1000 --queries 50
+    python benchmarks/recommendation_suite.py --output results.json  # keep numbers to compare
+    python benchmarks/recommendation_suite.py --no-cf-ann            # exact CF candidates, for comparison
+
+For each scale a catalog of N titles and N ratings is generated. Titles belong to latent
+topics that drive their genres and synopsis words, and users mostly rate titles from the
+topics they like, so both CBF and CF have signal to find. The pipeline then runs in a
+scratch directory:
+
+    build_and_save, load_models, build_cf_model                  timed end to end
+    get_cbf_recommendations, get_cf_recommendations,
+    get_hybrid_recommendations                                   latency percentiles, throughput
+
+Peak RSS is recorded after every stage. Next to the timings, each recommender is scored
+with precision@k and recall@k: 20% of every user's ratings are held out of training, and
+held-out titles rated 4+ are the relevant ones. A random ranking is listed as a floor.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+
+GENRES = ['Action', 'Adventure', 'Comedy', 'Drama', 'Fantasy', 'Horror', 'Mystery', 'Romance',
+          'Sci-Fi', 'Slice_of_Life', 'Sports', 'Supernatural', 'Suspense', 'Award_Winning',
+          'Ecchi', 'Gourmet', 'Boys_Love', 'Girls_Love', 'Avant_Garde', 'Erotica']
+TITLES_PER_TOPIC = 50
+TOPIC_WORDS = 10
+COMMON_WORDS = 2000
+SYNOPSIS_WORDS = 40
+HOLDOUT = 0.2
+RELEVANT_RATING = 4
+SYLLABLES = ['ka', 'shi', 'ro', 'mi', 'ten', 'go', 'ha', 'ru', 'zen', 'yo', 'ki', 'na', 'sa', 'to',
+             'mo', 'ri', 'kai', 'jin', 'sei', 'ryu', 'ma', 'no', 'ku', 'hi', 'da', 're', 'fu', 'wa']
+
+
+# --- Synthetic data ---
+
+def synthetic_titles(n, rng):
+    """n distinct two-word titles made of random syllables, as varied as real ones."""
+    titles = set()
+    while len(titles) < n:
+        words = ["".join(rng.choice(SYLLABLES, size=rng.integers(2, 5))).capitalize() for _ in range(2)]
+        titles.add(" ".join(words))
+    return sorted(titles, key=lambda _: rng.random())
+
+
+def synthetic_catalog(n, rng):
+    """n titles; each title's genres and most of its synopsis words come from its topic."""
+    n_topics = max(n // TITLES_PER_TOPIC, 10)
+    topics = rng.integers(n_topics, size=n)
+    topic_genres = [rng.choice(len(GENRES), size=3, replace=False) for _ in range(n_topics)]
+    titles = synthetic_titles(n, rng)
+    rows = []
+    for i, topic in enumerate(topics):
+        genres = rng.choice(topic_genres[topic], size=rng.integers(1, 4), replace=False)
+        own = rng.random(SYNOPSIS_WORDS) < 0.6
+        words = np.where(own, rng.integers(TOPIC_WORDS, size=SYNOPSIS_WORDS),
+                         rng.integers(COMMON_WORDS, size=SYNOPSIS_WORDS))
+        synopsis = " ".join(f"t{topic}w{w}" if o else f"word{w}" for w, o in zip(words, own))
+        rows.append({
+            'id': i + 1,
+            'title': titles[i],
+            'synopsis': synopsis,
+            'genres': " ".join(GENRES[g] for g in sorted(genres)),
+            'score': round(float(rng.uniform(5, 9)), 2),
+            'image_url': "",
+        })
+    return pd.DataFrame(rows), topics
+
+
+def synthetic_ratings(n_ratings, topics, rng):
+    """Users who like one or two topics: their titles get 4-5 stars, the rest 1-3."""
+    n_users = max(n_ratings // 25, 20)
+    per_user = max(n_ratings // n_users, 5)
+    n_topics = topics.max() + 1
+    by_topic = [np.flatnonzero(topics == t) for t in range(n_topics)]
+    rows = []
+    for user in range(1, n_users + 1):
+        liked = rng.choice(n_topics, size=rng.integers(1, 3), replace=False)
+        pool = np.concatenate([by_topic[t] for t in liked])
+        n_liked = min(int(per_user * 0.7), len(pool))
+        items = set(rng.choice(pool, size=n_liked, replace=False).tolist())
+        while len(items) < per_user:
+            items.add(int(rng.integers(len(topics))))
+        for item in items:
+            rating = rng.integers(4, 6) if topics[item] in liked else rng.integers(1, 4)
+            rows.append((user, item + 1, int(rating)))
+    return pd.DataFrame(rows, columns=['user_id', 'manga_id', 'rating'])
+
+
+def holdout_split(ratings, rng):
+    """Hold out HOLDOUT of each user's ratings (at least one)."""
+    held = np.zeros(len(ratings), dtype=bool)
+    for _, idx in ratings.groupby('user_id').indices.items():
+        n_test = max(int(len(idx) * HOLDOUT), 1)
+        held[rng.choice(idx, size=n_test, replace=False)] = True
+    return ratings[~held], ratings[held]
+
+
+# --- Measurement ---
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def timed(fn, calls):
+    """Call fn(i) for each i in calls; returns the latencies in seconds."""
+    latencies = []
+    for arg in calls:
+        start = time.perf_counter()
+        fn(arg)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def summarize(latencies):
+    ms = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {'calls': len(ms), 'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+            'ops_per_s': len(ms) / max(ms.sum() / 1000, 1e-9), 'peak_rss_mb': peak_rss_mb()}
+
+
+def precision_recall(recommend, train, test, k):
+    """Mean precision@k / recall@k over users with at least one relevant held-out title."""
+    seen = train.groupby('user_id')['manga_id'].apply(set)
+    relevant = test[test['rating'] >= RELEVANT_RATING].groupby('user_id')['manga_id'].apply(set)
+    precisions, recalls = [], []
+    for user_id, wanted in relevant.items():
+        rated = seen.get(user_id, set())
+        recs = [mid for mid in recommend(user_id, k + len(rated)) if mid not in rated][:k]
+        hits = len(wanted.intersection(recs))
+        precisions.append(hits / k)
+        recalls.append(hits / len(wanted))
+    return {'precision': float(np.mean(precisions)), 'recall': float(np.mean(recalls)), 'users': len(precisions)}
+
+
+def run_scale(n, queries, k, seed, cf_ann=True):
+    """Runs inside the scratch directory; returns this scale's results."""
+    rng = np.random.default_rng(seed)
+    catalog, topics = synthetic_catalog(n, rng)
+    ratings = synthetic_ratings(n, topics, rng)
+    train, test = holdout_split(ratings, rng)
+    Path("Data/Raw").mkdir(parents=True)
+    Path("models").mkdir()
+    catalog.to_csv("Data/Raw/manga.csv", index=False)
+    results = {'titles': n, 'ratings': len(ratings), 'users': int(ratings['user_id'].nunique()),
+               'timings': {}, 'quality': {}}
+    timings = results['timings']
+
+    from preprocess import preprocess
+    preprocess()
+    from build_models import build_and_save
+    timings['build_and_save'] = summarize(timed(lambda _: build_and_save(workers=1), [None]))
+
+    from app import recommender
+    timings['load_models'] = summarize(timed(lambda _: recommender.load_models(), range(5)))
+    recommender.models.load()
+
+    from app import collaborative, create_app
+    from app.collaborative import build_cf_model, get_cf_recommendations
+    from app.database import db
+    from app.hybrid import get_hybrid_recommendations
+
+    if not cf_ann:
+        # No IVF index over the item factors: hybrid CF candidates score the whole catalog
+        collaborative.ANN_MIN_ROWS = float('inf')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{Path('bench.db').resolve()}"})
+    with app.app_context():
+        db.session.execute(db.text("INSERT INTO user (id, username, email, password_hash) VALUES (:id, :name, :email, '')"),
+                           [{'id': int(u), 'name': f"user{u}", 'email': f"user{u}@example.com"}
+                            for u in ratings['user_id'].unique()])
+        db.session.execute(db.text("INSERT INTO rating (user_id, manga_id, rating) VALUES (:user_id, :manga_id, :rating)"),
+                           train.astype(int).to_dict('records'))
+        db.session.commit()
+        timings['build_cf_model'] = summarize(timed(lambda _: build_cf_model(), range(3)))
+
+        # Seeds: each user's favourite training title
+        favourite = train.sort_values('rating', ascending=False).drop_duplicates('user_id')
+        title_of = dict(zip(catalog['id'], catalog['title']))
+        seed_title = {user: title_of[mid] for user, mid in zip(favourite['user_id'], favourite['manga_id'])}
+        query_rng = np.random.default_rng(seed + 1)
+        titles = query_rng.choice(catalog['title'].to_numpy(), size=queries).tolist()
+        users = query_rng.choice(list(seed_title), size=queries)
+
+        timings['get_cbf_recommendations'] = summarize(
+            timed(lambda title: recommender.get_cbf_recommendations(title, top_n=k), titles))
+        timings['get_cf_recommendations'] = summarize(
+            timed(lambda user: get_cf_recommendations(int(user), top_n=k), users))
+        timings['get_hybrid_recommendations'] = summarize(
+            timed(lambda user: get_hybrid_recommendations(int(user), seed_title[user], top_n=k), users))
+
+        ids = catalog['id'].to_numpy()
+        recommenders = {
+            'random': lambda user, top: query_rng.choice(ids, size=top, replace=False).tolist(),
+            'cbf': lambda user, top: [r['id'] for r in recommender.get_cbf_recommendations(seed_title[user], top_n=top)],
+            'cf': lambda user, top: [mid for mid, _ in get_cf_recommendations(int(user), top_n=top)],
+            'hybrid': lambda user, top: [r['id'] for r in get_hybrid_recommendations(int(user), seed_title[user], top_n=top)],
+        }
+        for name, recommend in recommenders.items():
+            results['quality'][name] = precision_recall(recommend, train, test, k)
+    return results
+
+
+# --- Driver ---
+
+def print_results(results, k):
+    print(f"\n== {results['titles']} titles, {results['ratings']} ratings, {results['users']} users ==")
+    print(f"{'stage':<28} {'calls':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>8} {'peak RSS MB':>12}")
+    for name, t in results['timings'].items():
+        print(f"{name:<28} {t['calls']:>5} {t['p50_ms']:>9.2f} {t['p95_ms']:>9.2f} {t['p99_ms']:>9.2f} "
+              f"{t['ops_per_s']:>8.1f} {t['peak_rss_mb']:>12.0f}")
+    print(f"{'quality':<28} {f'precision@{k}':>13} {f'recall@{k}':>10} {'users':>6}")
+    for name, q in results['quality'].items():
+        print(f"{name:<28} {q['precision']:>13.4f} {q['recall']:>10.4f} {q['users']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="catalog sizes; each gets the same number of ratings")
+    parser.add_argument("--queries", type=int, default=200, help="calls per recommendation function")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write all results to this JSON file")
+    parser.add_argument("--no-cf-ann", action="store_true", help="train the CF model without its ANN index")
+    parser.add_argument("--run-scale", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scale:
+        # Child process, started in a scratch directory by the driver below
+        sys.path.insert(0, str(ROOT))
+        results = run_scale(args.run_scale, args.queries, args.k, args.seed, cf_ann=not args.no_cf_ann)
+        Path(args.result_file).write_text(json.dumps(results))
+        return
+
+    # One process per scale: the app loads models/ relative to the working directory at
+    # import time, and peak RSS is per process
+    all_results = []
+    for n in args.scales:
+        with tempfile.TemporaryDirectory() as workdir:
+            result_file = Path(workdir) / "results.json"
+            proc = subprocess.run(
+                [sys.executable, str(Path(__file__).resolve()), "--run-scale", str(n),
+                 "--queries", str(args.queries), "--k", str(args.k), "--seed", str(args.seed),
+                 "--result-file", str(result_file), *(["--no-cf-ann"] if args.no_cf_ann else [])],
+                cwd=workdir, env={**os.environ, "CF_TRAINER_ENABLED": "0"},
+                capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                sys.exit(f"Scale {n} failed:\n{proc.stdout[-2000:]}\n{proc.stderr[-4000:]}")
+            results = json.loads(result_file.read_text())
+        print_results(results, args.k)
+        all_results.append(results)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(all_results, indent=2))
+        print(f"\nWrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
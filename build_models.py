@@ -1,35 +1,375 @@
 # build_models.py
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
 import pandas as pd
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 import joblib
 from pathlib import Path
+from scipy import sparse
+
+from app.artifacts import write_artifact, prune, open_artifact
+from app.ann import IVFIndex, MIN_ROWS as ANN_MIN_ROWS
+from app.ranking import top_n as rank_top_n
+from app.genres import GenreIndex
+from app.popularity import PopularityIndex
+from preprocess import CATALOG_DIR, load_catalog as load_columnar_catalog
 
 DATA_PATH = Path("Data/Processed/processed_manga.csv")
 MODELS_DIR = Path("models")
 MODELS_DIR.mkdir(exist_ok=True)
+ARTIFACTS_DIR = MODELS_DIR / "artifacts"
+
+# Number of neighbours kept per title in the sparse similarity index
+TOP_K = 100
+# Rows per block when computing similarities; a block costs block_size * N * 4 bytes
+BLOCK_SIZE = 256
+# Processes computing similarity blocks in parallel
+WORKERS = os.cpu_count() or 1
+# Upper bound on the similarity blocks held in memory at once, across all workers
+MAX_MEMORY_MB = 1024
+# Incremental builds refit the vocabulary and IDF once this fraction of the catalog
+# has been added, changed or removed since the last full fit
+REFIT_THRESHOLD = 0.2
+METADATA_COLUMNS = ['title', 'genres', 'synopsis', 'image_url']
+
+
+def block_size_for(n, workers=1, block_size=BLOCK_SIZE, max_memory_mb=MAX_MEMORY_MB):
+    """Largest block size up to `block_size` whose blocks fit in max_memory_mb across workers."""
+    # A block is block_size x n float32, and argpartition needs about twice that again
+    bytes_per_row = n * 4 * 3
+    fit = int(max_memory_mb * 2**20 // (bytes_per_row * max(workers, 1)))
+    return max(1, min(block_size, fit))
+
+
+def _block_top_k(matrix, matrix_t, block_rows, k):
+    """Top-k (indices, scores) of each row in block_rows, excluding the row itself."""
+    block = (matrix[block_rows] @ matrix_t).toarray()
+    # A title is not its own recommendation
+    block[np.arange(len(block_rows)), block_rows] = -np.inf
+
+    top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(block, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    return (np.take_along_axis(top, order, axis=1).astype(np.int32),
+            np.take_along_axis(top_scores, order, axis=1))
+
+
+# (matrix, matrix_t) in each pool process, sent once by the pool initializer
+_worker_matrices = None
+
+
+def _init_worker(matrix):
+    global _worker_matrices
+    _worker_matrices = (matrix, matrix.T.tocsr())
+
 
-def build_and_save():
-    df = pd.read_csv(DATA_PATH)
+def _worker_block(block_rows, k):
+    return _block_top_k(*_worker_matrices, block_rows, k)
+
+
+def top_k_neighbors(tfidf_matrix, k=TOP_K, block_size=BLOCK_SIZE, rows=None, workers=1,
+                    max_memory_mb=MAX_MEMORY_MB):
+    """
+    Compute the k most similar titles for every row without building the N x N matrix.
+
+    TfidfVectorizer L2-normalises its rows, so a sparse dot product is already the
+    cosine similarity. Rows are processed in blocks and only each row's top-k survive.
+    With workers > 1 the blocks are spread over a process pool. Blocks are shrunk so
+    that the ones in flight stay under max_memory_mb.
+    Returns (indices, scores) arrays of shape (N, k), sorted by descending score,
+    with each title's own row excluded. Pass `rows` to compute only those rows.
+    """
+    n = tfidf_matrix.shape[0]
+    rows = np.arange(n) if rows is None else np.asarray(rows, dtype=np.intp)
+    k = max(min(k, n - 1), 0)
+    indices = np.empty((len(rows), k), dtype=np.int32)
+    scores = np.empty((len(rows), k), dtype=np.float32)
+    if k == 0:
+        return indices, scores
+
+    matrix = tfidf_matrix.astype(np.float32).tocsr()
+    block_size = block_size_for(n, workers, block_size, max_memory_mb)
+    starts = range(0, len(rows), block_size)
+    blocks = (rows[start:start + block_size] for start in starts)
+
+    if workers > 1 and len(starts) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(matrix,)) as pool:
+            # map() yields in submission order, so results drop straight into place
+            results = pool.map(_worker_block, blocks, repeat(k))
+            for start, (block_indices, block_scores) in zip(starts, results):
+                indices[start:start + len(block_indices)] = block_indices
+                scores[start:start + len(block_scores)] = block_scores
+        return indices, scores
+
+    matrix_t = matrix.T.tocsr()
+    for start, block_rows in zip(starts, blocks):
+        indices[start:start + len(block_rows)], scores[start:start + len(block_rows)] = \
+            _block_top_k(matrix, matrix_t, block_rows, k)
+    return indices, scores
+
+
+def ann_neighbors(tfidf_matrix, index, k=TOP_K, n_probe=None, block_size=BLOCK_SIZE):
+    """
+    Approximate top_k_neighbors using the IVF index: each row is only compared with the
+    rows in its n_probe nearest partitions, so the build is no longer quadratic.
+    """
+    n = tfidf_matrix.shape[0]
+    k = max(min(k, n - 1), 0)
+    # Probe enough partitions to see roughly 2k candidates per row
+    n_probe = max(n_probe or index.n_probe, int(np.ceil(2 * k * index.n_lists / max(n, 1))))
+    indices = np.empty((n, k), dtype=np.int32)
+    scores = np.empty((n, k), dtype=np.float32)
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        own_rows = [[row] for row in range(start, stop)]
+        indices[start:stop], scores[start:stop] = index.search(
+            tfidf_matrix, tfidf_matrix[start:stop], k, n_probe=n_probe, exclude=own_rows
+        )
+
+    # Rows whose probed partitions held fewer than k candidates fall back to exact search
+    short = np.flatnonzero(np.isinf(scores).any(axis=1))
+    for row in short:
+        row_scores = (tfidf_matrix[row] @ tfidf_matrix.T).toarray().ravel()
+        row_scores[row] = -np.inf
+        top = np.argsort(-row_scores, kind="stable")[:k]
+        indices[row], scores[row] = top, row_scores[top]
+    return indices, scores
+
+
+def load_catalog(path=DATA_PATH):
+    """The processed catalog: the columnar one from preprocess.py if built, else the CSV."""
+    df = load_columnar_catalog(CATALOG_DIR)
+    if df is None:
+        df = pd.read_csv(path)
     # Ensure required columns exist
     for col in ['id','title','genres','synopsis','image_url']:
         if col not in df.columns:
-            raise ValueError(f"Missing column: {col} in {DATA_PATH}")
+            raise ValueError(f"Missing column: {col} in the processed catalog")
 
     df['genres'] = df['genres'].fillna('').astype(str)
     df['synopsis'] = df['synopsis'].fillna('').astype(str)
     df['content'] = (df['genres'] + " " + df['synopsis']).astype(str)
+    return df
+
+
+def save_artifact(df, tfidf, tfidf_matrix, arrays, meta):
+    """Write the catalog, TF-IDF rows and similarity `arrays` as a new artifact version."""
+    if 'genre_bits' in df.columns:
+        genres = GenreIndex(df.attrs['genre_names'], df['genre_bits'].to_numpy(dtype=np.uint64))
+        arrays = {'genre_bits': genres.bits, **arrays}
+        meta = {'genre_names': genres.names, **meta}
+    else:
+        genres = GenreIndex.from_strings(df['genres'].fillna('').astype(str).tolist())
+    score = pd.to_numeric(df.get('score', pd.Series(np.nan, index=df.index)), errors='coerce')
+    # Popularity tiers and genre-stratified sampling tables for onboarding / cold start
+    arrays = {**PopularityIndex.build(score.to_numpy(), genres.bits, len(genres.names)).to_arrays(), **arrays}
+    version = write_artifact(
+        ARTIFACTS_DIR,
+        arrays={
+            'ids': df['id'].to_numpy(dtype=np.int32),
+            'score': score.fillna(0).to_numpy(dtype=np.float32),
+            'tfidf_data': tfidf_matrix.data,
+            'tfidf_indices': tfidf_matrix.indices,
+            'tfidf_indptr': tfidf_matrix.indptr,
+            **arrays,
+        },
+        strings={col: df[col].fillna('').astype(str).tolist() for col in METADATA_COLUMNS},
+        objects={'tfidf_vectorizer': tfidf},
+        meta={'rows': len(df), 'vocabulary': len(tfidf.vocabulary_), **meta},
+    )
+    prune(ARTIFACTS_DIR, keep=3)
+    print(f"Saved model artifact {version} to {ARTIFACTS_DIR}")
+    return version
+
+
+def build_and_save(dense=False, k=TOP_K, block_size=BLOCK_SIZE, approximate=False, n_probe=None,
+                   workers=WORKERS, max_memory_mb=MAX_MEMORY_MB):
+    df = load_catalog()
 
     tfidf = TfidfVectorizer(stop_words='english', max_features=20000)
     tfidf_matrix = tfidf.fit_transform(df['content'])
 
-    cosine_sim = cosine_similarity(tfidf_matrix, tfidf_matrix)
-
+    # Legacy copies for the notebooks
     joblib.dump(tfidf, MODELS_DIR / "tfidf_vectorizer.joblib")
-    joblib.dump(cosine_sim, MODELS_DIR / "cosine_sim.joblib")
     df.to_csv(MODELS_DIR / "manga_indexed.csv", index=False)
 
-    print("Saved tfidf_vectorizer.joblib, cosine_sim.joblib, manga_indexed.csv")
+    tfidf_matrix = tfidf_matrix.astype(np.float32).tocsr()
+    arrays = {}
+    # IVF index over the normalized TF-IDF rows, for sublinear similarity queries
+    ann = None
+    if approximate or len(df) >= ANN_MIN_ROWS:
+        ann = IVFIndex.build(tfidf_matrix)
+        arrays.update(ann.to_arrays())
+
+    if dense:
+        # Full N x N matrix, only practical for small catalogs
+        arrays['cosine_sim'] = cosine_similarity(tfidf_matrix, tfidf_matrix).astype(np.float32)
+    elif approximate:
+        arrays['neighbor_indices'], arrays['neighbor_scores'] = ann_neighbors(
+            tfidf_matrix, ann, k=k, n_probe=n_probe, block_size=block_size
+        )
+    else:
+        arrays['neighbor_indices'], arrays['neighbor_scores'] = top_k_neighbors(
+            tfidf_matrix, k=k, block_size=block_size, workers=workers, max_memory_mb=max_memory_mb
+        )
+
+    return save_artifact(df, tfidf, tfidf_matrix, arrays, {'dense': dense, 'rows_since_fit': 0})
+
+
+# --- Incremental rebuild ---
+
+def _surviving_rows(old_rows, dirty, n_old):
+    """Old row -> new row for rows whose vectors carry over unchanged; -1 otherwise."""
+    target = np.full(n_old, -1, dtype=np.int64)
+    carried = np.flatnonzero(~dirty)
+    target[old_rows[carried]] = carried
+    return target
+
+
+def merge_neighbors(tfidf_matrix, old_indices, old_scores, old_rows, dirty, block_size=BLOCK_SIZE,
+                    workers=1, max_memory_mb=MAX_MEMORY_MB):
+    """
+    Update a top-k index after the rows flagged in `dirty` were added or changed.
+    old_rows[r] is row r's index in the old artifact (-1 for new rows).
+
+    Clean rows keep their old neighbours, minus entries for removed or changed titles,
+    merged with their scores against the dirty rows. Every title outside a row's old
+    top-k scored at most the old k-th score, so the merged list is exact whenever its
+    k-th score has not dropped below that; rows that drop are recomputed, as are the
+    dirty rows themselves. Returns (indices, scores, n_recomputed).
+    """
+    n, k = tfidf_matrix.shape[0], old_indices.shape[1]
+    target = _surviving_rows(old_rows, dirty, len(old_indices))
+    dirty_rows = np.flatnonzero(dirty)
+    clean_rows = np.flatnonzero(~dirty)
+    indices = np.empty((n, k), dtype=np.int32)
+    scores = np.empty((n, k), dtype=np.float32)
+
+    matrix = tfidf_matrix.tocsr()
+    dirty_t = matrix[dirty_rows].T.tocsr()
+    recompute = [dirty_rows]
+    for start in range(0, len(clean_rows), block_size):
+        rows = clean_rows[start:start + block_size]
+        previous = old_rows[rows]
+        prev_scores = np.asarray(old_scores[previous], dtype=np.float32)
+        candidates = target[old_indices[previous]]
+        candidate_scores = np.where(candidates >= 0, prev_scores, -np.inf)
+
+        all_rows = np.hstack([candidates, np.broadcast_to(dirty_rows, (len(rows), len(dirty_rows)))])
+        all_scores = np.hstack([candidate_scores, (matrix[rows] @ dirty_t).toarray()])
+        top, top_scores = rank_top_n(all_scores, k)
+        indices[rows] = np.take_along_axis(all_rows, top, axis=1)
+        scores[rows] = top_scores
+        recompute.append(rows[top_scores[:, -1] < prev_scores[:, -1]])
+
+    recompute = np.concatenate(recompute)
+    if len(recompute):
+        indices[recompute], scores[recompute] = top_k_neighbors(
+            matrix, k, block_size, rows=recompute, workers=workers, max_memory_mb=max_memory_mb
+        )
+    return indices, scores, len(recompute)
+
+
+def build_incremental(k=TOP_K, block_size=BLOCK_SIZE, refit_threshold=REFIT_THRESHOLD,
+                      workers=WORKERS, max_memory_mb=MAX_MEMORY_MB):
+    """
+    Update the current artifact for new, changed and removed titles instead of rebuilding.
+
+    The fitted vocabulary and IDF are reused, so unchanged rows keep their TF-IDF vectors
+    and only new or changed rows are transformed. Once more than `refit_threshold` of the
+    catalog has changed since the last full fit, the IDF is stale enough that this falls
+    back to a full build, as it does for dense artifacts.
+    """
+    previous = open_artifact(ARTIFACTS_DIR)
+    if previous is None or not previous.has('neighbor_indices'):
+        print("No top-k artifact to update; running a full build.")
+        return build_and_save(k=k, block_size=block_size, workers=workers, max_memory_mb=max_memory_mb)
+
+    df = load_catalog()
+    n = len(df)
+    old_ids = previous.array('ids')
+    old_row_of_id = {manga_id: row for row, manga_id in enumerate(old_ids.tolist())}
+    old_rows = np.array([old_row_of_id.get(manga_id, -1) for manga_id in df['id'].tolist()], dtype=np.int64)
+    old_content = [g + " " + s for g, s in zip(previous.strings('genres').tolist(),
+                                                previous.strings('synopsis').tolist())]
+    dirty = np.array([row < 0 or old_content[row] != content
+                      for row, content in zip(old_rows.tolist(), df['content'].tolist())], dtype=bool)
+    removed = len(old_ids) - len(np.unique(old_rows[old_rows >= 0]))
+    changes = int(dirty.sum()) + removed
+    rows_since_fit = previous.meta.get('rows_since_fit', 0) + changes
+
+    old_indices, old_scores = previous.array('neighbor_indices'), previous.array('neighbor_scores')
+    if rows_since_fit > refit_threshold * n or old_indices.shape[1] != max(min(k, n - 1), 0):
+        print(f"{rows_since_fit} of {n} titles changed since the last fit; refitting.")
+        return build_and_save(k=k, block_size=block_size, workers=workers, max_memory_mb=max_memory_mb)
+
+    tfidf = previous.load_object('tfidf_vectorizer')
+    old_matrix = sparse.csr_matrix(
+        (previous.array('tfidf_data'), previous.array('tfidf_indices'), previous.array('tfidf_indptr')),
+        shape=(len(old_ids), previous.meta['vocabulary']),
+    )
+    # Clean rows are copied: with the same vocabulary and IDF their vectors are unchanged
+    dirty_rows = np.flatnonzero(dirty)
+    clean_rows = np.flatnonzero(~dirty)
+    stacked = sparse.vstack([
+        old_matrix[old_rows[clean_rows]],
+        tfidf.transform(df['content'].iloc[dirty_rows]).astype(np.float32),
+    ]).tocsr()
+    order = np.empty(n, dtype=np.intp)
+    order[clean_rows] = np.arange(len(clean_rows))
+    order[dirty_rows] = len(clean_rows) + np.arange(len(dirty_rows))
+    tfidf_matrix = stacked[order]
+
+    arrays = {}
+    arrays['neighbor_indices'], arrays['neighbor_scores'], recomputed = merge_neighbors(
+        tfidf_matrix, old_indices, old_scores, old_rows, dirty,
+        block_size=block_size, workers=workers, max_memory_mb=max_memory_mb,
+    )
+    ann = IVFIndex.from_artifact(previous)
+    if ann is not None:
+        ann = ann.remap(_surviving_rows(old_rows, dirty, len(old_ids))).add(tfidf_matrix, dirty_rows)
+    elif n >= ANN_MIN_ROWS:
+        ann = IVFIndex.build(tfidf_matrix)
+    if ann is not None:
+        arrays.update(ann.to_arrays())
+
+    df.to_csv(MODELS_DIR / "manga_indexed.csv", index=False)
+    print(f"Incremental build: {len(dirty_rows)} new or changed, {removed} removed, "
+          f"{recomputed} neighbour lists recomputed.")
+    return save_artifact(df, tfidf, tfidf_matrix, arrays, {'dense': False, 'rows_since_fit': rows_since_fit})
+
 
 if __name__ == "__main__":
-    build_and_save()
+    parser = argparse.ArgumentParser(description="Build the content-based models.")
+    parser.add_argument("--dense", action="store_true",
+                        help="store the full N x N similarity matrix instead of the top-k index")
+    parser.add_argument("--top-k", type=int, default=TOP_K,
+                        help="neighbours kept per title")
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE,
+                        help="rows per similarity block")
+    parser.add_argument("--approximate", action="store_true",
+                        help="find neighbours with the IVF index instead of exact block products")
+    parser.add_argument("--n-probe", type=int, default=None,
+                        help="IVF partitions probed per row with --approximate")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="processes computing similarity blocks (default: all cores)")
+    parser.add_argument("--max-memory", type=int, default=MAX_MEMORY_MB,
+                        help="MB of similarity blocks held at once; shrinks --block-size to fit")
+    parser.add_argument("--incremental", action="store_true",
+                        help="update the current artifact for new and changed titles only")
+    parser.add_argument("--refit-threshold", type=float, default=REFIT_THRESHOLD,
+                        help="fraction of changed titles since the last fit that forces a full rebuild")
+    args = parser.parse_args()
+    if args.incremental:
+        build_incremental(k=args.top_k, block_size=args.block_size, refit_threshold=args.refit_threshold,
+                          workers=args.workers, max_memory_mb=args.max_memory)
+    else:
+        build_and_save(dense=args.dense, k=args.top_k, block_size=args.block_size,
+                       approximate=args.approximate, n_probe=args.n_probe,
+                       workers=args.workers, max_memory_mb=args.max_memory)
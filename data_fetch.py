@@ -1,39 +1,332 @@
-import requests
+# data_fetch.py
+"""
+Fetch the manga catalog from the Jikan API into Data/Raw/manga.csv.
+
+Requests share one pooled session and two token buckets, one per second and one per
+minute, so as many pages are in flight as the API limits allow. Failed requests are
+retried with exponential backoff (honouring Retry-After). Every finished page is
+appended to a JSONL log next to a small checkpoint file holding the run settings and
+page count, so an interrupted run picks up where it stopped.
+
+With --incremental, pages are read newest-first (order_by=mal_id desc) and the run stops
+at the first page whose titles are all unchanged from the existing CSV, so a routine
+refresh only pulls the titles added since the last run (plus any edits on the pages it
+reads; a full run picks up edits to older titles).
+
+Point --base-url at a local stub server to test without hitting the real API.
+"""
+import argparse
+import json
+import os
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
 import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
 
-save_path = "Data/raw/manga.csv"
-
-def fetch_manga(page):
-    url=f"https://api.jikan.moe/v4/manga?page={page}&limit=25"
-    response = requests.get(url)
-    response.raise_for_status()
-    data = response.json()["data"]
-    
-    records = []
-    for item in data:
-        records.append({
-            "id":item["mal_id"],
-            "title": item["title"],
-            "synopsis": item.get("synopsis", ""),
-            "genres": " ".join([g["name"] for g in item.get("genres", [])]),
-            "score": item.get("score", 0),
-            "image_url": item["images"]["jpg"]["image_url"]
-        })
-    df = pd.DataFrame(records)
-    return df
+BASE_URL = "https://api.jikan.moe/v4"
+SAVE_PATH = Path("Data/Raw/manga.csv")
+CHECKPOINT_PATH = SAVE_PATH.with_name(".manga_fetch_checkpoint.json")
+COLUMNS = ["id", "title", "synopsis", "genres", "score", "image_url"]
 
-if __name__ == "__main__":
-    for i in range(1,40):
-        print(f"getting page {i}")
-        page_df= fetch_manga(i)
-        if i == 1:
-            # For the first page, write with the header
-            page_df.to_csv(save_path, index=False, mode='w', header=True)
+PAGE_SIZE = 25
+MAX_PAGES = 39
+# Jikan allows 3 requests per second and 60 per minute
+RATE_PER_SECOND = 3.0
+RATE_PER_MINUTE = 60
+BURST = 3
+MAX_WORKERS = 3
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0   # seconds; doubled on every retry
+BACKOFF_MAX = 30.0
+TIMEOUT = 15
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, at most `capacity` banked."""
+
+    def __init__(self, rate=RATE_PER_SECOND, capacity=BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then take it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Drain the bucket so no request goes out for `seconds` (e.g. after a 429)."""
+        with self._lock:
+            self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+class RateLimit:
+    """
+    Several token buckets enforced together; a request needs a token from each.
+
+    The per-minute bucket refills at (per_minute - burst) / 60 tokens a second with room
+    for `burst`, so no 60-second window sees more than per_minute requests.
+    """
+
+    def __init__(self, rate=RATE_PER_SECOND, per_minute=RATE_PER_MINUTE, burst=BURST):
+        self.buckets = [TokenBucket(rate, burst)]
+        if per_minute:
+            self.buckets.append(TokenBucket(max(per_minute - burst, 1) / 60, burst))
+
+    def acquire(self):
+        for bucket in self.buckets:
+            bucket.acquire()
+
+    def pause(self, seconds):
+        for bucket in self.buckets:
+            bucket.pause(seconds)
+
+
+def make_session(pool_size=MAX_WORKERS):
+    """One keep-alive session whose connection pool fits every worker."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["User-Agent"] = "manga-recommendation-system/data_fetch"
+    return session
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+
+
+def get_json(session, bucket, url, params, max_retries=MAX_RETRIES):
+    """GET `url` under the rate limit, retrying connection errors, 429 and 5xx."""
+    for attempt in range(max_retries + 1):
+        bucket.acquire()
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * (0.5 + random.random() / 2)
+        try:
+            response = session.get(url, params=params, timeout=TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
         else:
-            # For all other pages, append without the header
-            page_df.to_csv(save_path, index=False, mode='a', header=False)
-        
-        # --- RESPECT THE API RATE LIMIT ---
-        print("Waiting 1 second before next request...")
-        time.sleep(1) 
\ No newline at end of file
+            if response.status_code not in RETRY_STATUS:
+                response.raise_for_status()
+                return response.json()
+            error = requests.HTTPError(f"{response.status_code} for {response.url}", response=response)
+            if response.status_code == 429:
+                delay = max(delay, _retry_after(response) or 0)
+                # The drained bucket holds back every worker, this one included: the next
+                # acquire() does the waiting, so there is no sleep on top of it
+                bucket.pause(delay)
+        if attempt == max_retries:
+            raise error
+        print(f"{error}; retrying in {delay:.1f}s")
+        if not (isinstance(error, requests.HTTPError) and error.response.status_code == 429):
+            time.sleep(delay)
+
+
+def parse_manga(item):
+    return {
+        "id": item["mal_id"],
+        "title": item["title"],
+        "synopsis": item.get("synopsis") or "",
+        "genres": " ".join([g["name"] for g in item.get("genres", [])]),
+        "score": item.get("score") or 0,
+        "image_url": item["images"]["jpg"]["image_url"],
+    }
+
+
+def fetch_page(session, bucket, page, base_url=BASE_URL, incremental=False):
+    """Return (records, last_page) for one page of /manga."""
+    params = {"page": page, "limit": PAGE_SIZE}
+    if incremental:
+        params.update({"order_by": "mal_id", "sort": "desc"})
+    payload = get_json(session, bucket, f"{base_url.rstrip('/')}/manga", params)
+    last_page = payload.get("pagination", {}).get("last_visible_page", page)
+    return [parse_manga(item) for item in payload["data"]], last_page
+
+
+# --- Checkpoints ---
+
+def _pages_path(path):
+    return path.with_suffix(".pages.jsonl")
+
+
+def load_checkpoint(path, run_key):
+    """
+    State of an interrupted run with the same settings: ({page: records}, last_page).
+    Returns ({}, None) if there is nothing to resume.
+    """
+    if not path.exists():
+        return {}, None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("run") != run_key or not _pages_path(path).exists():
+        return {}, None
+    pages, good = {}, 0
+    with open(_pages_path(path), "rb+") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # The run stopped while writing this line; cut it so new pages append cleanly
+                f.truncate(good)
+                break
+            pages[entry["page"]] = entry["records"]
+            good += len(line)
+    return pages, checkpoint["last_page"]
+
+
+def save_checkpoint(path, run_key, last_page):
+    """Write the run settings and page count; the pages themselves go through append_page."""
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump({"run": run_key, "last_page": last_page}, f)
+    os.replace(tmp, path)
+
+
+def append_page(path, page, records):
+    """Append one fetched page to the run's log: O(page) I/O, however many pages came before."""
+    with open(_pages_path(path), "a") as f:
+        f.write(json.dumps({"page": page, "records": records}) + "\n")
+
+
+def clear_checkpoint(path):
+    path.unlink(missing_ok=True)
+    _pages_path(path).unlink(missing_ok=True)
+
+
+# --- Change detection ---
+
+def _fingerprint(record):
+    score = record.get("score")
+    score = 0.0 if score is None or pd.isna(score) else float(score)
+    return tuple(
+        score if col == "score" else ("" if pd.isna(record.get(col)) else str(record.get(col)))
+        for col in COLUMNS
+    )
+
+
+def load_existing(path):
+    """{id: fingerprint} of the rows already saved."""
+    if not path.exists():
+        return {}
+    df = pd.read_csv(path)
+    return {int(row["id"]): _fingerprint(row) for row in df.to_dict(orient="records")}
+
+
+def is_unchanged(records, existing):
+    return bool(records) and all(existing.get(r["id"]) == _fingerprint(r) for r in records)
+
+
+def save_catalog(path, pages):
+    """Merge fetched pages into the CSV (fetched rows win) and replace it atomically."""
+    fetched = pd.DataFrame([r for p in sorted(pages) for r in pages[p]], columns=COLUMNS)
+    if path.exists():
+        fetched = pd.concat([fetched, pd.read_csv(path)], ignore_index=True)
+    df = fetched.drop_duplicates("id", keep="first")
+    tmp = path.with_suffix(".tmp")
+    df.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+    return len(df)
+
+
+def fetch_catalog(base_url=BASE_URL, save_path=SAVE_PATH, max_pages=MAX_PAGES, incremental=False,
+                  workers=MAX_WORKERS, rate=RATE_PER_SECOND, per_minute=RATE_PER_MINUTE,
+                  checkpoint_path=CHECKPOINT_PATH):
+    """
+    Fetch up to `max_pages` pages (0 = all) and merge them into `save_path`.
+    Returns the number of pages fetched in this run.
+    """
+    save_path, checkpoint_path = Path(save_path), Path(checkpoint_path)
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    run_key = {"base_url": base_url, "incremental": incremental, "max_pages": max_pages}
+    pages, last_page = load_checkpoint(checkpoint_path, run_key)
+    if pages:
+        print(f"Resuming: {len(pages)} pages already fetched")
+    else:
+        # Start a fresh log; whatever is there belongs to another run
+        clear_checkpoint(checkpoint_path)
+        save_checkpoint(checkpoint_path, run_key, last_page)
+    existing = load_existing(save_path) if incremental else {}
+
+    session = make_session(workers)
+    bucket = RateLimit(rate, per_minute, burst=max(1, min(BURST, workers)))
+    lock = threading.Lock()
+    fetched = 0
+
+    def fetch(page):
+        nonlocal fetched, last_page
+        records, reported_last = fetch_page(session, bucket, page, base_url, incremental)
+        with lock:
+            pages[page] = records
+            fetched += 1
+            if last_page is None:
+                # Saved before the first page, so a logged page always comes with a page count
+                last_page = reported_last
+                save_checkpoint(checkpoint_path, run_key, last_page)
+            append_page(checkpoint_path, page, records)
+        print(f"got page {page} ({len(records)} titles)")
+
+    # Page 1 tells us how many pages there are
+    if 1 not in pages:
+        fetch(1)
+    if incremental and is_unchanged(pages[1], existing):
+        last_page = 1
+    last_page = min(last_page, max_pages) if max_pages else last_page
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        page = 2
+        while page <= last_page:
+            # Incremental runs go a window at a time so they can stop at the first unchanged page
+            window = range(page, min(page + (workers if incremental else last_page), last_page + 1))
+            todo = [p for p in window if p not in pages]
+            list(pool.map(fetch, todo))
+            page = window.stop
+            if incremental and any(is_unchanged(pages[p], existing) for p in window):
+                break
+            if any(not pages[p] for p in window):
+                break  # ran past the end of the catalog
+
+    total = save_catalog(save_path, pages)
+    clear_checkpoint(checkpoint_path)
+    print(f"Fetched {fetched} pages; {total} titles in {save_path}")
+    return fetched
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch the manga catalog from the Jikan API.")
+    parser.add_argument("--base-url", default=BASE_URL,
+                        help="API root, e.g. a local stub server for testing")
+    parser.add_argument("--output", type=Path, default=SAVE_PATH,
+                        help="CSV to create or update")
+    parser.add_argument("--pages", type=int, default=MAX_PAGES,
+                        help="maximum pages to fetch (0 = all)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="newest first; stop at the first page with no new or changed titles")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help="requests in flight")
+    parser.add_argument("--rate", type=float, default=RATE_PER_SECOND,
+                        help="requests per second")
+    parser.add_argument("--per-minute", type=int, default=RATE_PER_MINUTE,
+                        help="requests per minute (0 = no per-minute limit)")
+    args = parser.parse_args()
+    fetch_catalog(base_url=args.base_url, save_path=args.output, max_pages=args.pages,
+                  incremental=args.incremental, workers=args.workers, rate=args.rate,
+                  per_minute=args.per_minute, checkpoint_path=args.output.with_name(f".{args.output.stem}_fetch_checkpoint.json"))
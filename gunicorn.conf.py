@@ -0,0 +1,21 @@
+# gunicorn.conf.py
+"""
+Gunicorn settings, read automatically by `gunicorn wsgi:app`.
+
+By default every worker creates the app itself and loads the content model on the
+first request that needs it, so a worker serves /auth/login or /healthz as soon as it
+has started. With MODELS_PRELOAD=1 the app and the model are loaded once in the master
+instead (preload_app) and forked into the workers, which then start ready to
+recommend and share the loaded memory copy-on-write.
+"""
+import os
+
+preload_app = os.environ.get("MODELS_PRELOAD") == "1"
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from app import reset_after_fork
+        from wsgi import app
+
+        reset_after_fork(app)
@@ -0,0 +1,121 @@
+# preprocess.py
+"""
+Clean the raw catalog (Data/Raw/manga.csv) into a typed columnar catalog.
+
+The CSV is streamed in chunks, each chunk is normalised the same way as the exploration
+notebook did it (multi-word genres joined with underscores, rows without genres or a
+synopsis dropped, the MAL rewrite credit stripped, missing scores set to 0), and written
+straight to an artifact (app/artifacts.py) under Data/Processed/catalog/:
+
+    ids         int32
+    score       float32
+    genre_bits  uint64 bitset, bit i = meta['genre_names'][i]
+    title, genres, synopsis, image_url
+                string columns (offsets + UTF-8), kept apart from the numeric columns
+
+build_models.py reads this catalog when it exists; loading it is one memory-map per
+column instead of parsing a CSV into object columns.
+"""
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from app.artifacts import ArtifactWriter, open_artifact, prune
+from app.genres import MAX_GENRES, join_genre_phrases
+
+RAW_PATH = Path("Data/Raw/manga.csv")
+CATALOG_DIR = Path("Data/Processed/catalog")
+CSV_PATH = Path("Data/Processed/processed_manga.csv")
+CHUNK_SIZE = 10_000
+
+MAL_CREDIT = "[Written by MAL Rewrite]"
+STRING_COLUMNS = ['title', 'genres', 'synopsis', 'image_url']
+
+
+def normalize_chunk(chunk):
+    """Clean one chunk of raw rows; returns a new DataFrame."""
+    chunk = chunk.copy()
+    chunk['genres'] = chunk['genres'].map(join_genre_phrases, na_action='ignore')
+    chunk = chunk.dropna(subset=['genres', 'synopsis'])
+    chunk['synopsis'] = chunk['synopsis'].str.removesuffix(MAL_CREDIT).str.strip()
+    chunk['score'] = pd.to_numeric(chunk['score'], errors='coerce').fillna(0)
+    chunk['title'] = chunk['title'].fillna('').astype(str)
+    chunk['image_url'] = chunk['image_url'].fillna('').astype(str)
+    return chunk
+
+
+def genre_bitsets(genres, genre_codes):
+    """uint64 bitset per row; new genre names are given the next free bit."""
+    bits = np.zeros(len(genres), dtype=np.uint64)
+    for row, names in enumerate(genres):
+        for name in names.split():
+            code = genre_codes.setdefault(name, len(genre_codes))
+            if code >= MAX_GENRES:
+                raise ValueError(f"More than {MAX_GENRES} genres; genre_bits cannot hold '{name}'")
+            bits[row] |= np.uint64(1) << np.uint64(code)
+    return bits
+
+
+def preprocess(raw_path=RAW_PATH, catalog_dir=CATALOG_DIR, chunk_size=CHUNK_SIZE, csv_path=None):
+    """Stream `raw_path` into a new catalog version; returns the version id."""
+    genre_codes = {}
+    seen_ids = set()
+    dropped = 0
+    with ArtifactWriter(catalog_dir) as writer:
+        for i, chunk in enumerate(pd.read_csv(raw_path, chunksize=chunk_size)):
+            cleaned = normalize_chunk(chunk)
+            # The API can return a title on two pages; keep its first occurrence
+            cleaned = cleaned[~cleaned['id'].isin(seen_ids)].drop_duplicates('id')
+            seen_ids.update(cleaned['id'].tolist())
+            dropped += len(chunk) - len(cleaned)
+
+            writer.append(
+                arrays={
+                    'ids': cleaned['id'].to_numpy(dtype=np.int32),
+                    'score': cleaned['score'].to_numpy(dtype=np.float32),
+                    'genre_bits': genre_bitsets(cleaned['genres'].tolist(), genre_codes),
+                },
+                strings={col: cleaned[col].tolist() for col in STRING_COLUMNS},
+            )
+            if csv_path is not None:
+                cleaned[['id', 'title', 'synopsis', 'genres', 'score', 'image_url']].to_csv(
+                    csv_path, index=False, mode='w' if i == 0 else 'a', header=i == 0
+                )
+        version = writer.commit(meta={
+            'rows': writer.rows,
+            'genre_names': sorted(genre_codes, key=genre_codes.get),
+            'source': str(raw_path),
+        })
+    prune(catalog_dir, keep=3)
+    print(f"Wrote {writer.rows} titles ({dropped} dropped) to {catalog_dir}/{version}")
+    return version
+
+
+def load_catalog(catalog_dir=CATALOG_DIR):
+    """The current catalog as a DataFrame, or None if preprocess has not been run."""
+    catalog = open_artifact(catalog_dir)
+    if catalog is None:
+        return None
+    df = pd.DataFrame({
+        'id': catalog.array('ids'),
+        'score': catalog.array('score'),
+        'genre_bits': catalog.array('genre_bits'),
+    })
+    for col in STRING_COLUMNS:
+        df[col] = catalog.strings(col).tolist()
+    df.attrs['genre_names'] = catalog.meta['genre_names']
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clean the raw catalog into the columnar catalog.")
+    parser.add_argument("--input", type=Path, default=RAW_PATH)
+    parser.add_argument("--output", type=Path, default=CATALOG_DIR)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="raw rows held in memory at once")
+    parser.add_argument("--csv", action="store_true",
+                        help=f"also write {CSV_PATH} for the notebooks")
+    args = parser.parse_args()
+    preprocess(args.input, args.output, args.chunk_size, csv_path=CSV_PATH if args.csv else None)
@@ -0,0 +1,30 @@
+import pytest
+
+from app import collaborative, create_app, trainer
+from app.database import db
+from app.models import User
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # models/cf and other relative artifact paths resolve inside the test's directory
+    monkeypatch.chdir(tmp_path)
+    collaborative.set_cf_model(None)
+    monkeypatch.setattr(trainer, '_last_refresh_check', 0.0)
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'manga.db'}", 'TESTING': True})
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+    collaborative.set_cf_model(None)
+
+
+@pytest.fixture
+def make_user(app):
+    def make_user(username):
+        # Tests log in through the session, so the (slow) bcrypt hash is skipped
+        user = User(username=username, email=f"{username}@example.com", password_hash="!")
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+    return make_user
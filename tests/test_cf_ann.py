@@ -0,0 +1,34 @@
+import numpy as np
+
+from app.ann import IVFIndex
+from app.collaborative import get_cf_recommendations_batch
+
+
+def _model(n_users=50, n_items=3000, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    U = rng.standard_normal((n_users, dim)).astype(np.float32)
+    sigma_Vt = rng.standard_normal((dim, n_items)).astype(np.float32)
+    rated = [rng.choice(n_items, 20, replace=False) for _ in range(n_users)]
+    return {
+        'U': U, 'sigma_Vt': sigma_Vt, 'rated': rated,
+        'user_map': {uid: row for row, uid in enumerate(range(100, 100 + n_users))},
+        'item_ids': np.arange(10_000, 10_000 + n_items, dtype=np.int64),
+        'ann': IVFIndex.build(sigma_Vt.T),
+    }
+
+
+def test_ann_batch_matches_exact_when_every_list_is_probed():
+    model = _model()
+    users = list(model['user_map']) + [999]
+    exact = get_cf_recommendations_batch(users, top_n=10, model=model, use_ann=False)
+    approx = get_cf_recommendations_batch(users, top_n=10, model=model, n_probe=model['ann'].n_lists)
+    assert [[mid for mid, _ in r] for r in approx] == [[mid for mid, _ in r] for r in exact]
+    assert approx[-1] == []
+
+
+def test_ann_batch_never_returns_rated_items():
+    model = _model()
+    users = list(model['user_map'])
+    for uid, recs in zip(users, get_cf_recommendations_batch(users, top_n=50, model=model)):
+        rated_ids = set(model['item_ids'][model['rated'][model['user_map'][uid]]].tolist())
+        assert len(recs) == 50 and not rated_ids & {mid for mid, _ in recs}
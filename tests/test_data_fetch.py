@@ -0,0 +1,133 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pytest
+import requests
+
+import data_fetch
+from data_fetch import RateLimit, fetch_catalog
+
+
+class StubJikan:
+    """A /manga endpoint over `n_titles` ids with scripted failures, recording every request."""
+
+    def __init__(self, n_titles):
+        self.n_titles = n_titles
+        self.requests = []      # (page, monotonic time)
+        self.fail = {}          # page -> status to return while the page is "down"
+        self.throttle_once = set()
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub.handle(self)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def pages_requested(self):
+        return [page for page, _ in self.requests]
+
+    def handle(self, handler):
+        query = parse_qs(urlparse(handler.path).query)
+        page, limit = int(query["page"][0]), int(query["limit"][0])
+        with self.lock:
+            self.requests.append((page, time.monotonic()))
+            status = self.fail.get(page)
+            if page in self.throttle_once:
+                self.throttle_once.discard(page)
+                status = 429
+        if status:
+            handler.send_response(status)
+            if status == 429:
+                handler.send_header("Retry-After", "0.3")
+            handler.send_header("Content-Length", "2")
+            handler.end_headers()
+            handler.wfile.write(b"{}")
+            return
+        ids = list(range(1, self.n_titles + 1))
+        if query.get("sort") == ["desc"]:
+            ids.reverse()
+        data = [{"mal_id": i, "title": f"Title {i}", "synopsis": "", "genres": [{"name": "Action"}],
+                 "score": 7.0, "images": {"jpg": {"image_url": f"http://img/{i}.jpg"}}}
+                for i in ids[(page - 1) * limit:page * limit]]
+        body = json.dumps({"pagination": {"last_visible_page": -(-self.n_titles // limit)},
+                           "data": data}).encode()
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+@pytest.fixture
+def stub():
+    server = StubJikan(n_titles=5 * data_fetch.PAGE_SIZE)
+    yield server
+    server.server.shutdown()
+    server.server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(data_fetch, "BACKOFF_BASE", 0.01)
+
+
+def _fetch(stub, tmp_path, **kwargs):
+    kwargs = {"max_pages": 0, "workers": 1, "rate": 1000.0, "per_minute": 0, **kwargs}
+    return fetch_catalog(base_url=stub.url, save_path=tmp_path / "manga.csv",
+                         checkpoint_path=tmp_path / ".checkpoint.json", **kwargs)
+
+
+def test_per_minute_bucket_limits_past_the_burst():
+    # 20 tokens a second after a burst of 3: four more acquires take ~0.2 s
+    limit = RateLimit(rate=1000.0, per_minute=3 + 20 * 60, burst=3)
+    start = time.monotonic()
+    for _ in range(7):
+        limit.acquire()
+    assert time.monotonic() - start >= 0.15
+
+    unlimited = RateLimit(rate=1000.0, per_minute=0, burst=3)
+    assert len(unlimited.buckets) == 1
+
+
+def test_retry_after_holds_back_the_next_request(stub, tmp_path):
+    stub.throttle_once.add(2)
+    _fetch(stub, tmp_path)
+    (_, throttled), (_, retried) = [r for r in stub.requests if r[0] == 2]
+    assert retried - throttled >= 0.3
+    assert len(pd.read_csv(tmp_path / "manga.csv")) == stub.n_titles
+
+
+def test_interrupted_run_resumes_from_checkpoint(stub, tmp_path):
+    stub.fail[3] = 500
+    with pytest.raises(requests.HTTPError):
+        _fetch(stub, tmp_path)
+    assert not (tmp_path / "manga.csv").exists()
+
+    del stub.fail[3]
+    stub.requests.clear()
+    _fetch(stub, tmp_path)
+    # Pages logged before the failure are not fetched again (4 may or may not have made it)
+    assert stub.pages_requested()[0] == 3 and set(stub.pages_requested()) <= {3, 4, 5}
+    assert len(pd.read_csv(tmp_path / "manga.csv")) == stub.n_titles
+    assert not (tmp_path / ".checkpoint.json").exists()
+
+
+def test_incremental_run_stops_at_first_unchanged_page(stub, tmp_path):
+    _fetch(stub, tmp_path)
+    stub.n_titles += 3
+    stub.requests.clear()
+    _fetch(stub, tmp_path, incremental=True)
+    # Page 1 holds the 3 new titles; page 2 is all known titles, so the run stops there
+    assert stub.pages_requested() == [1, 2]
+    assert len(pd.read_csv(tmp_path / "manga.csv")) == stub.n_titles
@@ -0,0 +1,20 @@
+import pandas as pd
+
+from app.genres import GenreIndex
+from preprocess import normalize_chunk
+
+GENRES = ["Boys Love Drama", "Slice of Life Comedy", "Drama", "Boys_Love Romance"]
+
+
+def test_multi_word_genres_are_single_genres():
+    index = GenreIndex.from_strings(GENRES)
+    assert index.mask(include=["Boys Love"]).tolist() == [True, False, False, True]
+    assert index.mask(include=["slice of life"]).tolist() == [False, True, False, False]
+    assert index.mask(exclude=["Boys Love"]).tolist() == [False, True, True, False]
+    assert "Love" not in index.names and "Life" not in index.names
+
+
+def test_preprocess_joins_genres_the_same_way():
+    raw = pd.DataFrame({"genres": GENRES[:2] + [None], "synopsis": ["s", "s", "s"],
+                        "score": [1, 2, 3], "title": ["a", "b", "c"], "image_url": ["", "", ""]})
+    assert normalize_chunk(raw)["genres"].tolist() == ["Boys_Love Drama", "Slice_of_Life Comedy"]
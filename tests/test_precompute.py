@@ -0,0 +1,51 @@
+import numpy as np
+
+from app.database import db
+from app.models import Rating, UserRecommendations
+from app.precompute import _write_chunk, ratings_hashes
+from app.ratings import export_ratings, upsert_ratings
+
+
+def _chunk(user_ids):
+    """A scored chunk as the pool returns it: (users, ...) plus one (ids, scores) list per user."""
+    results = [(np.array([10, 11], dtype=np.int32), np.array([0.9, 0.8], dtype=np.float32)) for _ in user_ids]
+    return (np.asarray(user_ids, dtype=np.int64),), results
+
+
+def _stored_users():
+    return {row.user_id for row in UserRecommendations.query.all()}
+
+
+def test_write_chunk_drops_users_whose_ratings_changed_during_the_run(app, make_user):
+    edited, deleted, rated, untouched = (make_user(name) for name in ("edited", "deleted", "rated", "untouched"))
+    for user_id in (edited, deleted, rated, untouched):
+        upsert_ratings(user_id, {1: 4, 2: 2})
+    # The job hashes the ratings it scores at the start of the run...
+    user_ids, hashes = ratings_hashes(export_ratings())
+    user_hashes = dict(zip(user_ids.tolist(), hashes.tolist()))
+
+    # ...then, while it scores, users edit on the dashboard, delete and rate
+    rating = Rating.query.filter_by(user_id=edited, manga_id=1).one()
+    rating.rating = 1
+    db.session.commit()
+    db.session.delete(Rating.query.filter_by(user_id=deleted, manga_id=2).one())
+    db.session.commit()
+    upsert_ratings(rated, {3: 5})
+
+    chunk, results = _chunk([edited, deleted, rated, untouched])
+    _write_chunk(chunk, results, user_hashes)
+
+    assert _stored_users() == {untouched}
+    stored = db.session.get(UserRecommendations, untouched)
+    assert np.frombuffer(stored.manga_ids, dtype=np.int32).tolist() == [10, 11]
+
+
+def test_write_chunk_replaces_unchanged_users_rows(app, make_user):
+    user_id = make_user("reader")
+    upsert_ratings(user_id, {1: 5})
+    user_ids, hashes = ratings_hashes(export_ratings())
+    user_hashes = dict(zip(user_ids.tolist(), hashes.tolist()))
+
+    for _ in range(2):
+        _write_chunk(*_chunk([user_id]), user_hashes)
+    assert UserRecommendations.query.count() == 1
@@ -0,0 +1,58 @@
+import sqlite3
+
+from app import create_app
+from app.database import db
+from app.models import Rating
+from app.ratings import check_schema, upsert_ratings, user_ratings_version
+
+
+def test_version_changes_on_insert_edit_and_delete(app, make_user):
+    user_id = make_user("reader")
+    upsert_ratings(user_id, {1: 4, 2: 3})
+    inserted = user_ratings_version(user_id)
+
+    rating = Rating.query.filter_by(user_id=user_id, manga_id=1).one()
+    rating.rating = 2
+    db.session.commit()
+    edited = user_ratings_version(user_id)
+    assert edited != inserted
+
+    upsert_ratings(user_id, {1: 5})
+    upserted = user_ratings_version(user_id)
+    assert upserted != edited
+
+    db.session.delete(Rating.query.filter_by(user_id=user_id, manga_id=2).one())
+    db.session.commit()
+    assert user_ratings_version(user_id) != upserted
+
+
+def test_edit_rating_route_changes_version(app, make_user):
+    user_id = make_user("editor")
+    upsert_ratings(user_id, {1: 4})
+    before = user_ratings_version(user_id)
+    rating_id = Rating.query.filter_by(user_id=user_id).one().id
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+    response = client.post(f"/edit_rating/{rating_id}", data={'rating': 1})
+
+    assert response.status_code == 302
+    assert db.session.get(Rating, rating_id).rating == 1
+    assert user_ratings_version(user_id) != before
+
+
+def test_startup_migrates_an_old_database(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / 'old.db'
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE rating (id INTEGER PRIMARY KEY, user_id INTEGER, manga_id INTEGER, "
+                     "rating FLOAT, timestamp DATETIME)")
+        conn.executemany("INSERT INTO rating (user_id, manga_id, rating) VALUES (?, ?, ?)",
+                         [(1, 5, 3.0), (1, 5, 4.0)])
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{path}", 'TESTING': True})
+    with app.app_context():
+        assert check_schema() == []
+        upsert_ratings(1, {5: 5.0})
+        assert db.session.execute(db.text("SELECT rating FROM rating")).scalars().all() == [5.0]
+        db.engine.dispose()
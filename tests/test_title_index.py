@@ -0,0 +1,30 @@
+from app.title_index import PREFIX, SUBSTRING, TitleIndex
+
+TITLES = ["Agharta", "Ai Kora", "Akira", "Berserk", "Monster", "Naruto", "One", "One Piece", "X", "X: Kai"]
+
+
+def _titles(index, query, limit=10):
+    return [index.titles[row] for row, _, _ in index.search(query, limit=limit)]
+
+
+def test_prefix_matches_rank_by_similarity_not_alphabetically():
+    # Many earlier-sorting prefix matches must not crowd out the best one
+    index = TitleIndex([f"Aardvark Chronicles {i:03d}" for i in range(100)] + ["Ab"])
+    assert _titles(index, "a", limit=1) == ["Ab"]
+    assert index.lookup("a") == ("Ab", 100)
+
+
+def test_short_queries_use_the_gram_index():
+    index = TitleIndex(TITLES)
+    assert set(_titles(index, "er")) == {"Berserk", "Monster"}
+    assert {tier for _, tier, _ in index.search("er")} == {SUBSTRING}
+    assert _titles(index, "on")[:2] == ["One", "One Piece"]
+    assert index.search("on")[0][1] == PREFIX
+    assert index.lookup(TITLES[0][:2]) == ("Agharta", 0)
+
+
+def test_unrelated_short_query_does_not_resolve():
+    index = TitleIndex(TITLES)
+    assert index.lookup("xq") == (None, None)
+    assert _titles(index, "xq") == []
+    assert index.lookup("narto") == ("Naruto", 5)
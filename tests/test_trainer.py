@@ -0,0 +1,47 @@
+import numpy as np
+
+from app import collaborative
+from app.ratings import upsert_ratings
+from app.trainer import on_ratings_changed, refresh_cf_model, train_and_publish
+
+
+def _rate(user_ids, seed):
+    rng = np.random.default_rng(seed)
+    for user_id in user_ids:
+        mangas = rng.choice(30, size=8, replace=False)
+        upsert_ratings(user_id, {int(m) + 1: int(rng.integers(1, 6)) for m in mangas})
+
+
+def test_request_path_rebuild_survives_the_next_refresh(app, make_user):
+    first = [make_user(f"early{i}") for i in range(40)]
+    _rate(first, seed=0)
+    published = train_and_publish()
+    assert len(collaborative.cf_model['user_map']) == 40
+
+    # Trainer thread off (the default): the drift limit triggers a rebuild in the request
+    later = [make_user(f"late{i}") for i in range(40)]
+    _rate(later, seed=1)
+    for user_id in later:
+        on_ratings_changed(user_id)
+    rebuilt = collaborative.cf_model
+    assert len(rebuilt['user_map']) == 80
+    assert rebuilt['version'] not in (None, published)
+
+    assert refresh_cf_model(force=True) is rebuilt
+
+
+def test_refresh_keeps_an_unpublished_model_trained_on_newer_ratings(app, make_user):
+    users = [make_user(f"user{i}") for i in range(40)]
+    _rate(users[:30], seed=0)
+    train_and_publish()
+
+    # Rebuilt in memory only (e.g. models/cf is read-only), after more ratings came in
+    _rate(users[30:], seed=1)
+    collaborative.publish_cf_model(collaborative.train_cf_model())
+    assert refresh_cf_model(force=True)['version'] is None
+    assert len(collaborative.cf_model['user_map']) == 40
+
+    # A published model that covers those ratings replaces it
+    version = train_and_publish(force=True)
+    collaborative.set_cf_model({**collaborative.cf_model, 'version': None})
+    assert refresh_cf_model(force=True)['version'] == version